@@ -1,5 +1,17 @@
 """File handling."""
 import csv
+import mmap
+import os
+import re
+import tempfile
+from array import array
+from collections.abc import Iterable, Sequence
+from contextlib import contextmanager
+
+INDEX_SUFFIX = ".idx"
+MISSING_FIELD = "-"
+WRITE_BUFFER_SIZE = 1 << 20
+LINE_BREAK_PATTERN = re.compile(rb"\r\n?|\n")
 
 
 def read_file_contents(filename: str) -> str:
@@ -36,6 +48,153 @@ def read_file_contents_to_list(filename: str) -> list[str]:
         return lines
 
 
+class LineIndex(Sequence):
+    r"""
+    Lines of a file read from a memory map by their start offsets.
+
+    The offsets are found once (or loaded from a saved .idx file), and a line is decoded only when it is
+    asked for, so even a very large file can be used without reading it into memory:
+
+    with LineIndex("big.log") as lines:
+        lines.save()
+        print(len(lines), lines[0], lines[-1], lines[10:20], lines.get_csv_row(5))
+
+    Lines end with "\n", "\r\n" or "\r", and the line breaks are removed from the lines like in
+    read_file_contents_to_list(), which reads the file in universal newlines mode.
+    CSV rows are read line by line, so quoted fields must not contain line breaks.
+    """
+
+    def __init__(self, filename: str, encoding: str = "utf-8", index_filename: str | None = None):
+        """
+        Map the file and load the offsets of the lines from the index file or find them.
+
+        :param filename: The name of the file to read.
+        :param encoding: The encoding of the file.
+        :param index_filename: The index file saved with save(), by default filename + ".idx". The index is
+            only used if the size and modification time of the file are the same as when it was saved.
+        """
+        self.filename = filename
+        self.encoding = encoding
+        self.index_filename = index_filename or filename + INDEX_SUFFIX
+        self.index_map = None
+        self.index_view = None
+
+        with open(filename, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.signature = (stat.st_size, stat.st_mtime_ns)
+            self.size = stat.st_size
+            # An empty file can not be mapped.
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+
+        self.offsets = self.load_offsets()
+        if self.offsets is None:
+            self.offsets = self.find_offsets()
+
+    def find_offsets(self) -> array:
+        r"""Return the start offsets of all the lines, a line break at the end of the file starts no new line.
+
+        A file without "\r" is searched for "\n" alone, which is faster than matching every kind of line break.
+        """
+        if not self.size:
+            return array("q")
+        if self.map.find(b"\r") == -1:
+            offsets = array("q", [0])
+            position = self.map.find(b"\n") + 1
+            while 0 < position < self.size:
+                offsets.append(position)
+                position = self.map.find(b"\n", position) + 1
+            return offsets
+        offsets = array("q", [0])
+        offsets.extend(match.end() for match in LINE_BREAK_PATTERN.finditer(self.map))
+        if offsets[-1] == self.size:
+            offsets.pop()
+        return offsets
+
+    def load_offsets(self):
+        """Return the offsets saved in the index file, or None if there is no index for this version of the file."""
+        try:
+            with open(self.index_filename, "rb") as f:
+                index_size = os.fstat(f.fileno()).st_size
+                if index_size < 16 or index_size % 8:
+                    return None
+                index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            return None
+
+        view = memoryview(index_map).cast("q")
+        if tuple(view[:2]) != self.signature:
+            view.release()
+            index_map.close()
+            return None
+        self.index_map = index_map
+        self.index_view = view
+        return view[2:]
+
+    def save(self) -> None:
+        """Save the offsets to the index file with the size and modification time of the file."""
+        if self.index_map is not None:
+            # The offsets were loaded from the index file, which must not be truncated while it is mapped.
+            return
+        with open(self.index_filename, "wb") as f:
+            array("q", self.signature).tofile(f)
+            f.write(self.offsets.tobytes())
+
+    def get_bytes(self, i: int) -> bytes:
+        """Return line i as bytes without the line break."""
+        start = self.offsets[i]
+        end = self.offsets[i + 1] if i + 1 < len(self.offsets) else self.size
+        line = self.map[start:end]
+        if line.endswith(b"\n"):
+            return line[:-2] if line.endswith(b"\r\n") else line[:-1]
+        if line.endswith(b"\r"):
+            return line[:-1]
+        return line
+
+    def get_csv_row(self, i: int, delimiter: str = ",") -> list[str]:
+        """Return line i as a row of CSV fields."""
+        return next(csv.reader([self[i]], delimiter=delimiter), [])
+
+    def iter_csv_rows(self, start: int = 0, stop: int | None = None, delimiter: str = ","):
+        """Yield the lines from start to stop as rows of CSV fields."""
+        lines = (self[i] for i in range(*slice(start, stop).indices(len(self))))
+        return csv.reader(lines, delimiter=delimiter)
+
+    def __getitem__(self, i):
+        """Return line i, or a list of the lines of a slice."""
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("line index out of range")
+        return self.get_bytes(i).decode(self.encoding)
+
+    def __len__(self) -> int:
+        """Return the number of lines."""
+        return len(self.offsets)
+
+    def close(self) -> None:
+        """Close the memory maps of the file and the index."""
+        if self.index_map is not None:
+            self.offsets.release()
+            self.index_view.release()
+            self.index_map.close()
+            self.index_view = None
+            self.index_map = None
+        self.offsets = array("q")
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+            self.map = b""
+
+    def __enter__(self):
+        """Return the index for a with statement."""
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """Close the index at the end of a with statement."""
+        self.close()
+
+
 def read_csv_file(filename: str, delimiter=',') -> list[list[str]]:
     """
     Read CSV file contents into a list of rows.
@@ -132,6 +291,106 @@ def write_csv_file(filename: str, data: list[list[str]]) -> None:
         csv_writer.writerows(data)
 
 
+def iter_csv_file(filename: str, delimiter=','):
+    """Yield the non-empty rows of a CSV file one at a time."""
+    with open(filename, 'r') as f:
+        for row in csv.reader(f, delimiter=delimiter):
+            if row:
+                yield row
+
+
+def split_row(row: list[str]) -> tuple[str, str]:
+    """Return the key (first field) and the value (second field or "-") of a row."""
+    return row[0], row[1] if len(row) > 1 else MISSING_FIELD
+
+
+def is_sorted_by_key(filename: str, delimiter=',') -> bool:
+    """Return True if the rows of the CSV file are in ascending order of their first field."""
+    previous = None
+    for row in iter_csv_file(filename, delimiter):
+        if previous is not None and row[0] < previous:
+            return False
+        previous = row[0]
+    return True
+
+
+def read_spilled_rows(spill):
+    """Yield (key, "-", value) for every (key, value) row written to the spill file."""
+    spill.seek(0)
+    for key, value in csv.reader(spill):
+        yield key, MISSING_FIELD, value
+
+
+def sort_merge_join(left_filename: str, right_filename: str, delimiter=','):
+    """Join two CSV files sorted by key, see join_csv_files(). Only the keys missing on the left are spilled."""
+    with tempfile.TemporaryFile('w+', newline='') as spill:
+        spill_writer = csv.writer(spill)
+        right_rows = map(split_row, iter_csv_file(right_filename, delimiter))
+        right = next(right_rows, None)
+        for key, left_value in map(split_row, iter_csv_file(left_filename, delimiter)):
+            while right is not None and right[0] < key:
+                spill_writer.writerow(right)
+                right = next(right_rows, None)
+            if right is not None and right[0] == key:
+                yield key, left_value, right[1]
+                right = next(right_rows, None)
+            else:
+                yield key, left_value, MISSING_FIELD
+        while right is not None:
+            spill_writer.writerow(right)
+            right = next(right_rows, None)
+        yield from read_spilled_rows(spill)
+
+
+def hash_join_on_left(left_filename: str, right_filename: str, delimiter=','):
+    """Join two CSV files by keeping the smaller left file in memory, see join_csv_files()."""
+    left = dict(map(split_row, iter_csv_file(left_filename, delimiter)))
+    matched = {}
+    with tempfile.TemporaryFile('w+', newline='') as spill:
+        spill_writer = csv.writer(spill)
+        for key, right_value in map(split_row, iter_csv_file(right_filename, delimiter)):
+            if key in left:
+                matched[key] = right_value
+            else:
+                spill_writer.writerow((key, right_value))
+        for key, left_value in left.items():
+            yield key, left_value, matched.get(key, MISSING_FIELD)
+        yield from read_spilled_rows(spill)
+
+
+def hash_join_on_right(left_filename: str, right_filename: str, delimiter=','):
+    """Join two CSV files by keeping the smaller right file in memory, see join_csv_files()."""
+    right = dict(map(split_row, iter_csv_file(right_filename, delimiter)))
+    for key, left_value in map(split_row, iter_csv_file(left_filename, delimiter)):
+        yield key, left_value, right.pop(key, MISSING_FIELD)
+    for key, right_value in right.items():
+        yield key, MISSING_FIELD, right_value
+
+
+def join_csv_files(left_filename: str, right_filename: str, delimiter=','):
+    """
+    Join two CSV files of (key, value) rows by key and yield (key, left value, right value) rows.
+
+    All keys of both files are included, a missing value is "-". The rows follow the order of the left file,
+    and the keys that are only in the right file follow in the order of the right file.
+    Keys are expected to be unique within each file.
+
+    If both files are sorted by key, they are merged side by side (sort-merge join) and nothing is kept in
+    memory. Otherwise the smaller file is kept in a dictionary and the larger one is read row by row
+    (hash join). Rows that have to be written after the others are kept in a temporary file.
+
+    :param left_filename: The name of the first CSV file.
+    :param right_filename: The name of the second CSV file.
+    :param delimiter: The delimiter of both files.
+    :return: A generator of (key, left value, right value) tuples.
+    """
+    if is_sorted_by_key(left_filename, delimiter) and is_sorted_by_key(right_filename, delimiter):
+        return sort_merge_join(left_filename, right_filename, delimiter)
+    if os.path.getsize(left_filename) <= os.path.getsize(right_filename):
+        return hash_join_on_left(left_filename, right_filename, delimiter)
+    return hash_join_on_right(left_filename, right_filename, delimiter)
+
+
 def merge_dates_and_towns_into_csv(dates_filename: str, towns_filename: str, csv_output_filename: str) -> None:
     """
     Merge information from two input CSV files into one output CSV file.
@@ -168,36 +427,20 @@ def merge_dates_and_towns_into_csv(dates_filename: str, towns_filename: str, csv
     Reuse CSV reading and writing functions.
     Note: When reading CSV files, specify the delimiter (improve existing method).
 
+    The files are joined with join_csv_files(), so they are read and written row by row and only the
+    smaller file (or nothing, if both are sorted by name) is kept in memory. Names are expected to be
+    unique within each file.
+
     :param dates_filename: The name of the CSV file with names and dates (name:date).
     :param towns_filename: The name of the CSV file with names and towns (name:town).
     :param csv_output_filename: The name of the CSV file to write to names, towns, and dates.
     :return: None
     """
-
-    class Person:
-        def __init__(self, name, date, town):
-            self.name = name
-            self.date = date
-            self.town = town
-
-    dates = read_csv_file(dates_filename, delimiter=':')
-    towns = read_csv_file(towns_filename, delimiter=':')
-    my_dict = {}
-
-    for date in dates:
-        my_dict[date[0]] = Person(date[0], date[1], "-")
-
-    for town in towns:
-        if town[0] in my_dict:
-            my_dict[town[0]].town = town[1]
-        else:
-            my_dict[town[0]] = Person(town[0], "-", town[1])
-
-    output_list = [["name", "town", "date"]]
-    for key, value in my_dict.items():
-        output_list.append([value.name, value.town, value.date])
-
-    write_csv_file(csv_output_filename, output_list)
+    with open(csv_output_filename, "w") as f:
+        csv_writer = csv.writer(f, delimiter=',')
+        csv_writer.writerow(["name", "town", "date"])
+        csv_writer.writerows((name, town, date) for name, date, town
+                             in join_csv_files(dates_filename, towns_filename, delimiter=':'))
 
 
 def read_csv_file_into_list_of_dicts(filename: str) -> list[dict[str, str]]:
@@ -245,7 +488,7 @@ def read_csv_file_into_list_of_dicts(filename: str) -> list[dict[str, str]]:
             return []
 
 
-def write_list_of_dicts_to_csv_file(filename: str, data: list[dict]) -> None:
+def write_list_of_dicts_to_csv_file(filename: str, data: Iterable[dict], header: list[str] | None = None) -> None:
     """
     Write a list of dictionaries to a CSV file.
 
@@ -265,36 +508,72 @@ def write_list_of_dicts_to_csv_file(filename: str, data: list[dict]) -> None:
     john,12,
     mary,,London
 
+    The data can also be any iterable of dictionaries, like a generator. Without a header all the rows
+    have to be read first to find the fields, so an iterator is made into a list. With a declared header
+    the rows are written as they come, in one pass and without keeping them.
+
     :param filename: The name of the file to write to.
-    :param data: List of dictionaries to write to the file.
+    :param data: List (or another iterable) of dictionaries to write to the file.
+    :param header: The fields in the order they are written. Every key of the rows has to be in the header,
+        otherwise ValueError is raised and the file is left as it was. With a header, the header line is
+        written even if there are no rows.
     :return: None
     """
-    keys = []
-    values = []
+    if header is None:
+        if not isinstance(data, Sequence):
+            data = list(data)
+        if not data:
+            with open(filename, 'w'):
+                return
+
+        # A dictionary keeps the keys in the order they are first seen.
+        keys = {}
+        for item in data:
+            keys.update(item)
+        header = list(keys)
+        rows = data
+    else:
+        rows = check_header_fields(data, set(header))
+
+    with open_replacement(filename, WRITE_BUFFER_SIZE) as f:
+        csv_writer = csv.writer(f, delimiter=',')
+        csv_writer.writerow(header)
+        csv_writer.writerows([item.get(key, "") for key in header] for item in rows)
 
-    # Get the keys.
-    for item in data:
-        for key in item:
-            if key not in keys:
-                keys.append(key)
 
-    # Get values according to keys.
-    for item in data:
-        item_values = []
+def get_umask() -> int:
+    """Return the file mode creation mask of the process."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
 
-        for key in keys:
-            if key in item:
-                item_values.append(item[key])
-            else:
-                item_values.append("")
 
-        values.append(item_values)
+@contextmanager
+def open_replacement(filename: str, buffering: int = -1):
+    """
+    Open a temporary file next to the file for writing, it replaces the file at the end of the with statement.
 
-    with open(filename, 'w') as f:
-        csv_writer = csv.writer(f, delimiter=',')
+    If the with statement raises an exception, the temporary file is removed and the file is left as it was.
+    The temporary file gets the permissions open() would give a new file.
 
-        if not data:
-            csv_writer.writerows("")
-        else:
-            csv_writer.writerow(keys)
-            csv_writer.writerows(values)
+    :param filename: The name of the file to replace.
+    :param buffering: The buffering of the temporary file, see open().
+    """
+    directory, name = os.path.split(os.path.abspath(filename))
+    fd, temporary_filename = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=directory)
+    try:
+        os.chmod(temporary_filename, 0o666 & ~get_umask())
+        with open(fd, 'w', buffering=buffering) as f:
+            yield f
+        os.replace(temporary_filename, filename)
+    except BaseException:
+        os.remove(temporary_filename)
+        raise
+
+
+def check_header_fields(data: Iterable[dict], fields: set[str]):
+    """Yield the rows of data, raise ValueError if a row has a key that is not in the fields."""
+    for item in data:
+        if not item.keys() <= fields:
+            raise ValueError(f"Fields not in the header: {sorted(map(str, item.keys() - fields))}")
+        yield item
@@ -0,0 +1,163 @@
+"""File handling tests, joining dates and towns against the previous implementation."""
+import os
+
+import pytest
+
+from file_handling import (LineIndex, hash_join_on_left, hash_join_on_right, is_sorted_by_key, join_csv_files,
+                           merge_dates_and_towns_into_csv, read_csv_file, read_file_contents_to_list, sort_merge_join,
+                           write_list_of_dicts_to_csv_file)
+
+SORTED_DATES = ["ago:12.12.1999", "john:01.01.2001", "mary:06.03.2016", "peeter:-"]
+SORTED_TOWNS = ["aadu:tartu", "john:london", "kati:narva", "mary:new york", "zeno:paide"]
+UNSORTED_DATES = ["mary:06.03.2016", "john:01.01.2001", "zeno:02.02.2002", "ago:12.12.1999", "kati:03.03.2003"]
+UNSORTED_TOWNS = ["john:london", "peeter:tallinn", "mary:new york", "aadu:tartu"]
+DISJOINT_DATES = ["john:01.01.2001", "mary:06.03.2016"]
+DISJOINT_TOWNS = ["peeter:tallinn", "aadu:tartu", "kati:narva"]
+
+
+def legacy_merge(dates: list[list[str]], towns: list[list[str]]) -> list[list[str]]:
+    """Merge the dates and towns the way merge_dates_and_towns_into_csv() did before the streaming join."""
+    people = {}
+    for name, date in dates:
+        people[name] = [name, "-", date]
+    for name, town in towns:
+        if name in people:
+            people[name][1] = town
+        else:
+            people[name] = [name, town, "-"]
+    return [["name", "town", "date"], *people.values()]
+
+
+def write_files(tmp_path, dates: list[str], towns: list[str]) -> tuple[str, str]:
+    """Write the dates and towns files and return their names."""
+    dates_filename = str(tmp_path / "dates.txt")
+    towns_filename = str(tmp_path / "towns.txt")
+    with open(dates_filename, "w") as f:
+        f.write("\n".join(dates))
+    with open(towns_filename, "w") as f:
+        f.write("\n".join(towns))
+    return dates_filename, towns_filename
+
+
+def expected_join(dates_filename: str, towns_filename: str) -> list[tuple[str, str, str]]:
+    """Return the (name, date, town) rows of the previous implementation."""
+    merged = legacy_merge(read_csv_file(dates_filename, ":"), read_csv_file(towns_filename, ":"))
+    return [(name, date, town) for name, town, date in merged[1:]]
+
+
+def test__join_sorted_files_sort_merge_join(tmp_path):
+    """Test that sorted files are merged side by side with the same result as the hash joins."""
+    dates_filename, towns_filename = write_files(tmp_path, SORTED_DATES, SORTED_TOWNS)
+    assert is_sorted_by_key(dates_filename, ":") and is_sorted_by_key(towns_filename, ":")
+    expected = expected_join(dates_filename, towns_filename)
+    assert list(sort_merge_join(dates_filename, towns_filename, ":")) == expected
+    assert list(hash_join_on_left(dates_filename, towns_filename, ":")) == expected
+    assert list(hash_join_on_right(dates_filename, towns_filename, ":")) == expected
+    assert list(join_csv_files(dates_filename, towns_filename, ":")) == expected
+
+
+def test__join_unsorted_files_hash_joins(tmp_path):
+    """Test the hash join on either file with unsorted files, the names only in the towns file come last."""
+    dates_filename, towns_filename = write_files(tmp_path, UNSORTED_DATES, UNSORTED_TOWNS)
+    assert not is_sorted_by_key(dates_filename, ":")
+    expected = expected_join(dates_filename, towns_filename)
+    assert expected[-2:] == [("peeter", "-", "tallinn"), ("aadu", "-", "tartu")]
+    assert list(hash_join_on_left(dates_filename, towns_filename, ":")) == expected
+    assert list(hash_join_on_right(dates_filename, towns_filename, ":")) == expected
+    assert list(join_csv_files(dates_filename, towns_filename, ":")) == expected
+    assert list(join_csv_files(towns_filename, dates_filename, ":")) == expected_join(towns_filename, dates_filename)
+
+
+def test__join_disjoint_files(tmp_path):
+    """Test that every name of disjoint files is written with "-" for the missing value."""
+    for dates, towns in [(DISJOINT_DATES, DISJOINT_TOWNS), (sorted(DISJOINT_DATES), sorted(DISJOINT_TOWNS))]:
+        dates_filename, towns_filename = write_files(tmp_path, dates, towns)
+        expected = expected_join(dates_filename, towns_filename)
+        assert len(expected) == len(dates) + len(towns)
+        assert list(hash_join_on_left(dates_filename, towns_filename, ":")) == expected
+        assert list(hash_join_on_right(dates_filename, towns_filename, ":")) == expected
+        assert list(join_csv_files(dates_filename, towns_filename, ":")) == expected
+    assert list(sort_merge_join(dates_filename, towns_filename, ":")) == expected
+
+
+def test__merge_dates_and_towns_into_csv_same_as_before(tmp_path):
+    """Test the written file against the previous implementation, including empty files."""
+    output_filename = str(tmp_path / "output.csv")
+    for dates, towns in [(SORTED_DATES, SORTED_TOWNS), (UNSORTED_DATES, UNSORTED_TOWNS),
+                         (DISJOINT_DATES, DISJOINT_TOWNS), ([], UNSORTED_TOWNS), (UNSORTED_DATES, []), ([], [])]:
+        dates_filename, towns_filename = write_files(tmp_path, dates, towns)
+        merge_dates_and_towns_into_csv(dates_filename, towns_filename, output_filename)
+        assert read_csv_file(output_filename) == legacy_merge(read_csv_file(dates_filename, ":"),
+                                                              read_csv_file(towns_filename, ":"))
+
+
+@pytest.mark.parametrize("text", [b"", b"\n", b"a", b"a\nb\n", b"a\nb", b"\n\na\n\n", b"a\r\nb\r\n", b"a\r\n\r\nb",
+                                  b"a\rb\r", b"a\r\rb", b"a\nb\r\nc\rd", b"name,age\r\njohn,12\r\nmary,14"])
+def test__line_index_same_as_read_file_contents_to_list(tmp_path, text):
+    """Test the lines and CSV rows of files with every kind of line break against reading the whole file."""
+    filename = str(tmp_path / "lines.txt")
+    with open(filename, "wb") as f:
+        f.write(text)
+    expected = read_file_contents_to_list(filename)
+    with LineIndex(filename) as lines:
+        assert list(lines) == expected
+        assert len(lines) == len(expected)
+        assert lines[-2:] == expected[-2:]
+        assert list(lines.iter_csv_rows()) == read_csv_file(filename)
+        assert [lines.get_csv_row(i) for i in range(len(lines))] == read_csv_file(filename)
+
+
+def test__line_index_saved_and_loaded(tmp_path):
+    """Test that saved offsets are loaded while the file is the same and found again after it changes."""
+    filename = str(tmp_path / "lines.txt")
+    with open(filename, "wb") as f:
+        f.write(b"first\r\nsecond\r\nthird\r\n")
+    with LineIndex(filename) as lines:
+        lines.save()
+    with LineIndex(filename) as lines:
+        assert lines.index_map is not None
+        assert list(lines) == ["first", "second", "third"]
+        with pytest.raises(IndexError):
+            lines[3]
+
+    with open(filename, "ab") as f:
+        f.write(b"fourth")
+    with LineIndex(filename) as lines:
+        assert lines.index_map is None
+        assert lines[-1] == "fourth" and len(lines) == 4
+    assert os.path.exists(filename + ".idx")
+
+
+def test__write_list_of_dicts_to_csv_file(tmp_path):
+    """Test the header of all the keys in the order they are seen, a declared header and a generator of rows."""
+    filename = str(tmp_path / "people.csv")
+    rows = [{"name": "john", "age": "12"}, {"name": "mary", "town": "London"}]
+    write_list_of_dicts_to_csv_file(filename, rows)
+    assert read_csv_file(filename) == [["name", "age", "town"], ["john", "12", ""], ["mary", "", "London"]]
+    write_list_of_dicts_to_csv_file(filename, (row for row in rows), ["town", "name", "age"])
+    assert read_csv_file(filename) == [["town", "name", "age"], ["", "john", "12"], ["London", "mary", ""]]
+    write_list_of_dicts_to_csv_file(filename, [], ["name"])
+    assert read_csv_file(filename) == [["name"]]
+    assert os.listdir(tmp_path) == ["people.csv"]
+
+
+def test__write_list_of_dicts_to_csv_file_error_leaves_file(tmp_path):
+    """Test that a row outside the header, or a failing generator, leaves the file as it was and no other file."""
+    filename = str(tmp_path / "people.csv")
+    with open(filename, "w"):
+        mode = os.stat(filename).st_mode
+    write_list_of_dicts_to_csv_file(filename, [{"name": "john"}])
+
+    def failing_rows():
+        yield {"name": "mary"}
+        raise RuntimeError("no more rows")
+    with pytest.raises(ValueError):
+        write_list_of_dicts_to_csv_file(filename, [{"name": "mary"}, {"name": "ago", "age": "3"}], ["name"])
+    with pytest.raises(RuntimeError):
+        write_list_of_dicts_to_csv_file(filename, failing_rows(), ["name"])
+    assert read_csv_file(filename) == [["name"], ["john"]]
+    assert os.listdir(tmp_path) == ["people.csv"]
+
+    write_list_of_dicts_to_csv_file(filename, [{"name": "mary"}], ["name"])
+    assert read_csv_file(filename) == [["name"], ["mary"]]
+    assert os.stat(filename).st_mode == mode
@@ -0,0 +1,128 @@
+"""Compare typed CSV reading with the previous implementation on a large generated file."""
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from file_handling import read_csv_file_into_list_of_dicts_using_datatypes
+
+
+def legacy_assign_data_types(lines, data_types):
+    """Assign correct data types (previous implementation)."""
+    for line in lines:
+        for key, value in line.items():
+            if key not in data_types:
+                data_types[key] = legacy_infer_data_type(value)
+            else:
+                if data_types[key] != str:
+                    if value == "-":
+                        break
+                    try:
+                        datetime.strptime(value, "%d.%m.%Y").date()
+                        data_types[key] = datetime
+                    except ValueError:
+                        try:
+                            int(value)
+                            data_types[key] = int
+                        except ValueError:
+                            data_types[key] = str
+
+    return data_types
+
+
+def legacy_infer_data_type(value):
+    """Infer data type based on value (previous implementation)."""
+    if value == "-":
+        return None
+    else:
+        try:
+            value = int(value)
+            return int
+        except ValueError:
+            try:
+                datetime.strptime(value, "%d.%m.%Y").date()
+                return datetime
+            except ValueError:
+                return str
+
+
+def legacy_convert_value(value, data_types, key):
+    """Convert value to the specified data type (previous implementation)."""
+    if value == '-' or value is None:
+        return None
+    else:
+        if data_types[key] == str:
+            return str(value)
+        elif data_types[key] == int:
+            try:
+                return int(value)
+            except ValueError:
+                data_types[key] = str
+                return str(value)
+        elif data_types[key] == datetime:
+            try:
+                return datetime.strptime(value, "%d.%m.%Y").date()
+            except ValueError:
+                data_types[key] = str
+                return str(value)
+        else:
+            return str(value)
+
+
+def legacy_read_csv_file_into_list_of_dicts_using_datatypes(filename: str) -> list[dict]:
+    """Read the typed CSV file with the previous implementation."""
+    with open(filename, 'r', newline='') as f:
+        lines = list(csv.DictReader(f))
+        data_types = legacy_assign_data_types(lines, {})
+        return [{key: legacy_convert_value(value, data_types, key) for key, value in line.items()} for line in lines]
+
+
+def write_people_file(filename: str, rows: int) -> None:
+    """Write a CSV file of people with int, date, text and missing values."""
+    names = ["john", "mary", "ago", "peeter", "mari", "kati"]
+    towns = ["Tallinn", "Tartu", "Narva", "Pärnu"]
+    random.seed(1)
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "name", "birth", "death", "town", "score"])
+        for person_id in range(rows):
+            birth = f"{random.randint(1, 28):02}.{random.randint(1, 12):02}.{random.randint(1920, 2020)}"
+            death = "-" if random.random() < 0.7 else f"{random.randint(1, 28):02}.{random.randint(1, 12):02}.2022"
+            writer.writerow([person_id, random.choice(names), birth, death, random.choice(towns),
+                             random.randint(0, 100) if random.random() < 0.9 else "-"])
+
+
+def measure(func, filename: str):
+    """Return the result of the function and the seconds it took."""
+    start = time.perf_counter()
+    result = func(filename)
+    return result, time.perf_counter() - start
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--sample-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "people.csv")
+        write_people_file(filename, args.rows)
+
+        legacy, legacy_time = measure(legacy_read_csv_file_into_list_of_dicts_using_datatypes, filename)
+        full, full_time = measure(read_csv_file_into_list_of_dicts_using_datatypes, filename)
+        sampled, sampled_time = measure(
+            lambda name: read_csv_file_into_list_of_dicts_using_datatypes(name, args.sample_size), filename)
+
+    print(f"{args.rows} rows")
+    print(f"previous implementation:     {legacy_time:.2f} s")
+    print(f"inferred from all rows:      {full_time:.2f} s, same result: {full == legacy}")
+    print(f"inferred from {args.sample_size} rows: {sampled_time:.2f} s, same result: {sampled == legacy}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,92 +1,267 @@
 """File handling."""
 
 import csv
+import hashlib
+import heapq
+import json
 import os
-from datetime import datetime
+import pickle
+import re
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from functools import lru_cache
+from itertools import chain, groupby, islice, repeat
+from operator import itemgetter
+
+MISSING_VALUE = "-"
+# Like int(), surrounding whitespace and underscores between digits are allowed (' 4', '1_000').
+INT_PATTERN = re.compile(r"\s*[-+]?\d+(?:_\d+)*\s*", re.ASCII)
+DATE_PATTERN = re.compile(r"\s*\d{1,2}\.\d{1,2}\.\d{4}\s*", re.ASCII)
+SCHEMA_SUFFIX = ".schema.json"
+SCHEMA_HASH_LINES = 1000
+MISSING_INT = -(1 << 63)
+REPORT_RUN_SIZE = 1_000_000
+REPORT_RUN_CHUNK = 10_000
+REPORT_MERGE_WIDTH = 64
+REPORT_BUFFER_SIZE = 1 << 20
+
+
+def classify_value(value: str | None) -> type | None:
+    """Return the data type of the value: int, date, str or None if the value is missing."""
+    if value is None or value == MISSING_VALUE:
+        return None
+    if INT_PATTERN.fullmatch(value):
+        return int
+    if DATE_PATTERN.fullmatch(value):
+        return date
+    return str
 
 
-def assign_data_types(lines, data_types):
-    """Assign correct data types."""
-    for line in lines:
-        for key, value in line.items():
-            if key not in data_types:
-                data_types[key] = infer_data_type(value)
-            else:
-                if data_types[key] != str:
-                    if value == "-":
-                        break
-                    try:
-                        datetime.strptime(value, "%d.%m.%Y").date()
-                        data_types[key] = datetime
-                    except ValueError:
-                        try:
-                            int(value)
-                            data_types[key] = int
-                        except ValueError:
-                            data_types[key] = str
+def promote_type(data_type: type | None, value_type: type | None) -> type | None:
+    """Return the data type of a column of data_type after a value of value_type, mixed types become str."""
+    if data_type is None:
+        return value_type
+    if value_type is None or value_type is data_type:
+        return data_type
+    return str
+
+
+def fit_type(data_type: type | None, value: str | None) -> type | None:
+    """Return the data type of a column of data_type that has to fit the value too.
+
+    A column without values gets the type of the value. A value of another type, or one that looks right
+    but can not be converted (like 31.02.2022), makes the column str.
+    """
+    data_type = promote_type(data_type, classify_value(value))
+    if data_type is not str:
+        try:
+            CONVERTERS[data_type](value)
+        except ValueError:
+            return str
+    return data_type
 
-    return data_types
 
+def infer_column_type(values) -> type | None:
+    """Return the data type that fits all the values, every different value is checked once."""
+    data_type = None
+    for value in set(values):
+        data_type = fit_type(data_type, value)
+        if data_type is str:
+            break
+    return data_type
 
-def infer_data_type(value):
-    """Infer data type based on value."""
-    if value == "-":
+
+def infer_column_types(rows: list[list], width: int) -> list[type | None]:
+    """Return the data type of every column of the rows."""
+    return [infer_column_type(map(itemgetter(i), rows)) for i in range(width)]
+
+
+def to_missing(value: str | None) -> None:
+    """Convert the value of a column without values, raise ValueError if the value is not missing."""
+    if value is None or value == MISSING_VALUE:
         return None
-    else:
+    raise ValueError(f"Unexpected value {value!r}.")
+
+
+def to_int(value: str | None) -> int | None:
+    """Convert the value to int or None if it is missing."""
+    if value is None or value == MISSING_VALUE:
+        return None
+    return int(value)
+
+
+@lru_cache(maxsize=1 << 16)
+def to_date(value: str | None) -> date | None:
+    """Convert a dd.mm.yyyy value to date or None if it is missing, dates of recent values are reused."""
+    if value is None or value == MISSING_VALUE:
+        return None
+    day, month, year = value.split(".")
+    return date(int(year), int(month), int(day))
+
+
+def to_str(value: str | None) -> str | None:
+    """Keep the value as it is or None if it is missing."""
+    if value is None or value == MISSING_VALUE:
+        return None
+    return value
+
+
+CONVERTERS = {None: to_missing, int: to_int, date: to_date, str: to_str}
+TYPE_NAMES = {None: None, int: "int", date: "date", str: "str"}
+NAMED_TYPES = {name: data_type for data_type, name in TYPE_NAMES.items()}
+
+
+def read_rows(csv_reader, width: int):
+    """Yield the non-empty rows of the reader, short rows are filled with None like csv.DictReader does."""
+    for values in csv_reader:
+        if not values:
+            continue
+        if len(values) < width:
+            values += [None] * (width - len(values))
+        yield values
+
+
+def convert_column(values, data_type: type | None) -> tuple[list, type | None]:
+    """Convert the values of a column and return them with the data type that fits all of them.
+
+    If a value does not fit the data type (for example when the type was inferred from a sample), a column
+    without values gets the type of all its values and any other column becomes str.
+    """
+    while True:
         try:
-            value = int(value)
-            return int
+            return list(map(CONVERTERS[data_type], values)), data_type
         except ValueError:
-            try:
-                datetime.strptime(value, "%d.%m.%Y").date()
-                return datetime
-            except ValueError:
-                return str
+            data_type = infer_column_type(values) if data_type is None else str
 
 
-def assign_values(lines, data_types, processed_fields):
-    """Assign values to the processed field list by using data_types dict."""
-    for line in lines:
-        processed_row = {}
+def convert_columns(rows: list[list], data_types: list[type | None]) -> list[list]:
+    """Return the converted values of every column of the rows, every column is converted with a single converter.
+
+    :param rows: values of every row
+    :param data_types: data type of every column, changed if a value does not fit its column
+    :return: a list of converted values for every column (no columns if there are no rows)
+    """
+    columns = list(zip(*rows))[:len(data_types)]
+    for i, values in enumerate(columns):
+        columns[i], data_types[i] = convert_column(values, data_types[i])
+    return columns
+
 
-        for key, value in line.items():
-            processed_row[key] = convert_value(value, data_types, key)
+def convert_rows(header: list[str], rows: list[list], columns: list[list]) -> list[dict]:
+    """Return the rows as dictionaries of the converted values.
 
-        processed_fields.append(processed_row)
+    Values after the header are kept as a list with the key None like csv.DictReader does.
 
+    :param header: names of the columns
+    :param rows: values of every row as they are in the file
+    :param columns: converted values of every column, see convert_columns()
+    :return: a list of rows as dictionaries
+    """
+    processed_fields = [dict(zip(header, values)) for values in zip(*columns)]
+    if rows and max(map(len, rows)) > len(header):
+        for row, values in zip(processed_fields, rows):
+            if len(values) > len(header):
+                row[None] = values[len(header):]
     return processed_fields
 
 
-def convert_value(value, data_types, key):
-    """Convert value to the specified data type."""
-    if value == '-' or value is None:
+def get_file_signature(filename: str) -> dict:
+    """Return the size and modification time of the file and a hash of its header and first lines."""
+    stat = os.stat(filename)
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for line in islice(f, SCHEMA_HASH_LINES + 1):
+            digest.update(line)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest.hexdigest()}
+
+
+def load_cached_schema(filename: str) -> dict[str, str | None] | None:
+    """Return the schema saved next to the file (filename.schema.json).
+
+    None is returned if the file has changed since, or if the schema file is not one written by
+    save_cached_schema() (any other JSON, or a data type name that is not known).
+    """
+    try:
+        with open(filename + SCHEMA_SUFFIX, 'r') as f:
+            cached = json.load(f)
+        stat = os.stat(filename)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or not isinstance(cached.get("signature"), dict):
+        return None
+    schema = cached.get("schema")
+    if not isinstance(schema, dict) or any(name not in TYPE_NAMES.values() for name in schema.values()):
+        return None
+    signature = cached["signature"]
+    if signature.get("size") != stat.st_size or signature.get("mtime_ns") != stat.st_mtime_ns:
+        return None
+    if signature != get_file_signature(filename):
         return None
+    return schema
+
+
+def save_cached_schema(filename: str, signature: dict, schema: dict[str, str | None]) -> None:
+    """Save the schema next to the file with the signature of the file, a read-only directory is ignored.
+
+    The schema is written to a temporary file that then replaces the schema file, so a reader never
+    sees a half-written schema file.
+    """
+    directory, name = os.path.split(filename + SCHEMA_SUFFIX)
+    try:
+        fd, temporary_filename = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=directory or ".")
+    except OSError:
+        return
+    try:
+        with open(fd, 'w') as f:
+            json.dump({"signature": signature, "schema": schema}, f, indent=2)
+        os.replace(temporary_filename, filename + SCHEMA_SUFFIX)
+    except OSError:
+        os.remove(temporary_filename)
+
+
+def read_typed_columns(filename: str, sample_size: int | None = None,
+                       use_schema_cache: bool = False) -> tuple[list[str], list[list], list[list], list[type | None]]:
+    """Read the CSV file and return the header, the rows, the converted columns and their data types.
+
+    See read_csv_file_into_list_of_dicts_using_datatypes() for the parameters. With the schema cache the data
+    types are read from the cache, or inferred and saved to the cache after the conversion has checked them.
+    """
+    schema = load_cached_schema(filename) if use_schema_cache else None
+    signature = get_file_signature(filename) if use_schema_cache and schema is None else None
+
+    with open(filename, 'r', newline='') as f:
+        csv_reader = csv.reader(f)
+        header = next(csv_reader, [])
+        rows = list(read_rows(csv_reader, len(header)))
+
+    if schema is not None and all(column in schema for column in header):
+        data_types = [NAMED_TYPES[schema[column]] for column in header]
     else:
-        if data_types[key] == str:
-            return str(value)
-        elif data_types[key] == int:
-            try:
-                return int(value)
-            except ValueError:
-                data_types[key] = str
-                return str(value)
-        elif data_types[key] == datetime:
-            try:
-                return datetime.strptime(value, "%d.%m.%Y").date()
-            except ValueError:
-                data_types[key] = str
-                return str(value)
-        else:
-            return str(value)
+        sample = rows[:sample_size] if sample_size else rows
+        data_types = infer_column_types(sample, len(header))
+    columns = convert_columns(rows, data_types)
+
+    if signature is not None:
+        save_cached_schema(filename, signature, {column: TYPE_NAMES[data_type]
+                                                 for column, data_type in zip(header, data_types)})
+    return header, rows, columns, data_types
 
 
-def read_csv_file_into_list_of_dicts_using_datatypes(filename: str) -> list[dict]:
+def read_csv_file_into_list_of_dicts_using_datatypes(filename: str, sample_size: int | None = None,
+                                                     use_schema_cache: bool = False) -> list[dict]:
     """
     Read data from a CSV file and cast values into different data types based on their content.
 
     Fields containing only numbers are cast into integers.
     Fields containing dates (in the format dd.mm.yyyy) are cast into date.
     Otherwise, the data type remains string (default by csv reader).
+    Like int(), numbers and dates may have spaces around them, and numbers underscores between digits
+    (' 4' and '1_000' are ints). Only ASCII digits and whitespace are recognized.
     The order of elements in the list matches the lines in the file.
     None values don't affect the data type (the column will have the type based on the existing values).
 
@@ -150,22 +325,199 @@ def read_csv_file_into_list_of_dicts_using_datatypes(filename: str) -> list[dict
       {'name': 'mary', 'date': datetime.date(2023, 9, 7)},
     ]
 
+    The data types are inferred from the values first (each different value of a column is classified once
+    with a regular expression), then every column is converted with the converter of its type.
+
     :param filename: The name of the CSV file to read.
+    :param sample_size: Infer the data types from this many first rows only, a later value that does not
+        fit changes the type of its column. By default all rows are used.
+    :param use_schema_cache: Keep the data types in a filename.schema.json file next to the file and use them
+        instead of inferring them again while the size, modification time and first lines of the file are
+        the same.
     :return: A list of dictionaries containing processed field values.
     """
+    header, rows, columns, _ = read_typed_columns(filename, sample_size, use_schema_cache)
+    return convert_rows(header, rows, columns)
+
+
+def infer_schema(filename: str, sample_size: int | None = None) -> dict[str, str | None]:
+    """
+    Scan the CSV file and return its schema: the name of the data type of every column.
+
+    The names are "int", "date", "str" or None for a column without values, so the schema can be saved as JSON.
+    Only the data types are kept while scanning, and the scan stops when every column is str.
+
+    :param filename: The name of the CSV file to read.
+    :param sample_size: Scan only this many first rows. By default all rows are scanned.
+    :return: A dictionary of column names and data type names.
+    """
+    with open(filename, 'r', newline='') as f:
+        csv_reader = csv.reader(f)
+        header = next(csv_reader, [])
+        data_types = [None] * len(header)
+        columns = list(range(len(header)))
+        for row_count, values in enumerate(read_rows(csv_reader, len(header))):
+            if not columns or row_count == sample_size:
+                break
+            for i in columns:
+                data_types[i] = fit_type(data_types[i], values[i])
+            columns = [i for i in columns if data_types[i] is not str]
+
+    return {column: TYPE_NAMES[data_type] for column, data_type in zip(header, data_types)}
+
+
+def save_schema(schema: dict[str, str | None], filename: str) -> None:
+    """Save the schema to a JSON file."""
+    with open(filename, 'w') as f:
+        json.dump(schema, f, indent=2)
+
+
+def load_schema(filename: str) -> dict[str, str | None]:
+    """Load a schema saved with save_schema()."""
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def iter_csv_typed(filename: str, schema: dict[str, str | None] | None = None, sample_size: int = 1000):
+    """
+    Read the CSV file lazily and yield every row as a dictionary of converted values.
+
+    The values are converted like in read_csv_file_into_list_of_dicts_using_datatypes(), but only one row
+    (and the sample) is kept in memory at a time. The data types come from the schema (see infer_schema()
+    and load_schema()); the types of columns that are not in the schema are inferred from the first
+    sample_size rows.
+
+    Rows that have been yielded can not be changed anymore, so a value that does not fit the type of its
+    column is demoted late: a column without values gets the type of the value, any other column becomes
+    str from that row on, and the value itself is yielded as the string it was in the file.
+
+    :param filename: The name of the CSV file to read.
+    :param schema: Column names and data type names ("int", "date", "str" or None).
+    :param sample_size: The number of first rows to infer the missing data types from.
+    :return: A generator of rows as dictionaries.
+    """
     with open(filename, 'r', newline='') as f:
-        csv_reader = csv.DictReader(f)
-        lines = list(csv_reader)
+        csv_reader = csv.reader(f)
+        header = next(csv_reader, None)
+        if header is None:
+            return
+        width = len(header)
+        rows = read_rows(csv_reader, width)
+
+        schema = schema or {}
+        sample = []
+        if any(column not in schema for column in header):
+            sample = list(islice(rows, sample_size))
+        data_types = [NAMED_TYPES[schema[column]] if column in schema else infer_column_type(map(itemgetter(i), sample))
+                      for i, column in enumerate(header)]
+        converters = [CONVERTERS[data_type] for data_type in data_types]
+
+        for values in chain(sample, rows):
+            try:
+                converted = [convert(value) for convert, value in zip(converters, values)]
+            except ValueError:
+                converted = []
+                for i, (convert, value) in enumerate(zip(converters, values)):
+                    try:
+                        converted.append(convert(value))
+                    except ValueError:
+                        data_types[i] = fit_type(data_types[i], value)
+                        converters[i] = CONVERTERS[data_types[i]]
+                        converted.append(converters[i](value))
 
-        processed_fields = []
-        data_types = {}
+            row = dict(zip(header, converted))
+            if len(values) > width:
+                row[None] = values[width:]
+            yield row
 
-        data_types = assign_data_types(lines, data_types)  # Assign data types.
 
-        return assign_values(lines, data_types, processed_fields)  # Assign value and return processed fields.
+def guess_value(value: str | None):
+    """Return the value as date, int, str or None (if it is missing) by the value alone."""
+    value_type = classify_value(value)
+    if value_type is None:
+        return None
+    try:
+        return CONVERTERS[value_type](value)
+    except ValueError:
+        return value
 
 
-def read_people_data(directory: str) -> dict[int, dict]:
+def get_people_file_paths(directory: str) -> list[str]:
+    """Return the paths of the CSV files of people data in the order they are merged (by file name)."""
+    return sorted(os.path.join(directory, file) for file in os.listdir(directory) if file.endswith(".csv"))
+
+
+def read_header(file_path: str) -> list[str]:
+    """Return the header of the CSV file."""
+    with open(file_path, 'r', newline='') as file:
+        return next(csv.reader(file), [])
+
+
+def read_people_file(file_path: str, typed: bool = False,
+                     use_schema_cache: bool = False) -> tuple[list[str], dict[int, dict]]:
+    """Read one file of people data and return its header and the rows by id.
+
+    See read_people_data() for the parameters.
+    """
+    header = read_header(file_path)
+
+    people = {}
+    if typed or use_schema_cache:
+        lines = read_csv_file_into_list_of_dicts_using_datatypes(file_path, use_schema_cache=use_schema_cache)
+    else:
+        with open(file_path, 'r', newline='') as file:
+            lines = [{key: guess_value(value) for key, value in line.items()} for line in csv.DictReader(file)]
+
+    for line in lines:
+        person_id = int(line['id'])
+        if person_id in people:
+            people[person_id].update(line)
+        else:
+            people[person_id] = line
+        line["id"] = person_id
+    return header, people
+
+
+def get_people_columns(headers) -> list[str]:
+    """Return the columns of the people data: "id" and then the columns of the headers in the order they first appear.
+
+    :param headers: the headers of the files in the order they are merged
+    """
+    columns = {"id": None}
+    for header in headers:
+        columns.update(dict.fromkeys(header))
+    return list(columns)
+
+
+def read_people_data_and_columns(directory: str, typed: bool = False, use_schema_cache: bool = False,
+                                 workers: int = 1) -> tuple[list[str], dict[int, dict]]:
+    """Read people data like read_people_data() and return the columns too, see get_people_columns()."""
+    file_paths = get_people_file_paths(directory)
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(read_people_file, file_paths, repeat(typed), repeat(use_schema_cache)))
+    else:
+        results = [read_people_file(file_path, typed, use_schema_cache) for file_path in file_paths]
+
+    outcome = {}
+    columns = get_people_columns(header for header, _ in results)
+    for _, people in results:
+        for person_id, line in people.items():
+            if person_id in outcome:
+                outcome[person_id].update(line)
+            else:
+                outcome[person_id] = line
+
+    for person in outcome.values():
+        if len(person) < len(columns):
+            for column in columns:
+                person.setdefault(column, None)
+
+    return columns, outcome
+
+
+def read_people_data(directory: str, typed: bool = False, use_schema_cache: bool = False,
+                     workers: int = 1) -> dict[int, dict]:
     """
     Read people data from CSV files and merge information.
 
@@ -199,42 +551,318 @@ def read_people_data(directory: str) -> dict[int, dict]:
         3: {"id": 3, "name": "john", "birth": None, "death": None},
     }
 
+    The files can be read in parallel processes (see workers) and are merged in the order of the file names,
+    so the result does not depend on which file is read first.
+
     :param directory: The directory containing CSV files.
+    :param typed: Convert every column by its data type (the rules of
+        read_csv_file_into_list_of_dicts_using_datatypes) instead of guessing the type of every value on its own.
+    :param use_schema_cache: Convert typed and keep the data types of each file in a .schema.json file next to
+        it, see read_csv_file_into_list_of_dicts_using_datatypes().
+    :param workers: The number of processes to read the files with, one file per task. By default (1) the files
+        are read in this process. The rows are sent back to this process, so more workers only help with
+        several big files on several CPUs. A script that uses workers has to run its code under
+        if __name__ == '__main__' on platforms that start processes with spawn.
     :return: A dictionary with "id" as keys and data dictionaries as values.
     """
-    outcome = {}
+    return read_people_data_and_columns(directory, typed, use_schema_cache, workers)[1]
+
+
+class TableColumn:
+    """One column of a PeopleTable stored by the data type of its values.
+
+    Ints are kept in array('q') with MISSING_INT for a missing value, dates as day numbers in array('i') with 0
+    for a missing value and strings interned in a list. A column with values of different types keeps them
+    in a list. Rows after the end of the column are missing, so a column only grows up to its last value.
+    """
+
+    def __init__(self):
+        """Construct a column without values."""
+        self.data_type = None
+        self.values = []
+
+    def get(self, row: int):
+        """Return the value of the row or None if it is missing."""
+        if row >= len(self.values):
+            return None
+        value = self.values[row]
+        if self.data_type is int:
+            return None if value == MISSING_INT else value
+        if self.data_type is date:
+            return date.fromordinal(value) if value else None
+        return value
+
+    def encode(self, values: list) -> list:
+        """Return the values as they are stored in this column."""
+        if self.data_type is int:
+            return [MISSING_INT if value is None else value for value in values]
+        if self.data_type is date:
+            return [0 if value is None else value.toordinal() for value in values]
+        if self.data_type is str:
+            return [None if value is None else sys.intern(value) for value in values]
+        return list(values)
+
+    def change_type(self, data_type: type | None) -> None:
+        """Store the column for values of the data type, object for values of different types."""
+        values = [self.get(row) for row in range(len(self.values))]
+        self.data_type = data_type
+        self.values = {int: array('q'), date: array('i')}.get(data_type, [])
+        self.values.extend(self.encode(values))
+
+    def set_rows(self, rows: list[int], values: list, data_type: type | None) -> None:
+        """Set the values of the rows, the values are converted values of the data type (or None)."""
+        if data_type is not None and data_type is not self.data_type:
+            self.change_type(data_type if self.data_type is None else object)
+        try:
+            encoded = self.encode(values)
+            if isinstance(self.values, array):
+                encoded = array(self.values.typecode, encoded)
+        except OverflowError:
+            self.change_type(object)
+            encoded = self.encode(values)
+
+        end = len(self.values)
+        if rows == list(range(end, end + len(rows))):
+            self.values.extend(encoded)
+            return
+        missing = self.encode([None])[0]
+        for row, value in zip(rows, encoded):
+            if row >= len(self.values):
+                if value == missing:
+                    continue
+                self.values.extend([missing] * (row + 1 - len(self.values)))
+            self.values[row] = value
+
+
+class PeopleTable(Mapping):
+    """People data stored by columns, see read_people_table().
+
+    The table is a read-only mapping of ids to rows like the dictionary returned by read_people_data(),
+    but the rows are made when they are asked for. The ids are kept in array('q'). While files are added,
+    rows are found by an id -> row dictionary; finish() replaces it with the ids sorted in array('q') and
+    their rows in array('q'), which are searched with bisect and take a fraction of the memory.
+    """
 
-    csv_files = [file for file in os.listdir(directory) if file.endswith(".csv")]
+    def __init__(self):
+        """Construct an empty table."""
+        self.ids = array('q')
+        self.index = {}
+        self.sorted_ids = array('q')
+        self.sorted_rows = array('q')
+        self.columns = {}
+        self.headers = []
+
+    def add_columns(self, header: list[str], columns: list[list], data_types: list[type | None]) -> None:
+        """Add the converted columns of one file, the values of a later file replace the earlier ones.
+
+        :param header: names of the columns, one of them is "id"
+        :param columns: converted values of every column, see convert_columns()
+        :param data_types: data type of every column
+        """
+        self.headers.append(header)
+        for name in header:
+            if name != "id" and name not in self.columns:
+                self.columns[name] = TableColumn()
+        if not columns:
+            return
+
+        if self.index is None:
+            self.index = dict(zip(self.sorted_ids, self.sorted_rows))
+        rows = []
+        for person_id in columns[header.index("id")]:
+            person_id = int(person_id)
+            row = self.index.get(person_id)
+            if row is None:
+                row = self.index[person_id] = len(self.ids)
+                self.ids.append(person_id)
+            rows.append(row)
+
+        for name, values, data_type in zip(header, columns, data_types):
+            if name != "id":
+                self.columns[name].set_rows(rows, values, data_type)
+
+    def finish(self) -> None:
+        """Replace the id -> row dictionary with the sorted arrays of ids and rows."""
+        if self.index is None:
+            return
+        rows = sorted(range(len(self.ids)), key=self.ids.__getitem__)
+        self.sorted_ids = array('q', [self.ids[row] for row in rows])
+        self.sorted_rows = array('q', rows)
+        self.index = None
+
+    def find_row(self, person_id: int) -> int:
+        """Return the row of the person, raise KeyError if there is no such id."""
+        if self.index is not None:
+            return self.index[person_id]
+        i = bisect_left(self.sorted_ids, person_id)
+        if i == len(self.sorted_ids) or self.sorted_ids[i] != person_id:
+            raise KeyError(person_id)
+        return self.sorted_rows[i]
+
+    def get_row(self, row: int) -> dict:
+        """Return the row as a dictionary of the id and all the columns."""
+        person = {"id": self.ids[row]}
+        for name, column in self.columns.items():
+            person[name] = column.get(row)
+        return person
+
+    def __getitem__(self, person_id: int) -> dict:
+        """Return the row of the person as a dictionary."""
+        if not isinstance(person_id, int):
+            raise KeyError(person_id)
+        return self.get_row(self.find_row(person_id))
+
+    def __iter__(self):
+        """Iterate over the ids in the order the people were added."""
+        return iter(self.ids)
+
+    def __len__(self) -> int:
+        """Return the number of people."""
+        return len(self.ids)
+
+
+def read_people_table(directory: str, use_schema_cache: bool = False) -> PeopleTable:
+    """
+    Read people data from CSV files into a PeopleTable.
+
+    The data is the same as read_people_data(directory, typed=True) returns, but every column is kept in
+    a typed array or a list of interned strings instead of a dictionary for every person.
+
+    :param directory: The directory containing CSV files.
+    :param use_schema_cache: Keep the data types of each file in a .schema.json file next to it,
+        see read_csv_file_into_list_of_dicts_using_datatypes().
+    :return: A PeopleTable of all the people.
+    """
+    table = PeopleTable()
+    for file in sorted(file for file in os.listdir(directory) if file.endswith(".csv")):
+        header, _, columns, data_types = read_typed_columns(os.path.join(directory, file),
+                                                            use_schema_cache=use_schema_cache)
+        table.add_columns(header, columns, data_types)
+    table.finish()
+    return table
 
-    for csv_file in csv_files:
-        file_path = os.path.join(directory, csv_file)
 
-        with open(file_path, 'r') as file:
-            csv_reader = csv.DictReader(file)
-            for line in csv_reader:
-                person_id = int(line['id'])
+def calculate_age(birth, death, today: date) -> int:
+    """Return the age in full years at death or today, or -1 if there is no birth date."""
+    if not isinstance(birth, date):
+        return -1
+    end = death if isinstance(death, date) else today
+    return end.year - birth.year - ((end.month, end.day) < (birth.month, birth.day))
 
-                if person_id not in outcome:
-                    outcome[person_id] = {"id": int(person_id)}
 
-                for key, the_value in line.items():
-                    if the_value == '-':
-                        value = None
-                    else:
-                        try:
-                            value = datetime.strptime(the_value, "%d.%m.%Y").date()
-                        except ValueError:
-                            try:
-                                value = int(the_value)
-                            except ValueError:
-                                value = str(the_value)
+def format_report_value(value) -> str:
+    """Return the value as it is written to the report: dates as dd.mm.yyyy and None as "-"."""
+    if value is None:
+        return MISSING_VALUE
+    if isinstance(value, date):
+        return f"{value.day:02}.{value.month:02}.{value.year:04}"
+    return str(value)
+
+
+def get_report_record(person: dict, columns: list[str], today: date) -> tuple[tuple, list[str]]:
+    """Return the sort key and the report line of the person.
+
+    The key is (age, negated birth day number, name, id) with the age -1 replaced by sys.maxsize,
+    so people without age come last and the keys compare as plain integers and strings.
+    """
+    birth = person.get("birth")
+    death = person.get("death")
+    age = calculate_age(birth, death, today)
+    name = person.get("name")
+    key = (age if age >= 0 else sys.maxsize, -birth.toordinal() if isinstance(birth, date) else 0,
+           "" if name is None else str(name), person["id"])
+    line = [format_report_value(person.get(column)) for column in columns]
+    line += ["dead" if isinstance(death, date) else "alive", str(age)]
+    return key, line
+
+
+def write_run(records, directory: str, chunk_size: int = REPORT_RUN_CHUNK) -> str:
+    """Save the sorted records to a new file in the directory, chunk_size records at a time.
+
+    :return: the name of the file
+    """
+    records = iter(records)
+    with tempfile.NamedTemporaryFile('wb', dir=directory, suffix=".run", delete=False) as f:
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                return f.name
+            pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+
+
+def read_run(filename: str):
+    """Yield the records saved by write_run() in order, one chunk is in memory at a time."""
+    with open(filename, 'rb') as f:
+        while True:
+            try:
+                yield from pickle.load(f)
+            except EOFError:
+                return
+
 
-                    outcome[person_id][key] = value
+def merge_runs(runs: list[str]):
+    """Return the records of the runs merged in the order of their keys."""
+    return heapq.merge(*(read_run(run) for run in runs), key=itemgetter(0))
 
-    return outcome
 
+def sort_records(records, directory: str, max_in_memory: int):
+    """Return the (key, value) records sorted by key.
 
-def generate_people_report(person_data_directory: str, report_filename: str) -> None:
+    At most max_in_memory records are sorted in memory at once. With more records, sorted runs are saved to
+    temporary files in the directory and merged while the result is read. At most REPORT_MERGE_WIDTH runs are
+    merged at once, more runs are merged into longer runs first, and the runs are read in chunks small enough
+    that a merge keeps at most max_in_memory records in memory too.
+    """
+    chunk_size = max(1, min(REPORT_RUN_CHUNK, max_in_memory // REPORT_MERGE_WIDTH))
+    runs = []
+    buffer = []
+    for record in records:
+        buffer.append(record)
+        if len(buffer) >= max_in_memory:
+            buffer.sort(key=itemgetter(0))
+            runs.append(write_run(buffer, directory, chunk_size))
+            buffer = []
+    buffer.sort(key=itemgetter(0))
+    if not runs:
+        return iter(buffer)
+    if buffer:
+        runs.append(write_run(buffer, directory, chunk_size))
+
+    while len(runs) > REPORT_MERGE_WIDTH:
+        merged_runs = []
+        for start in range(0, len(runs), REPORT_MERGE_WIDTH):
+            merged_runs.append(write_run(merge_runs(runs[start:start + REPORT_MERGE_WIDTH]), directory, chunk_size))
+            for run in runs[start:start + REPORT_MERGE_WIDTH]:
+                os.remove(run)
+        runs = merged_runs
+    return merge_runs(runs)
+
+
+def iter_people_lines(file_paths: list[str]):
+    """Yield every line of the people files as ((id, file number, line number), values).
+
+    The values are guessed one by one like read_people_data() does, so the lines sorted by the key can be merged
+    into the same people in the same order.
+    """
+    for file_number, file_path in enumerate(file_paths):
+        with open(file_path, 'r', newline='') as file:
+            for line_number, line in enumerate(csv.DictReader(file)):
+                values = {key: guess_value(value) for key, value in line.items()}
+                yield (int(values['id']), file_number, line_number), values
+
+
+def merge_people_lines(lines):
+    """Yield the people of the lines sorted by iter_people_lines() key, later lines update the earlier ones."""
+    for person_id, person_lines in groupby(lines, key=lambda line: line[0][0]):
+        person = {}
+        for _, values in person_lines:
+            person.update(values)
+        person["id"] = person_id
+        yield person
+
+
+def generate_people_report(person_data_directory: str, report_filename: str,
+                           max_people_in_memory: int = REPORT_RUN_SIZE, use_table: bool = False) -> None:
     """
     Generate a report about people data from CSV files.
 
@@ -243,7 +871,8 @@ def generate_people_report(person_data_directory: str, report_filename: str) ->
     Input files should contain fields "birth" and "death," which are dates in the format "dd.mm.yyyy".
     There are no duplicate headers in the files except for the "id" field.
 
-    The report is a CSV file that includes all fields from the input data along with two fields:
+    The report is a CSV file that includes all fields from the input data, in the order they first appear in
+    the files (read in the order of the file names, see get_people_columns()), along with two fields:
     - "status": Either "dead" or "alive" based on the presence of a death date;
     - "age": The current age or the age of death, calculated in full years.
       If there is no birthdate, the age is set to -1.
@@ -261,58 +890,49 @@ def generate_people_report(person_data_directory: str, report_filename: str) ->
       If a name is not available, use "" (people with missing names should come before people with name);
     - If names are the same or the name field is missing, ordered by id ascending.
 
+    Dates are written in the format "dd.mm.yyyy" and missing values as "-". A death value that is not a date
+    is unknown: the person is alive and the age is calculated to today.
+
+    The lines of the files are streamed into sorted runs by id and merged into people, and the report lines
+    are sorted the same way, so the memory used does not grow with the number of people.
+
     :param person_data_directory: The directory containing CSV files.
     :param report_filename: The name of the file to write to.
+    :param max_people_in_memory: The number of lines or people sorted in memory at once. With more, sorted runs
+        of this size are saved to temporary files and merged.
+    :param use_table: Read the data with read_people_table(), which keeps all the people in memory in typed
+        columns and converts the columns by their data types.
     :return: None
     """
-    """
-    # Read data from CSV files
-    data = read_people_data(person_data_directory)
-
-    if not data:
-        return
-
-    # Calculate age, add "status" and "age" fields, and sort the data
-    processed_data = []
-    for person in data.values():
-        # Calculate age based on birth and death dates
-        try:
-            birthdate = person['birth']
-            deathdate = person['death']
-        except KeyError:
-            return
-        if birthdate is None:
-            age = -1
+    today = date.today()
+    with tempfile.TemporaryDirectory() as run_directory:
+        if use_table:
+            table = read_people_table(person_data_directory)
+            columns = get_people_columns(table.headers)
+            people = map(table.get_row, range(len(table)))
         else:
-            birthdate_datetime = datetime.combine(birthdate, datetime.min.time())
-            if deathdate is not None:
-                deathdate_datetime = datetime.combine(deathdate, datetime.min.time())
-                age = (deathdate_datetime - birthdate_datetime).days // 365
-            else:
-                age = (datetime.now() - birthdate_datetime).days // 365
-
-        # Add "status" and "age" fields
-        person["status"] = "alive" if deathdate is None else "dead"
-        person["age"] = age
-
-        processed_data.append(person)
-
-    # Sort the data based on specified criteria
-    processed_data.sort(key=lambda x: (x["age"], x["birth"], x.get("name", ""), x["id"]))
+            file_paths = get_people_file_paths(person_data_directory)
+            columns = get_people_columns(map(read_header, file_paths))
+            people = merge_people_lines(sort_records(iter_people_lines(file_paths), run_directory,
+                                                     max_people_in_memory))
+
+        records = sort_records((get_report_record(person, columns, today) for person in people), run_directory,
+                               max_people_in_memory)
+        first_record = next(records, None)
+        if first_record is None:
+            return
 
-    # Write the sorted data to a new CSV file
-    with open(report_filename, 'w', newline='') as report_file:
-        fieldnames = list(data[0].keys()) + ["status", "age"]
-        csv_writer = csv.DictWriter(report_file, fieldnames=fieldnames)
-        csv_writer.writeheader()
-        csv_writer.writerows(processed_data)
-    """
+        with open(report_filename, 'w', newline='', buffering=REPORT_BUFFER_SIZE) as report_file:
+            csv_writer = csv.writer(report_file)
+            csv_writer.writerow(columns + ["status", "age"])
+            csv_writer.writerows(map(itemgetter(1), chain([first_record], records)))
 
 
-result = read_csv_file_into_list_of_dicts_using_datatypes("test.csv")
+if __name__ == '__main__':
+    result = read_csv_file_into_list_of_dicts_using_datatypes("test.csv")
 
-# Print the result for verification
-for row in result:
-    print(row)
+    # Print the result for verification
+    for row in result:
+        print(row)
 
-print(read_people_data("data"))
+    print(read_people_data("data"))
@@ -0,0 +1,301 @@
+"""File handling tests, typed CSV reading against the previous implementation."""
+import csv
+import json
+import os
+import random
+from datetime import date
+
+import pytest
+
+from benchmark_file_handling import legacy_read_csv_file_into_list_of_dicts_using_datatypes, write_people_file
+from file_handling import (SCHEMA_SUFFIX, classify_value, convert_column, fit_type, infer_column_type, infer_schema,
+                           iter_csv_typed, load_cached_schema, load_schema,
+                           read_csv_file_into_list_of_dicts_using_datatypes, read_people_data, save_schema,
+                           generate_people_report, read_people_table, sort_records, to_date, to_int, to_missing,
+                           to_str)
+
+PEOPLE_FILES = {
+    "a.csv": "id,name\n1,john\n2,mary\n3,john\n",
+    "births.csv": "id,birth\n1,01.01.2001\n2,05.06.1990\n",
+    "deaths.csv": "id,death\n2,01.02.2022\n1,-\n",
+}
+MIXED_CSV = "name,age,born,empty\njohn,11,-,-\nmary,14,01.01.2001,-\nago,unknown,02.02.2002,-\n"
+
+
+def write_csv(tmp_path, text: str, name: str = "data.csv") -> str:
+    """Write the text into a CSV file and return its name."""
+    filename = str(tmp_path / name)
+    with open(filename, 'w', newline='') as f:
+        f.write(text)
+    return filename
+
+
+def test__classify_value():
+    """Test the regular expressions that tell ints and dates from text, whitespace and underscores like int()."""
+    for value, value_type in [("11", int), (" -4 ", int), ("+7", int), ("1_000", int), ("01.01.2022", date),
+                              (" 1.2.2023", date), ("-", None), (None, None), ("1__0", str), ("_1", str),
+                              ("١٢", str), ("1.2.23", str), ("late 2023", str), ("", str), ("4.5", str)]:
+        assert classify_value(value) is value_type, value
+
+
+def test__fit_type():
+    """Test that a value of another type, or one that can not be converted, makes the column str."""
+    assert fit_type(None, "5") is int
+    assert fit_type(int, "-") is int
+    assert fit_type(int, "01.01.2022") is str
+    assert fit_type(date, "31.02.2022") is str
+    assert fit_type(None, "29.02.2024") is date
+    assert infer_column_type(["1", "-", "2", "1"]) is int
+    assert infer_column_type(["-", None]) is None
+    assert infer_column_type(["01.01.2022", "x", "02.01.2022"]) is str
+
+
+def test__converters():
+    """Test the converter of every data type, a missing value is None for all of them."""
+    for convert in (to_missing, to_int, to_date, to_str):
+        assert convert("-") is None and convert(None) is None
+    assert to_int(" 1_000 ") == 1000
+    assert to_date("7.9.2023") == date(2023, 9, 7)
+    assert to_str(" text ") == " text "
+    with pytest.raises(ValueError):
+        to_missing("x")
+    with pytest.raises(ValueError):
+        to_date("31.02.2022")
+
+
+def test__convert_column_demotes_type():
+    """Test that a column is converted with its type and demoted when a value does not fit."""
+    assert convert_column(("1", "-", "2"), int) == ([1, None, 2], int)
+    assert convert_column(("1", "x"), int) == (["1", "x"], str)
+    assert convert_column(("-", "01.01.2022"), None) == ([None, date(2022, 1, 1)], date)
+    assert convert_column(("01.01.2022", "31.02.2022"), date) == (["01.01.2022", "31.02.2022"], str)
+
+
+def test__read_typed_same_as_before(tmp_path):
+    """Test the typed rows of a generated file against the previous implementation, also with a sample."""
+    filename = str(tmp_path / "people.csv")
+    write_people_file(filename, 2000)
+    expected = legacy_read_csv_file_into_list_of_dicts_using_datatypes(filename)
+    assert read_csv_file_into_list_of_dicts_using_datatypes(filename) == expected
+    assert read_csv_file_into_list_of_dicts_using_datatypes(filename, 10) == expected
+
+
+def test__read_typed_sample_value_does_not_fit(tmp_path):
+    """Test that a value after the sample that does not fit the sampled type makes its column str."""
+    filename = write_csv(tmp_path, "name,age,born\njohn,11,-\nmary,14,01.01.2001\nago,unknown,02.02.2002\n")
+    assert read_csv_file_into_list_of_dicts_using_datatypes(filename, 2) == [
+        {'name': "john", 'age': "11", 'born': None},
+        {'name': "mary", 'age': "14", 'born': date(2001, 1, 1)},
+        {'name': "ago", 'age': "unknown", 'born': date(2002, 2, 2)},
+    ]
+
+
+def test__read_typed_short_and_long_rows(tmp_path):
+    """Test that short rows are filled with None and extra values kept under None like csv.DictReader."""
+    filename = write_csv(tmp_path, "a,b\n1,2\n3\n\n4,5,x,y\n")
+    assert read_csv_file_into_list_of_dicts_using_datatypes(filename) == [
+        {'a': 1, 'b': 2}, {'a': 3, 'b': None}, {'a': 4, 'b': 5, None: ["x", "y"]}]
+    assert read_csv_file_into_list_of_dicts_using_datatypes(write_csv(tmp_path, "", "empty.csv")) == []
+
+
+def test__infer_schema(tmp_path):
+    """Test the data type names of the columns, of all rows and of a sample, saved and loaded as JSON."""
+    filename = write_csv(tmp_path, MIXED_CSV)
+    schema = infer_schema(filename)
+    assert schema == {'name': "str", 'age': "str", 'born': "date", 'empty': None}
+    assert infer_schema(filename, 2) == {'name': "str", 'age': "int", 'born': "date", 'empty': None}
+    save_schema(schema, str(tmp_path / "schema.json"))
+    assert load_schema(str(tmp_path / "schema.json")) == schema
+    assert infer_schema(write_csv(tmp_path, "", "empty.csv")) == {}
+
+
+def test__iter_csv_typed_same_as_read_typed(tmp_path):
+    """Test that the streamed rows are the same as the typed rows when the schema fits every value."""
+    filename = str(tmp_path / "people.csv")
+    write_people_file(filename, 2000)
+    expected = read_csv_file_into_list_of_dicts_using_datatypes(filename)
+    assert list(iter_csv_typed(filename)) == expected
+    assert list(iter_csv_typed(filename, infer_schema(filename))) == expected
+
+
+def test__iter_csv_typed_value_does_not_fit_schema(tmp_path):
+    """Test that a value that does not fit the schema is yielded as it was and its column is str from then on."""
+    filename = write_csv(tmp_path, MIXED_CSV + "kati,15,03.03.2003,4\n")
+    rows = list(iter_csv_typed(filename, {'name': "str", 'age': "int", 'born': "date", 'empty': None}))
+    assert [row['age'] for row in rows] == [11, 14, "unknown", "15"]
+    assert [row['born'] for row in rows] == [None, date(2001, 1, 1), date(2002, 2, 2), date(2003, 3, 3)]
+    assert [row['empty'] for row in rows] == [None, None, None, 4]
+    assert list(iter_csv_typed(write_csv(tmp_path, "", "empty.csv"))) == []
+
+
+def test__schema_cache_used_until_file_changes(tmp_path):
+    """Test that the sidecar schema is saved, used while the file is the same and not used after it changes."""
+    filename = write_csv(tmp_path, "name,age\njohn,11\nmary,14\n")
+    expected = read_csv_file_into_list_of_dicts_using_datatypes(filename)
+    assert read_csv_file_into_list_of_dicts_using_datatypes(filename, use_schema_cache=True) == expected
+    assert load_cached_schema(filename) == {'name': "str", 'age': "int"}
+    assert sorted(os.listdir(tmp_path)) == ["data.csv", "data.csv" + SCHEMA_SUFFIX]
+
+    # A schema that does not fit the values is only used as a start, the columns are still converted right.
+    with open(filename + SCHEMA_SUFFIX) as f:
+        cached = json.load(f)
+    cached["schema"]["name"] = "int"
+    with open(filename + SCHEMA_SUFFIX, 'w') as f:
+        json.dump(cached, f)
+    assert read_csv_file_into_list_of_dicts_using_datatypes(filename, use_schema_cache=True) == expected
+
+    with open(filename, 'a', newline='') as f:
+        f.write("ago,unknown\n")
+    assert load_cached_schema(filename) is None
+    assert read_csv_file_into_list_of_dicts_using_datatypes(filename, use_schema_cache=True)[2]['age'] == "unknown"
+    assert load_cached_schema(filename) == {'name': "str", 'age': "str"}
+
+
+def test__schema_cache_other_json_is_miss(tmp_path):
+    """Test that a sidecar file with other JSON in it is not used and is replaced by the inferred schema."""
+    filename = write_csv(tmp_path, "name,age\njohn,11\n")
+    for text in ['[1, 2]', '"schema"', 'null', '{"signature": [], "schema": {}}', '{"schema": 5}',
+                 '{"signature": {}, "schema": {"age": "float"}}', '{"signature": {}, "schema": {"age": []}}',
+                 '{not json']:
+        with open(filename + SCHEMA_SUFFIX, 'w') as f:
+            f.write(text)
+        assert load_cached_schema(filename) is None, text
+        assert read_csv_file_into_list_of_dicts_using_datatypes(filename, use_schema_cache=True) == [
+            {'name': "john", 'age': 11}]
+        assert load_cached_schema(filename) == {'name': "str", 'age': "int"}
+
+
+def test__schema_cache_read_only_directory(tmp_path, monkeypatch):
+    """Test that a schema that can not be saved is ignored and leaves no temporary file."""
+    filename = write_csv(tmp_path, "name,age\njohn,11\n")
+
+    def fail(*args, **kwargs):
+        raise OSError("read-only")
+    monkeypatch.setattr(os, "replace", fail)
+    assert read_csv_file_into_list_of_dicts_using_datatypes(filename, use_schema_cache=True) == [
+        {'name': "john", 'age': 11}]
+    assert os.listdir(tmp_path) == ["data.csv"]
+
+
+def write_people_files(directory, files: dict[str, str]) -> None:
+    """Write the people files into the directory."""
+    directory.mkdir(exist_ok=True)
+    for name, text in files.items():
+        write_csv(directory, text, name)
+
+
+def test__read_people_data_merged(tmp_path):
+    """Test the example of read_people_data(): every person has every column, None if it is missing."""
+    write_people_files(tmp_path, PEOPLE_FILES)
+    assert read_people_data(str(tmp_path)) == {
+        1: {"id": 1, "name": "john", "birth": date(2001, 1, 1), "death": None},
+        2: {"id": 2, "name": "mary", "birth": date(1990, 6, 5), "death": date(2022, 2, 1)},
+        3: {"id": 3, "name": "john", "birth": None, "death": None},
+    }
+
+
+def test__read_people_data_parallel_same_as_serial(tmp_path):
+    """Test that reading the files in worker processes gives the same people, values and key order."""
+    files = dict(PEOPLE_FILES)
+    files["towns.csv"] = "id,town,name\n3,Tartu,jaan\n4,Narva,-\n1,-,\n"
+    files["z.csv"] = "id,birth,score\n4,02.02.2002,7\n2,-,x\n"
+    write_people_files(tmp_path, files)
+    for typed in (False, True):
+        serial = read_people_data(str(tmp_path), typed)
+        parallel = read_people_data(str(tmp_path), typed, workers=3)
+        assert parallel == serial
+        assert list(parallel) == list(serial)
+        assert [list(person) for person in parallel.values()] == [list(person) for person in serial.values()]
+    assert serial[3]["name"] == "jaan" and serial[2]["score"] == "x"
+
+
+def read_report(filename: str) -> list[list[str]]:
+    """Return the lines of the report."""
+    with open(filename, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test__generate_people_report_order_and_age(tmp_path):
+    """Test the report lines: age in full years, the sort order, and a death that is not a date as unknown."""
+    today = date.today()
+    write_people_files(tmp_path / "people", {
+        "a.csv": "id,name\n1,john\n2,mary\n3,ago\n4,-\n5,kati\n6,peeter\n",
+        "births.csv": "id,birth\n1,01.01.1940\n2,02.01.1940\n3,01.01.1940\n4,01.01.1940\n6,01.01.1990\n",
+        "deaths.csv": "id,death\n1,01.01.2022\n2,01.01.2022\n3,01.01.2022\n4,01.01.2022\n6,unknown\n",
+    })
+    report_filename = str(tmp_path / "report.csv")
+    generate_people_report(str(tmp_path / "people"), report_filename)
+    age = today.year - 1990 - ((today.month, today.day) < (1, 1))
+    assert read_report(report_filename) == [
+        ["id", "name", "birth", "death", "status", "age"],
+        ["6", "peeter", "01.01.1990", "unknown", "alive", str(age)],
+        ["2", "mary", "02.01.1940", "01.01.2022", "dead", "81"],
+        ["4", "-", "01.01.1940", "01.01.2022", "dead", "82"],
+        ["3", "ago", "01.01.1940", "01.01.2022", "dead", "82"],
+        ["1", "john", "01.01.1940", "01.01.2022", "dead", "82"],
+        ["5", "kati", "-", "-", "alive", "-1"],
+    ]
+
+
+def test__generate_people_report_runs_same_as_in_memory(tmp_path):
+    """Test that the report sorted in many small runs is the same as the one sorted in memory."""
+    rng = random.Random(1)
+    files = {"a.csv": ["id,name"], "births.csv": ["id,birth"], "deaths.csv": ["id,death"]}
+    for person_id in rng.sample(range(1, 10_000), 500):
+        files["a.csv"].append(f"{person_id},{rng.choice(['john', 'mary', '-', ''])}")
+        files["births.csv"].append(f"{person_id},{rng.randint(1, 28):02}.{rng.randint(1, 12):02}."
+                                   f"{rng.randint(1900, 2000)}")
+        if rng.random() < 0.5:
+            files["deaths.csv"].append(f"{person_id},{rng.randint(1, 28):02}.{rng.randint(1, 12):02}.2020")
+    files["a.csv"].append(f"{person_id},renamed")
+    write_people_files(tmp_path / "people", {name: "\n".join(lines) + "\n" for name, lines in files.items()})
+
+    generate_people_report(str(tmp_path / "people"), str(tmp_path / "memory.csv"))
+    generate_people_report(str(tmp_path / "people"), str(tmp_path / "runs.csv"), max_people_in_memory=3)
+    generate_people_report(str(tmp_path / "people"), str(tmp_path / "table.csv"), use_table=True)
+    report = read_report(str(tmp_path / "memory.csv"))
+    assert len(report) == 501
+    assert report == read_report(str(tmp_path / "runs.csv")) == read_report(str(tmp_path / "table.csv"))
+    assert [str(person_id), "renamed"] in [line[:2] for line in report]
+
+
+def test__sort_records_in_runs(tmp_path):
+    """Test that records sorted in runs, merged more than once, are in the same order as sorted in memory."""
+    rng = random.Random(1)
+    records = [((rng.randint(0, 100), i), str(i)) for i in range(2000)]
+    assert list(sort_records(iter(records), str(tmp_path), 7)) == sorted(records)
+    assert list(sort_records(iter(records), str(tmp_path), 5000)) == sorted(records)
+
+
+def test__people_table_same_as_read_people_data(tmp_path):
+    """Test that the table has the same people as read_people_data(typed=True), with columns of mixed types."""
+    files = dict(PEOPLE_FILES)
+    files["towns.csv"] = "id,town,name\n3,Tartu,jaan\n4,Narva,-\n1,-,\n"
+    files["y.csv"] = "id,birth,score\n4,02.02.2002,7\n5,-,99999999999999999999\n"
+    files["z.csv"] = "id,score\n2,x\n"
+    write_people_files(tmp_path, files)
+    table = read_people_table(str(tmp_path))
+    expected = read_people_data(str(tmp_path), typed=True)
+    assert len(table) == len(expected) == 5
+    assert list(table) == list(expected)
+    assert dict(table.items()) == expected
+    assert table[2]["score"] == "x" and table[5]["score"] == 99999999999999999999 and table[4]["score"] == 7
+    assert table.headers == [["id", "name"], ["id", "birth"], ["id", "death"], ["id", "town", "name"],
+                             ["id", "birth", "score"], ["id", "score"]]
+
+
+def test__people_table_lookup(tmp_path):
+    """Test finding people by id before and after finish(), and ids that are not in the table."""
+    write_people_files(tmp_path, PEOPLE_FILES)
+    table = read_people_table(str(tmp_path))
+    assert table[3] == {"id": 3, "name": "john", "birth": None, "death": None}
+    assert 2 in table and 7 not in table and "2" not in table and 0 not in table
+    assert table.get(7) is None
+
+    table.add_columns(["id", "name"], [[7, 1], ["kati", "johannes"]], [int, str])
+    assert table.index is not None
+    assert table[7]["name"] == "kati" and table[1]["name"] == "johannes"
+    table.finish()
+    assert list(table) == [1, 2, 3, 7]
+    assert [table[person_id]["name"] for person_id in table] == ["johannes", "mary", "john", "kati"]
+    assert len(table) == 4 and 8 not in table
@@ -1,5 +1,14 @@
 """Library API."""
-import re
+import gzip
+import heapq
+import math
+import os
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import date
+from urllib.parse import parse_qs, unquote, urlsplit
 
 
 class Person:
@@ -9,113 +18,471 @@ class Person:
         """Construct a person."""
 
 
+def parse_date(text: str) -> int:
+    """Return the day number (date ordinal) of a date like 2023-12-24 or 24.12.2023."""
+    if len(text) == 10 and text[4] == '-':
+        return date.fromisoformat(text).toordinal()
+    parts = text.split('.')
+    if len(parts) == 3:
+        day, month, year = parts
+        return date(int(year), int(month), int(day)).toordinal()
+    raise ValueError(f"Invalid date {text!r}.")
+
+
+def get_month_range(month: str) -> tuple[str, str]:
+    """Return the first and the last date of a month like 2023-12."""
+    year, month = map(int, month.split('-'))
+    first = date(year, month, 1)
+    last = date(year + month // 12, month % 12 + 1, 1).toordinal() - 1
+    return first.isoformat(), date.fromordinal(last).isoformat()
+
+
+def open_transactions(filename: str):
+    """Open a transaction file for reading bytes, gzip-compressed if the name ends with .gz."""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
 class LibraryStats:
-    """LibraryStats is important for saving data and requesting them."""
+    """LibraryStats is important for saving data and requesting them.
+
+    All answers are kept up to date while the transactions are read, so that no request
+    has to go over the transactions again. The file is read line by line; book and borrower
+    names are interned and stored once, and dates are kept as day numbers in arrays.
+
+    The file is append-only, so refresh() reads only the lines added after the last read,
+    and follow() does that periodically in a background thread. Every query takes self.lock,
+    so it never sees a transaction half added or the answers cleared by reset().
+    """
 
-    def __init__(self, filename):
+    def __init__(self, filename, encoding='utf-8'):
         """Construct the object by reading the file.
 
         file format: kuupäev;raamatu nimi;laenutaja nimi;tegevus
+        The file may be gzip-compressed (.gz). Lines that do not have 4 fields are skipped and
+        reported in self.parse_errors as (line number, reason). A transaction with a date that
+        can not be read is counted like any other, but left out of the date range and overdue queries.
+        """
+        self.filename = filename
+        self.encoding = encoding
+        self.lock = threading.Lock()
+        self.stop_event = None
+        self.follower = None
+        # version grows every time new transactions are read, so cached answers can be checked.
+        self.version = 0
+        with self.lock:
+            self.reset()
+            self.read_lines(complete_only=False)
+
+    def reset(self):
+        """Forget all transactions read so far."""
+        self.offset = 0
+        # Every distinct date string as written in the file, and date string -> (index, day number or None).
+        self.date_texts = []
+        self.parsed_dates = {}
+        self.parse_errors = []
+        self.line_count = 0
+        self.total_transactions = 0
+
+        self.book_ids = {}
+        self.book_titles = []
+        self.book_borrow_dates = []
+        self.book_borrow_date_ids = []
+        self.book_statuses = []
+
+        self.borrower_ids = {}
+        self.borrower_names = []
+        self.borrower_histories = []
+        self.borrower_borrow_dates = []
+        self.borrower_borrow_counts = []
+        self.borrower_transaction_counts = []
+        self.borrower_book_counts = []
+        self.favourite_books = []
+        self.most_frequent_borrower = None
+
+        # Every borrow as (day, book, borrower) in parallel arrays, sorted by day before a query.
+        self.borrow_days = array('i')
+        self.borrow_books = array('i')
+        self.borrow_borrowers = array('i')
+        self.borrows_sorted = True
+        # While the file is in date order, the borrow dates of every book and borrower are sorted too.
+        self.in_date_order = True
+        # Day of the last borrow of every book that is out now, and the same as (day, book) pairs sorted by day.
+        self.books_out_since = {}
+        self.books_out = []
+
+    def read_lines(self, complete_only: bool) -> int:
+        """Read the lines after self.offset and return the number of new transactions.
+
+        :param complete_only: stop before a last line without a line break, as it may still be written
+        """
+        offset = self.offset
+        total_transactions = self.total_transactions
+        with open_transactions(self.filename) as f:
+            f.seek(self.offset)
+            for line in f:
+                if complete_only and not line.endswith(b'\n'):
+                    break
+                self.offset += len(line)
+                self.add_line(line)
+        if self.offset != offset:
+            self.version += 1
+        return self.total_transactions - total_transactions
+
+    def refresh(self) -> int:
+        """Read the lines appended to the file since the last read and return the number of new transactions.
+
+        If the file has become shorter than what has been read, it has been replaced and is read again
+        from the beginning. A gzip-compressed file is a finished log and is not followed, as it can only
+        be read from its start, so refreshing it reads nothing.
+        """
+        if self.filename.endswith('.gz'):
+            return 0
+        with self.lock:
+            if os.path.getsize(self.filename) < self.offset:
+                self.reset()
+                self.version += 1
+            return self.read_lines(complete_only=True)
+
+    def follow(self, interval: float = 1.0) -> None:
+        """Start a background thread that refreshes the data every interval seconds, not for a .gz file."""
+        if self.follower is not None or self.filename.endswith('.gz'):
+            return
+        self.stop_event = threading.Event()
+        self.follower = threading.Thread(target=self.run_follower, args=(self.stop_event, interval), daemon=True)
+        self.follower.start()
+
+    def run_follower(self, stop_event: threading.Event, interval: float) -> None:
+        """Refresh the data until stop_event is set, a missing file is tried again later."""
+        while not stop_event.wait(interval):
+            try:
+                self.refresh()
+            except OSError:
+                continue
+
+    def stop_following(self) -> None:
+        """Stop the background thread started by follow()."""
+        if self.follower is None:
+            return
+        self.stop_event.set()
+        self.follower.join()
+        self.follower = None
+        self.stop_event = None
+
+    def add_line(self, line: bytes) -> None:
+        """Read one line of the file, a malformed line is added to self.parse_errors."""
+        self.line_count += 1
+        text = line.decode(self.encoding, errors='replace').strip()
+        if not text:
+            return
+
+        parts = text.split(';')
+        if len(parts) != 4:
+            self.parse_errors.append((self.line_count, f"Expected 4 fields, got {len(parts)}."))
+            return
+
+        self.add_transaction(*parts)
+
+    def get_book_id(self, book: str) -> int:
+        """Return the number of the book, adding it if it is new."""
+        book_id = self.book_ids.get(book)
+        if book_id is None:
+            book_id = len(self.book_titles)
+            book = sys.intern(book)
+            self.book_ids[book] = book_id
+            self.book_titles.append(book)
+            self.book_borrow_dates.append(array('i'))
+            self.book_borrow_date_ids.append(array('i'))
+            self.book_statuses.append(None)
+        return book_id
+
+    def get_borrower_id(self, borrower: str) -> int:
+        """Return the number of the borrower, adding them if they are new."""
+        borrower_id = self.borrower_ids.get(borrower)
+        if borrower_id is None:
+            borrower_id = len(self.borrower_names)
+            borrower = sys.intern(borrower)
+            self.borrower_ids[borrower] = borrower_id
+            self.borrower_names.append(borrower)
+            self.borrower_histories.append(array('i'))
+            self.borrower_borrow_dates.append(array('i'))
+            self.borrower_borrow_counts.append(0)
+            self.borrower_transaction_counts.append(0)
+            self.borrower_book_counts.append({})
+            self.favourite_books.append(None)
+        return borrower_id
+
+    def add_transaction(self, date: str, book: str, borrower: str, action: str) -> None:
+        """Update every answer with one transaction."""
+        parsed_date = self.parsed_dates.get(date)
+        if parsed_date is None:
+            try:
+                day = parse_date(date)
+            except ValueError:
+                day = None
+            parsed_date = self.parsed_dates[date] = (len(self.date_texts), day)
+            self.date_texts.append(sys.intern(date))
+        date_id, day = parsed_date
+
+        self.total_transactions += 1
+        action = sys.intern(action)
+        book_id = self.get_book_id(book)
+        borrower_id = self.get_borrower_id(borrower)
+
+        self.book_statuses[book_id] = action
+        self.borrower_histories[borrower_id].append(book_id)
+
+        if action == 'laenutus':
+            self.add_borrow(day, date_id, book_id, borrower_id)
+        elif action == 'tagastus':
+            self.remove_book_out(book_id)
+
+        # Favourite book is the most frequent (book, action) pair, on a tie the one seen first.
+        book_counts = self.borrower_book_counts[borrower_id]
+        key = (book_id, action)
+        if key not in book_counts:
+            book_counts[key] = [0, len(book_counts)]
+        book_counts[key][0] += 1
+        count, first_seen = book_counts[key]
+        favourite = self.favourite_books[borrower_id]
+        if favourite is None or count > favourite[0] or (count == favourite[0] and first_seen < favourite[1]):
+            self.favourite_books[borrower_id] = (count, first_seen, book_id)
+
+        # Most frequent borrower has the most transactions, on a tie the one seen first (lower id).
+        self.borrower_transaction_counts[borrower_id] += 1
+        leader = self.most_frequent_borrower
+        if leader is None or ((self.borrower_transaction_counts[borrower_id], -borrower_id)
+                              > (self.borrower_transaction_counts[leader], -leader)):
+            self.most_frequent_borrower = borrower_id
+
+    def add_borrow(self, day: int | None, date_id: int, book_id: int, borrower_id: int) -> None:
+        """Add the borrow to the date indexes and mark the book as out since the day.
+
+        A borrow with a date that can not be read (day is None) is only counted, the book is out
+        since an unknown day then and is not in the overdue books.
         """
-        self.user_transactions = {}
-        self.book_transactions = {}
+        self.book_borrow_date_ids[book_id].append(date_id)
+        self.borrower_borrow_counts[borrower_id] += 1
+        self.remove_book_out(book_id)
+        if day is None:
+            return
+
+        if self.borrow_days and day < self.borrow_days[-1]:
+            self.borrows_sorted = False
+            self.in_date_order = False
+        self.borrow_days.append(day)
+        self.borrow_books.append(book_id)
+        self.borrow_borrowers.append(borrower_id)
+        self.book_borrow_dates[book_id].append(day)
+        self.borrower_borrow_dates[borrower_id].append(day)
+
+        self.books_out_since[book_id] = day
+        insort(self.books_out, (day, book_id))
+
+    def remove_book_out(self, book_id: int) -> None:
+        """Remove the book from the books that are out, if it is out."""
+        day = self.books_out_since.pop(book_id, None)
+        if day is not None:
+            del self.books_out[bisect_left(self.books_out, (day, book_id))]
 
-        with open(filename, 'r') as f:
-            lines = f.readlines()
+    def sort_borrows(self) -> None:
+        """Sort the borrows by day, borrows of the same day stay in the order of the file."""
+        if self.borrows_sorted:
+            return
+        order = sorted(range(len(self.borrow_days)), key=self.borrow_days.__getitem__)
+        for borrows in (self.borrow_days, self.borrow_books, self.borrow_borrowers):
+            borrows[:] = array('i', [borrows[i] for i in order])
+        self.borrows_sorted = True
 
-            for line in lines:
-                parts = line.strip().split(';')
-                date, book, borrower, action = parts
+    def count_borrows(self, start: str | None, end: str | None, k: int, entities: array,
+                      entity_dates: list[array]) -> list[tuple[int, int]]:
+        """Return the k (id, borrows) pairs with the most borrows between start and end, both included.
 
-                if borrower not in self.user_transactions:
-                    self.user_transactions[borrower] = []
-                self.user_transactions[borrower].append((book, action))
+        The borrows in the range are counted from the date-sorted arrays, or, if that is cheaper, the range
+        is searched in the borrow dates of every book or borrower. Ties go to the one seen first.
 
-                if book not in self.book_transactions:
-                    self.book_transactions[book] = []
-                self.book_transactions[book].append((action, date))
+        :param start: first date or None to count from the beginning
+        :param end: last date or None to count to the end
+        :param k: number of results
+        :param entities: book or borrower id of every borrow in the date-sorted arrays
+        :param entity_dates: borrow dates of every book or borrower
+        """
+        first = parse_date(start) if start else -math.inf
+        last = parse_date(end) if end else math.inf
+        self.sort_borrows()
+        lo = bisect_left(self.borrow_days, first)
+        hi = bisect_right(self.borrow_days, last)
+
+        if self.in_date_order and len(entity_dates) * math.log2(len(self.borrow_days) + 2) < hi - lo:
+            counts = ((entity_id, bisect_right(dates, last) - bisect_left(dates, first))
+                      for entity_id, dates in enumerate(entity_dates))
+        else:
+            counts = {}
+            for entity_id in entities[lo:hi]:
+                counts[entity_id] = counts.get(entity_id, 0) + 1
+            counts = counts.items()
+        top = heapq.nlargest(k, counts, key=lambda item: (item[1], -item[0]))
+        return [(entity_id, count) for entity_id, count in top if count > 0]
 
     def get_borrower_names(self) -> list[str]:
         """Return a list of borrowers' names."""
-        return list(self.user_transactions.keys())
+        with self.lock:
+            return list(self.borrower_names)
 
     def get_book_titles(self) -> list[str]:
         """Return a list of book titles."""
-        return list(self.book_transactions.keys())
+        with self.lock:
+            return list(self.book_titles)
 
     def get_total_transactions(self) -> int:
         """Return the sum of total transactions."""
-        return sum(len(value) for value in self.book_transactions.values())
+        with self.lock:
+            return self.total_transactions
 
     def get_total_borrows_of_book(self, book_name: str) -> int:
         """Return the num of times a book has been borrowed."""
-        if book_name in self.book_transactions:
-            return sum(1 for action, date in self.book_transactions[book_name] if action == "laenutus")
-        else:
-            return 0
+        with self.lock:
+            if book_name not in self.book_ids:
+                return 0
+            return len(self.book_borrow_date_ids[self.book_ids[book_name]])
 
     def get_total_borrows_by(self, borrower_name: str) -> int:
         """Return the num of times the person has borrowed books."""
-        return sum(1 for book, action in self.user_transactions[borrower_name] if action == 'laenutus')
+        with self.lock:
+            return self.borrower_borrow_counts[self.borrower_ids[borrower_name]]
 
     def get_favourite_book(self, borrower_name: str) -> str:
         """Return the most borrowed book by the person."""
-        my_list = self.user_transactions[borrower_name]
-        return max(my_list, key=my_list.count)[0]
+        with self.lock:
+            return self.book_titles[self.favourite_books[self.borrower_ids[borrower_name]][2]]
 
     def get_borrow_history(self, borrower_name: str) -> list[str]:
         """Return a list of books borrowed by person."""
-        return [t[0] for t in self.user_transactions[borrower_name]]
+        with self.lock:
+            return [self.book_titles[book_id] for book_id in self.borrower_histories[self.borrower_ids[borrower_name]]]
 
     def get_most_frequent_borrower(self, book_name: str) -> str:
         """Return the person with the most borrows."""
-        return max(self.user_transactions, key=lambda x: len(self.user_transactions[x]))
+        with self.lock:
+            if self.most_frequent_borrower is None:
+                raise ValueError("No borrowers.")
+            return self.borrower_names[self.most_frequent_borrower]
 
     def get_borrow_dates(self, book_name: str) -> list[str]:
         """Return a list of dates when book was borrowed."""
-        return [date for action, date in self.book_transactions[book_name] if action == 'laenutus']
+        with self.lock:
+            return [self.date_texts[date_id] for date_id in self.book_borrow_date_ids[self.book_ids[book_name]]]
 
     def get_current_status(self, book_name: str) -> str:
         """Return the status of book - 'laenutatud' or 'tagastatud'."""
-        if book_name in self.book_transactions:
-            if self.book_transactions[book_name][-1][0] == 'tagastus':
+        with self.lock:
+            if book_name not in self.book_ids or self.book_statuses[self.book_ids[book_name]] == 'tagastus':
                 return 'tagastatud'
             else:
                 return 'laenutatud'
-        else:
-            return "tagastatud"
+
+    def get_most_borrowed_books(self, start: str | None = None, end: str | None = None,
+                                k: int = 10) -> list[tuple[str, int]]:
+        """Return the k books borrowed most between the two dates (both included) with the number of borrows."""
+        with self.lock:
+            top = self.count_borrows(start, end, k, self.borrow_books, self.book_borrow_dates)
+        return [(self.book_titles[book_id], count) for book_id, count in top]
+
+    def get_top_borrowers(self, start: str | None = None, end: str | None = None,
+                          k: int = 10) -> list[tuple[str, int]]:
+        """Return the k people who borrowed most between the two dates (both included) with the number of borrows."""
+        with self.lock:
+            top = self.count_borrows(start, end, k, self.borrow_borrowers, self.borrower_borrow_dates)
+        return [(self.borrower_names[borrower_id], count) for borrower_id, count in top]
+
+    def get_books_out_longer_than(self, days: int, today: str | None = None) -> list[str]:
+        """Return the books that have been out for more than the number of days, the longest out first.
+
+        The books that are out are kept sorted by the day they were borrowed, so the overdue ones are found
+        with a binary search. A book is out when its last transaction is not a return, the same as
+        get_current_status(), whoever borrowed or returned it.
+        """
+        today = parse_date(today) if today else date.today().toordinal()
+        with self.lock:
+            overdue = self.books_out[:bisect_left(self.books_out, (today - days,))]
+            return [self.book_titles[book_id] for _, book_id in overdue]
 
 
 class Controller:
-    """Communicate with LibraryStats functionality."""
+    """Communicate with LibraryStats functionality.
+
+    Routes are looked up by path segments in dictionaries, so dispatching does not depend
+    on the number of routes. Book and borrower names in the path may be URL-encoded.
+    """
 
     def __init__(self, library_stats: LibraryStats):
         """Construct the controller that has all necessary information."""
         self.library_stats = library_stats
-        self.path_function_map = {
-            r'/book/([^/]+)/borrows': self.library_stats.get_total_borrows_of_book,
-            r'/book/([^/]+)/most-frequent-borrower': self.library_stats.get_most_frequent_borrower,
-            r'/book/([^/]+)/borrow-dates': self.library_stats.get_borrow_dates,
-            r'/book/([^/]+)/current-status': self.library_stats.get_current_status,
-            r'/borrower/([^/]+)/total-borrows': self.library_stats.get_total_borrows_by,
-            r'/borrower/([^/]+)/favourite-book': self.library_stats.get_favourite_book,
-            r'/borrower/([^/]+)/borrow-history': self.library_stats.get_borrow_history,
+        self.collection_routes = {
+            'books': self.library_stats.get_book_titles,
+            'borrowers': self.library_stats.get_borrower_names,
+            'total': self.library_stats.get_total_transactions,
         }
+        self.item_routes = {
+            ('book', 'borrows'): self.library_stats.get_total_borrows_of_book,
+            ('book', 'most-frequent-borrower'): self.library_stats.get_most_frequent_borrower,
+            ('book', 'borrow-dates'): self.library_stats.get_borrow_dates,
+            ('book', 'current-status'): self.library_stats.get_current_status,
+            ('borrower', 'total-borrows'): self.library_stats.get_total_borrows_by,
+            ('borrower', 'favourite-book'): self.library_stats.get_favourite_book,
+            ('borrower', 'borrow-history'): self.library_stats.get_borrow_history,
+        }
+        self.query_routes = {
+            ('books', 'most-borrowed'): self.get_most_borrowed_books,
+            ('borrowers', 'top'): self.get_top_borrowers,
+            ('books', 'overdue'): self.get_overdue_books,
+        }
+
+    def resolve(self, path: str):
+        """Return the function and arguments for the path, or None if no route matches."""
+        url = urlsplit(path)
+        parts = url.path.split('/')
+        if parts[0] != '':
+            return None
+
+        if len(parts) == 2 and parts[1] in self.collection_routes:
+            return self.collection_routes[parts[1]], ()
+
+        if len(parts) == 3 and (parts[1], parts[2]) in self.query_routes:
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            return self.query_routes[parts[1], parts[2]], (query,)
+
+        if len(parts) == 4 and parts[2]:
+            func = self.item_routes.get((parts[1], parts[3]))
+            if func is not None:
+                return func, (unquote(parts[2]),)
+
+        return None
+
+    def get_most_borrowed_books(self, query: dict[str, str]) -> list[tuple[str, int]]:
+        """Return the most borrowed books for /books/most-borrowed?start=...&end=...&k=..."""
+        return self.library_stats.get_most_borrowed_books(query.get('start'), query.get('end'),
+                                                          int(query.get('k', 10)))
+
+    def get_top_borrowers(self, query: dict[str, str]) -> list[tuple[str, int]]:
+        """Return the top borrowers for /borrowers/top?start=...&end=...&k=... or /borrowers/top?month=2023-12."""
+        start, end = query.get('start'), query.get('end')
+        if 'month' in query:
+            start, end = get_month_range(query['month'])
+        return self.library_stats.get_top_borrowers(start, end, int(query.get('k', 10)))
+
+    def get_overdue_books(self, query: dict[str, str]) -> list[str]:
+        """Return the books out for longer than the days for /books/overdue?days=...&today=..."""
+        return self.library_stats.get_books_out_longer_than(int(query.get('days', 0)), query.get('today'))
 
     def get(self, path: str):
         """Get request."""
-        if path == '/books':
-            return self.library_stats.get_book_titles()
-        elif path == '/borrowers':
-            return self.library_stats.get_borrower_names()
-        elif path == '/total':
-            return self.library_stats.get_total_transactions()
-
-        for pattern, func in self.path_function_map.items():
-            match = re.match(pattern, path)
-            if match:
-                name = match.group(1)
-                return func(name)
+        route = self.resolve(path)
 
         # Handle cases where no match was found
-        return "No matching route found"
+        if route is None:
+            return "No matching route found"
+
+        func, args = route
+        return func(*args)
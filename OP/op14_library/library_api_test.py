@@ -0,0 +1,182 @@
+"""Library API tests, answers of LibraryStats and Controller against the transactions written."""
+import gzip
+import random
+import threading
+from collections import Counter
+
+from library_api import Controller, LibraryStats
+
+TRANSACTIONS = [
+    "2023-01-02;Tõde ja õigus;mari;laenutus",
+    "2023-01-03;Kevade;jaan;laenutus",
+    "2023-01-10;Tõde ja õigus;mari;tagastus",
+    "2023-01-11;Kevade;jaan;tagastus",
+    "2023-01-12;Kevade;mari;laenutus",
+    "2023-02-01;Rehepapp;jaan;laenutus",
+    "2023-02-03;Tõde ja õigus;kati;laenutus",
+]
+
+
+def write_transactions(tmp_path, lines: list[str], name: str = "transactions.txt") -> str:
+    """Write the transaction lines into a file and return its name."""
+    filename = str(tmp_path / name)
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    return filename
+
+
+def test__borrow_dates_as_written(tmp_path):
+    """Test that the borrow dates are returned as written in the file, whatever their format."""
+    lines = ["1.2.2023;A;mari;laenutus", "02.02.2023;A;mari;tagastus", "2023-02-05;A;jaan;laenutus"]
+    library_stats = LibraryStats(write_transactions(tmp_path, lines))
+    assert Controller(library_stats).get('/book/A/borrow-dates') == ["1.2.2023", "2023-02-05"]
+
+
+def test__transaction_with_unreadable_date_counted(tmp_path):
+    """Test that a transaction with a date that can not be read is counted but left out of the date queries."""
+    lines = [*TRANSACTIONS, "2023/12/03;Lumekuninganna;kati;laenutus", "2023-02-04;Rehepapp;jaan;tagastus"]
+    library_stats = LibraryStats(write_transactions(tmp_path, lines))
+    controller = Controller(library_stats)
+    assert "Lumekuninganna" in controller.get('/books')
+    assert controller.get('/total') == len(lines)
+    assert controller.get('/book/Lumekuninganna/borrow-dates') == ["2023/12/03"]
+    assert controller.get('/book/Lumekuninganna/borrows') == 1
+    assert controller.get('/book/Lumekuninganna/current-status') == 'laenutatud'
+    assert controller.get('/borrower/kati/total-borrows') == 2
+    assert library_stats.parse_errors == []
+    assert library_stats.get_books_out_longer_than(0, '2024-01-01') == ["Kevade", "Tõde ja õigus"]
+    assert library_stats.get_top_borrowers('2023-01-01', '2023-12-31') == [("mari", 2), ("jaan", 2), ("kati", 1)]
+
+
+def test__line_without_4_fields_skipped(tmp_path):
+    """Test that a line with a wrong number of fields is reported and the other lines are read."""
+    lines = [*TRANSACTIONS[:2], "2023-01-05;Kevade;laenutus", *TRANSACTIONS[2:]]
+    library_stats = LibraryStats(write_transactions(tmp_path, lines))
+    assert library_stats.parse_errors == [(3, "Expected 4 fields, got 3.")]
+    assert library_stats.get_total_transactions() == len(TRANSACTIONS)
+
+
+def test__refresh_reads_appended_lines(tmp_path):
+    """Test that refresh() reads the complete lines appended to the file and a replaced file from its start."""
+    filename = write_transactions(tmp_path, TRANSACTIONS[:3])
+    library_stats = LibraryStats(filename)
+    version = library_stats.version
+    with open(filename, 'a', encoding='utf-8') as f:
+        f.write("\n".join(TRANSACTIONS[3:]) + "\n2023-03-01;Kevade;kati;lae")
+    assert library_stats.refresh() == len(TRANSACTIONS) - 3
+    assert library_stats.version > version
+    assert library_stats.get_total_transactions() == len(TRANSACTIONS)
+    with open(filename, 'a', encoding='utf-8') as f:
+        f.write("nutus\n")
+    assert library_stats.refresh() == 1
+    assert library_stats.get_total_borrows_of_book("Kevade") == 3
+
+    write_transactions(tmp_path, TRANSACTIONS[:2])
+    library_stats.refresh()
+    assert library_stats.get_total_transactions() == 2
+    assert library_stats.get_book_titles() == ["Tõde ja õigus", "Kevade"]
+
+
+def test__gzip_file_read_once_and_not_followed(tmp_path):
+    """Test that a gzip-compressed file is read when constructed and that refresh() and follow() leave it."""
+    filename = str(tmp_path / "transactions.txt.gz")
+    with gzip.open(filename, 'wt', encoding='utf-8') as f:
+        f.write("\n".join(TRANSACTIONS) + "\n")
+    library_stats = LibraryStats(filename)
+    assert library_stats.get_total_transactions() == len(TRANSACTIONS)
+    assert library_stats.refresh() == 0
+    library_stats.follow(0.01)
+    assert library_stats.follower is None
+
+
+def test__query_waits_for_lock(tmp_path):
+    """Test that a plain query waits while the lock is held, so it never reads the answers half updated."""
+    library_stats = LibraryStats(write_transactions(tmp_path, TRANSACTIONS))
+    results = []
+    with library_stats.lock:
+        reader = threading.Thread(target=lambda: results.append(library_stats.get_borrower_names()))
+        reader.start()
+        reader.join(0.05)
+        assert reader.is_alive()
+        library_stats.reset()
+        library_stats.read_lines(complete_only=False)
+    reader.join()
+    assert results == [["mari", "jaan", "kati"]]
+
+
+def test__answers_of_every_route(tmp_path):
+    """Test the answer of every Controller route, with URL-encoded names and paths that do not match."""
+    controller = Controller(LibraryStats(write_transactions(tmp_path, TRANSACTIONS)))
+    expected = {
+        '/books': ["Tõde ja õigus", "Kevade", "Rehepapp"],
+        '/borrowers': ["mari", "jaan", "kati"],
+        '/total': 7,
+        '/book/T%C3%B5de%20ja%20%C3%B5igus/borrows': 2,
+        '/book/Kevade/borrows': 2,
+        '/book/Lumekuninganna/borrows': 0,
+        '/book/Kevade/most-frequent-borrower': "mari",
+        '/book/Kevade/borrow-dates': ["2023-01-03", "2023-01-12"],
+        '/book/Kevade/current-status': 'laenutatud',
+        '/book/Lumekuninganna/current-status': 'tagastatud',
+        '/borrower/mari/total-borrows': 2,
+        '/borrower/mari/favourite-book': "Tõde ja õigus",
+        '/borrower/jaan/favourite-book': "Kevade",
+        '/borrower/mari/borrow-history': ["Tõde ja õigus", "Tõde ja õigus", "Kevade"],
+        '/books/most-borrowed?start=2023-01-01&end=2023-01-31': [("Kevade", 2), ("Tõde ja õigus", 1)],
+        '/books/most-borrowed?k=2': [("Tõde ja õigus", 2), ("Kevade", 2)],
+        '/borrowers/top?month=2023-02': [("jaan", 1), ("kati", 1)],
+        '/books/overdue?days=7&today=2023-02-10': ["Kevade", "Rehepapp"],
+        '/nothing': "No matching route found",
+        '/book//borrows': "No matching route found",
+        '/book/Kevade/borrows/more': "No matching route found",
+        'books': "No matching route found",
+    }
+    for path, answer in expected.items():
+        assert controller.get(path) == answer, path
+
+
+def brute_force_counts(lines: list[str], start: str, end: str, field: int) -> list[tuple[str, int]]:
+    """Return the borrows between the dates of every book (field 1) or borrower (field 2), most first."""
+    first_seen = {}
+    counts = Counter()
+    for line in lines:
+        parts = line.split(';')
+        first_seen.setdefault(parts[field], len(first_seen))
+        if parts[3] == 'laenutus' and start <= parts[0] <= end:
+            counts[parts[field]] += 1
+    return sorted(counts.items(), key=lambda item: (-item[1], first_seen[item[0]]))
+
+
+def test__borrows_in_date_range_same_as_brute_force(tmp_path):
+    """Test the most borrowed books and top borrowers of random ranges, with the file in and out of date order."""
+    rng = random.Random(1)
+    days = [f"2023-{month:02}-{day:02}" for month in range(1, 13) for day in range(1, 29)]
+    lines = sorted(f"{rng.choice(days)};Raamat {rng.randint(1, 40)};Isik {rng.randint(1, 15)};"
+                   f"{rng.choice(['laenutus', 'laenutus', 'tagastus'])}" for _ in range(3000))
+    for shuffled in (False, True):
+        if shuffled:
+            rng.shuffle(lines)
+        library_stats = LibraryStats(write_transactions(tmp_path, lines))
+        assert library_stats.in_date_order != shuffled
+        for _ in range(20):
+            start, end = sorted(rng.sample(days, 2))
+            k = rng.randint(1, 20)
+            assert library_stats.get_most_borrowed_books(start, end, k) == brute_force_counts(lines, start, end, 1)[:k]
+            assert library_stats.get_top_borrowers(start, end, k) == brute_force_counts(lines, start, end, 2)[:k]
+
+
+def test__overdue_books_same_as_current_status(tmp_path):
+    """Test that the overdue books are the books out, whoever returned them, sorted by the day they were borrowed."""
+    lines = [*TRANSACTIONS,
+             "2023-02-04;Kevade;kati;tagastus",
+             "2023-02-05;Lumekuninganna;jaan;laenutus",
+             "2023-02-06;Lumekuninganna;jaan;pikendus",
+             "2023-01-20;Rehepapp;mari;laenutus"]
+    library_stats = LibraryStats(write_transactions(tmp_path, lines))
+    overdue = library_stats.get_books_out_longer_than(0, '2023-03-01')
+    assert overdue == ["Rehepapp", "Tõde ja õigus", "Lumekuninganna"]
+    assert {book for book in library_stats.get_book_titles()
+            if library_stats.get_current_status(book) == 'laenutatud'} == set(overdue)
+    assert library_stats.get_books_out_longer_than(24, '2023-03-01') == ["Rehepapp", "Tõde ja õigus"]
+    assert library_stats.get_books_out_longer_than(39, '2023-03-01') == ["Rehepapp"]
+    assert library_stats.get_books_out_longer_than(40, '2023-03-01') == []
@@ -0,0 +1,192 @@
+"""HTTP server for the library API."""
+import argparse
+import asyncio
+import json
+from collections import OrderedDict
+from datetime import date
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from library_api import Controller, LibraryStats
+
+
+class ResponseCache:
+    """Least recently used cache of response bodies keyed by path.
+
+    The cache belongs to one version of LibraryStats, all entries are dropped when the version changes.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        """Construct an empty cache that holds at most maxsize responses."""
+        self.maxsize = maxsize
+        self.version = None
+        self.responses = OrderedDict()
+
+    def get(self, path: str, version: int):
+        """Return the cached (status, body) for the path, or None if it is not cached for this version."""
+        if version != self.version:
+            self.responses.clear()
+            self.version = version
+            return None
+        response = self.responses.get(path)
+        if response is not None:
+            self.responses.move_to_end(path)
+        return response
+
+    def put(self, path: str, version: int, response: tuple[int, bytes]) -> None:
+        """Save the response of the path, dropping the least recently used one if the cache is full."""
+        if version != self.version or self.maxsize <= 0:
+            return
+        self.responses[path] = response
+        self.responses.move_to_end(path)
+        if len(self.responses) > self.maxsize:
+            self.responses.popitem(last=False)
+
+
+class LibraryServer:
+    """Serve the Controller routes over HTTP, every answer is JSON.
+
+    Connections are kept alive (HTTP/1.1), so a client can send many requests over one connection.
+    """
+
+    def __init__(self, controller: Controller, cache_size: int = 1024):
+        """Construct the server for the controller."""
+        self.controller = controller
+        self.cache = ResponseCache(cache_size)
+
+    async def respond(self, path: str) -> tuple[int, bytes]:
+        """Return the status and JSON body for the path, cached until new transactions are read.
+
+        The route is called in a worker thread, so a query that waits for LibraryStats.lock while
+        refresh() reads new transactions does not stop the other connections. The cache is only used
+        from the event loop, and server errors are not cached.
+        """
+        version = self.controller.library_stats.version
+        key = get_cache_key(path)
+        response = self.cache.get(key, version)
+        if response is None:
+            response = await asyncio.to_thread(self.call, path)
+            if response[0] != HTTPStatus.INTERNAL_SERVER_ERROR:
+                self.cache.put(key, version, response)
+        return response
+
+    def call(self, path: str) -> tuple[int, bytes]:
+        """Call the route of the path and return the status and JSON body."""
+        route = self.controller.resolve(path)
+        if route is None:
+            return error_response(HTTPStatus.NOT_FOUND, "No matching route found")
+
+        func, args = route
+        try:
+            result = func(*args)
+        except KeyError as e:
+            return error_response(HTTPStatus.NOT_FOUND, f"Not found: {e.args[0]}")
+        except ValueError as e:
+            return error_response(HTTPStatus.BAD_REQUEST, str(e))
+        except Exception as e:
+            return error_response(HTTPStatus.INTERNAL_SERVER_ERROR, f"{type(e).__name__}: {e}")
+        return HTTPStatus.OK, json.dumps(result, ensure_ascii=False).encode()
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer the requests of one connection until the client closes it."""
+        try:
+            while True:
+                try:
+                    request_line = await reader.readline()
+                    if not request_line:
+                        break
+                    keep_alive = await read_headers(reader, request_line)
+                except ValueError:
+                    # readline() raises ValueError for a line longer than the reader's limit.
+                    status, body = error_response(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Line too long")
+                    writer.write(format_response(status, body, False))
+                    await writer.drain()
+                    break
+                parts = request_line.decode('latin-1').split()
+                head_only = False
+                if len(parts) != 3:
+                    status, body = error_response(HTTPStatus.BAD_REQUEST, "Invalid request line")
+                    keep_alive = False
+                elif parts[0] not in ('GET', 'HEAD'):
+                    status, body = error_response(HTTPStatus.METHOD_NOT_ALLOWED, "Only GET is supported")
+                else:
+                    status, body = await self.respond(parts[1])
+                    head_only = parts[0] == 'HEAD'
+                writer.write(format_response(status, body, keep_alive, head_only))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8080) -> None:
+        """Serve until the task is cancelled."""
+        server = await asyncio.start_server(self.handle_client, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+async def read_headers(reader: asyncio.StreamReader, request_line: bytes) -> bool:
+    """Read the request headers and return whether the connection should be kept alive."""
+    keep_alive = not request_line.rstrip().endswith(b'HTTP/1.0')
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            return keep_alive
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'connection':
+            keep_alive = value.strip().lower() == b'keep-alive'
+
+
+def get_cache_key(path: str) -> str:
+    """Return the cache key of the path, the overdue books without a given day are cached for today only."""
+    url = urlsplit(path)
+    if url.path == '/books/overdue' and 'today' not in parse_qs(url.query):
+        return f"{path}#{date.today().isoformat()}"
+    return path
+
+
+def error_response(status: HTTPStatus, message: str) -> tuple[int, bytes]:
+    """Return the status and JSON body of an error."""
+    return status, json.dumps({'error': message}, ensure_ascii=False).encode()
+
+
+def format_response(status: int, body: bytes, keep_alive: bool, head_only: bool = False) -> bytes:
+    """Return the HTTP response with headers and body, only the headers of it for a HEAD request."""
+    status = HTTPStatus(status)
+    head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    if head_only:
+        return head.encode()
+    return head.encode() + body
+
+
+def main():
+    """Serve the transaction file given on the command line."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('filename', help="transaction file, may be gzip-compressed")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cache-size', type=int, default=1024, help="number of cached responses")
+    parser.add_argument('--follow', type=float, metavar='SECONDS', help="read appended transactions periodically")
+    args = parser.parse_args()
+
+    library_stats = LibraryStats(args.filename)
+    if args.follow:
+        library_stats.follow(args.follow)
+    server = LibraryServer(Controller(library_stats), args.cache_size)
+    print(f"Serving {args.filename} on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        library_stats.stop_following()
+
+
+if __name__ == '__main__':
+    main()
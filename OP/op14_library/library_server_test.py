@@ -0,0 +1,140 @@
+"""Library server tests, HTTP answers and the response cache."""
+import asyncio
+import json
+from datetime import date
+
+from library_api import Controller, LibraryStats
+from library_api_test import TRANSACTIONS, write_transactions
+from library_server import LibraryServer, ResponseCache, get_cache_key
+
+
+def exchange(server: LibraryServer, request: bytes, limit: int = 2 ** 16) -> bytes:
+    """Serve one connection on a free port, send the request and return everything the server sent."""
+    async def run() -> bytes:
+        listener = await asyncio.start_server(server.handle_client, '127.0.0.1', 0, limit=limit)
+        port = listener.sockets[0].getsockname()[1]
+        async with listener:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(request)
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            return response
+    return asyncio.run(run())
+
+
+def split_responses(data: bytes) -> list[tuple[int, dict[str, str], bytes]]:
+    """Return the (status, headers, body) of every response in the data."""
+    responses = []
+    while data:
+        head, _, data = data.partition(b'\r\n\r\n')
+        status_line, *header_lines = head.decode().split('\r\n')
+        headers = dict(line.split(': ', 1) for line in header_lines)
+        length = int(headers['Content-Length'])
+        responses.append((int(status_line.split()[1]), headers, data[:length]))
+        data = data[length:]
+    return responses
+
+
+def make_server(tmp_path) -> LibraryServer:
+    """Return a server on the test transactions."""
+    return LibraryServer(Controller(LibraryStats(write_transactions(tmp_path, TRANSACTIONS))))
+
+
+def test__get_requests_over_one_connection(tmp_path):
+    """Test that the requests of a kept-alive connection are answered in order, with the errors as JSON."""
+    request = (b"GET /books HTTP/1.1\r\n\r\n"
+               b"GET /book/T%C3%B5de%20ja%20%C3%B5igus/borrows HTTP/1.1\r\n\r\n"
+               b"GET /borrower/nobody/total-borrows HTTP/1.1\r\n\r\n"
+               b"GET /nothing HTTP/1.1\r\n\r\n"
+               b"GET /books/most-borrowed?k=x HTTP/1.1\r\n\r\n"
+               b"POST /books HTTP/1.1\r\nConnection: close\r\n\r\n")
+    responses = split_responses(exchange(make_server(tmp_path), request))
+    assert [status for status, _, _ in responses] == [200, 200, 404, 404, 400, 405]
+    assert json.loads(responses[0][2]) == ["Tõde ja õigus", "Kevade", "Rehepapp"]
+    assert json.loads(responses[1][2]) == 2
+    assert responses[-1][1]['Connection'] == 'close'
+
+
+def test__head_request_has_get_content_length(tmp_path):
+    """Test that a HEAD request gets the headers of the GET request without the body."""
+    server = make_server(tmp_path)
+    get = exchange(server, b"GET /borrowers HTTP/1.1\r\nConnection: close\r\n\r\n")
+    head = exchange(server, b"HEAD /borrowers HTTP/1.1\r\nConnection: close\r\n\r\n")
+    headers, _, body = get.partition(b'\r\n\r\n')
+    assert head == headers + b'\r\n\r\n'
+    assert f"Content-Length: {len(body)}".encode() in head and body
+
+
+def test__line_too_long_answered(tmp_path):
+    """Test that a request line or header longer than the reader's limit gets an error instead of no answer."""
+    server = make_server(tmp_path)
+    for request in [b"GET /" + b"a" * 200 + b" HTTP/1.1\r\n\r\n",
+                    b"GET /books HTTP/1.1\r\nX-Long: " + b"a" * 200 + b"\r\n\r\n"]:
+        [(status, headers, _)] = split_responses(exchange(server, request, limit=100))
+        assert status == 431
+        assert headers['Connection'] == 'close'
+
+
+def test__route_error_is_internal_server_error(tmp_path):
+    """Test that an unexpected exception of a route is answered with 500 and is not cached."""
+    server = make_server(tmp_path)
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise ZeroDivisionError("division by zero")
+    server.controller.collection_routes['books'] = fail
+    request = b"GET /books HTTP/1.1\r\n\r\nGET /books HTTP/1.1\r\nConnection: close\r\n\r\n"
+    responses = split_responses(exchange(server, request))
+    assert [status for status, _, _ in responses] == [500, 500]
+    assert json.loads(responses[0][2]) == {'error': "ZeroDivisionError: division by zero"}
+    assert len(calls) == 2
+
+
+def test__responses_cached_until_new_transactions(tmp_path):
+    """Test that a response is cached and that it is answered again when new transactions have been read."""
+    filename = write_transactions(tmp_path, TRANSACTIONS)
+    library_stats = LibraryStats(filename)
+    server = LibraryServer(Controller(library_stats))
+    request = b"GET /total HTTP/1.1\r\nConnection: close\r\n\r\n"
+    assert split_responses(exchange(server, request))[0][2] == str(len(TRANSACTIONS)).encode()
+    assert server.cache.get('/total', library_stats.version) is not None
+    with open(filename, 'a', encoding='utf-8') as f:
+        f.write("2023-03-01;Kevade;kati;laenutus\n")
+    library_stats.refresh()
+    assert split_responses(exchange(server, request))[0][2] == str(len(TRANSACTIONS) + 1).encode()
+
+
+def test__overdue_without_today_cached_for_today():
+    """Test that the overdue books without a given day are cached under today's date only."""
+    today = date.today().isoformat()
+    assert get_cache_key('/books/overdue?days=3') == f"/books/overdue?days=3#{today}"
+    assert get_cache_key('/books/overdue?days=3&today=2023-01-01') == '/books/overdue?days=3&today=2023-01-01'
+    assert get_cache_key('/books') == '/books'
+
+
+def test__response_cache_least_recently_used():
+    """Test that the least recently used response is dropped when the cache is full."""
+    cache = ResponseCache(2)
+    assert cache.get('/a', 1) is None
+    cache.put('/a', 1, (200, b'a'))
+    cache.put('/b', 1, (200, b'b'))
+    assert cache.get('/a', 1) == (200, b'a')
+    cache.put('/c', 1, (200, b'c'))
+    assert cache.get('/b', 1) is None
+    assert cache.get('/a', 1) == (200, b'a') and cache.get('/c', 1) == (200, b'c')
+
+
+def test__response_cache_version():
+    """Test that a new version drops every response and that a response of an old version is not saved."""
+    cache = ResponseCache()
+    cache.get('/a', 1)
+    cache.put('/a', 1, (200, b'a'))
+    assert cache.get('/a', 2) is None
+    cache.put('/a', 1, (200, b'old'))
+    assert cache.get('/a', 2) is None
+    disabled = ResponseCache(0)
+    disabled.get('/a', 1)
+    disabled.put('/a', 1, (200, b'a'))
+    assert disabled.get('/a', 1) is None
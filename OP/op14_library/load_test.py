@@ -0,0 +1,92 @@
+"""Load test for the library HTTP server, reports latency percentiles."""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from urllib.parse import quote
+
+
+async def request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, path: str):
+    """Send one GET request over the connection and return the status and the body."""
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n".encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.partition(b':')
+        if name.lower() == b'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def get_paths(host: str, port: int) -> list[str]:
+    """Return the paths of every route for the books and borrowers the server knows."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        books = json.loads((await request(reader, writer, host, '/books'))[1])
+        borrowers = json.loads((await request(reader, writer, host, '/borrowers'))[1])
+    finally:
+        writer.close()
+    paths = ['/books', '/borrowers', '/total']
+    for book in books:
+        for route in ('borrows', 'most-frequent-borrower', 'borrow-dates', 'current-status'):
+            paths.append(f"/book/{quote(book)}/{route}")
+    for borrower in borrowers:
+        for route in ('total-borrows', 'favourite-book', 'borrow-history'):
+            paths.append(f"/borrower/{quote(borrower)}/{route}")
+    return paths
+
+
+async def worker(host: str, port: int, paths: list[str], count: int, latencies: list[float], errors: list[int]):
+    """Send count random requests over one connection and save the latency of each."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(count):
+            path = random.choice(paths)
+            start = time.perf_counter()
+            status, _ = await request(reader, writer, host, path)
+            latencies.append(time.perf_counter() - start)
+            if status >= 500:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run(host: str, port: int, requests: int, concurrency: int) -> None:
+    """Run the load test and print the results."""
+    paths = await get_paths(host, port)
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    # The first requests % concurrency connections send one request more.
+    await asyncio.gather(*(worker(host, port, paths, requests // concurrency + (i < requests % concurrency),
+                                  latencies, errors)
+                           for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(f"requests: {len(latencies)}, connections: {concurrency}, errors: {len(errors)}")
+    print(f"throughput: {len(latencies) / elapsed:.0f} requests/s")
+    print(f"p50: {percentiles[49] * 1000:.2f} ms, p99: {percentiles[98] * 1000:.2f} ms")
+
+
+def main():
+    """Run the load test against the server given on the command line."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args()
+    if args.requests < 2:
+        parser.error("--requests must be at least 2 to report percentiles")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    # No connection is opened without requests to send.
+    asyncio.run(run(args.host, args.port, args.requests, min(args.concurrency, args.requests)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Compare ways of finding the top movies of every genre on a large generated movie data set."""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+
+from movie_data import MovieData, MovieFilter
+
+GENRES = ["Action", "Adventure", "Animation", "Children", "Comedy", "Crime", "Documentary", "Drama", "Fantasy",
+          "Horror", "Musical", "Mystery", "Romance", "Sci-Fi", "Thriller", "War", "Western"]
+TAGS = ["pixar", "funny", "dark comedy", "will ferrell", "classic", "twist ending"]
+
+
+def write_movie_files(directory: str, movies: int, ratings: int) -> tuple[str, str, str]:
+    """Write the movies, ratings and tags files and return their names."""
+    random.seed(1)
+    movies_filename = os.path.join(directory, "movies.csv")
+    ratings_filename = os.path.join(directory, "ratings.csv")
+    tags_filename = os.path.join(directory, "tags.csv")
+    pd.DataFrame({
+        'movieId': range(1, movies + 1),
+        'title': [f"Movie {movie_id} ({random.randint(1920, 2020)})" for movie_id in range(1, movies + 1)],
+        'genres': ["|".join(random.sample(GENRES, random.randint(1, 4))) for _ in range(movies)],
+    }).to_csv(movies_filename, index=False)
+    pd.DataFrame({
+        'userId': [random.randint(1, 1000) for _ in range(ratings)],
+        'movieId': [random.randint(1, movies) for _ in range(ratings)],
+        'rating': [random.randint(1, 10) / 2 for _ in range(ratings)],
+        'timestamp': range(ratings),
+    }).to_csv(ratings_filename, index=False)
+    tags = movies // 2
+    pd.DataFrame({
+        'userId': [random.randint(1, 1000) for _ in range(tags)],
+        'movieId': [random.randint(1, movies) for _ in range(tags)],
+        'tag': [random.choice(TAGS) for _ in range(tags)],
+        'timestamp': range(tags),
+    }).to_csv(tags_filename, index=False)
+    return movies_filename, ratings_filename, tags_filename
+
+
+def same_result(result: dict, expected: dict) -> bool:
+    """Return whether both dictionaries have the same movies in the same order for every genre."""
+    return result.keys() == expected.keys() and all(
+        result[genre].index.tolist() == expected[genre].index.tolist() for genre in expected)
+
+
+def measure(func):
+    """Return the result of the function and the seconds it took."""
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--movies', type=int, default=10_000)
+    parser.add_argument('--ratings', type=int, default=1_000_000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('-n', type=int, default=10)
+    args = parser.parse_args()
+
+    movie_data = MovieData()
+    with tempfile.TemporaryDirectory() as directory:
+        movie_data.load_data(*write_movie_files(directory, args.movies, args.ratings))
+    movie_data.create_aggregate_movie_dataframe('--empty--')
+    movie_filter = MovieFilter()
+    movie_filter.set_movie_data(movie_data.get_aggregate_movie_dataframe())
+    movie_filter.calculate_mean_rating_for_every_movie()
+
+    genres = list(movie_filter.mean_genre_index.genre_bits)
+    per_genre, loop_time = measure(lambda: {genre: movie_filter.get_top_movies_by_genre(genre, args.n)
+                                            for genre in genres})
+    sorted_pass, sorted_time = measure(lambda: movie_filter.top_movies_for_all_genres(args.n))
+    parallel, parallel_time = measure(lambda: movie_filter.top_movies_for_all_genres(args.n, workers=args.workers))
+
+    print(f"{args.movies} movies, {args.ratings} ratings, {len(genres)} genres")
+    print(f"per-genre loop:       {loop_time:.4f} s")
+    print(f"sorted pass:          {sorted_time:.4f} s, same result: {same_result(sorted_pass, per_genre)}")
+    print(f"{args.workers} worker processes: {parallel_time:.4f} s, same result: {same_result(parallel, per_genre)}")
+
+
+if __name__ == '__main__':
+    main()
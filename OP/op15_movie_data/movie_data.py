@@ -1,14 +1,243 @@
 """What should we watch, Honey?..."""
+import importlib.util
+import operator
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
+import numpy as np
 import pandas as pd
 
+YEAR_PATTERN = re.compile(r'\((\d{4})\)')
+
+# Compact column types for the MovieLens files, used by MovieData.load_data(compact=True).
+MOVIES_DTYPES = {'movieId': 'int32', 'title': 'object', 'genres': 'category'}
+RATINGS_DTYPES = {'userId': 'int32', 'movieId': 'int32', 'rating': 'float32', 'timestamp': 'int64'}
+TAGS_DTYPES = {'userId': 'int32', 'movieId': 'int32', 'tag': 'category', 'timestamp': 'int64'}
+
+CACHE_FORMATS = ('parquet', 'feather')
+AGGREGATE_COLUMNS = ['movieId', 'title', 'genres', 'rating', 'tag']
+TAG_MATCH_MODES = ('substring', 'prefix', 'exact')
+RATING_OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le,
+                    '==': operator.eq, '!=': operator.ne,
+                    'greater_than': operator.gt, 'less_than': operator.lt, 'equals': operator.eq}
+RATING_STEP = 0.5
+RATING_SCALE = np.arange(1, 11) * RATING_STEP  # 0.5, 1.0, ..., 5.0
+
 
 def raise_error():
     """Raise value error."""
     raise ValueError("Value error.")
 
 
+def pyarrow_available() -> bool:
+    """Return True if the optional pyarrow package is installed."""
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def get_cache_filename(csv_filename: str, cache_format: str, compact: bool) -> str:
+    """Return the path of the columnar cache file that sits beside csv_filename."""
+    stem = os.path.splitext(csv_filename)[0]
+    return f"{stem}.compact.{cache_format}" if compact else f"{stem}.{cache_format}"
+
+
+def read_csv_cached(filename: str, dtypes: dict | None = None, engine: str | None = None,
+                    cache_format: str | None = None, compact: bool = False) -> pd.DataFrame:
+    """
+    Read a csv file into a dataframe, optionally through a Parquet or Feather cache.
+
+    The cache is used only if it is newer than the csv file, otherwise the csv file is parsed
+    and the cache is (re)written beside it. If the cache can not be written, the parsed dataframe
+    is still returned.
+
+    :param filename: file path for the csv file.
+    :param dtypes: column types to declare while parsing, None lets pandas infer them.
+    :param engine: pandas csv parser engine ('c', 'python' or 'pyarrow').
+    :param cache_format: 'parquet', 'feather' or None for no cache.
+    :param compact: whether dtypes are the compact column types (kept apart in the cache name).
+    :return: pandas DataFrame
+    """
+    if cache_format is None:
+        return pd.read_csv(filename, dtype=dtypes, engine=engine)
+
+    if cache_format not in CACHE_FORMATS:
+        raise_error()
+
+    cache_filename = get_cache_filename(filename, cache_format, compact)
+    if os.path.exists(cache_filename) and os.path.getmtime(cache_filename) >= os.path.getmtime(filename):
+        if cache_format == 'parquet':
+            return pd.read_parquet(cache_filename)
+        return pd.read_feather(cache_filename)
+
+    dataframe = pd.read_csv(filename, dtype=dtypes, engine=engine)
+    # The cache is written under a temporary name first, so that a failed write leaves no broken cache.
+    # The cache only saves time, so a directory that can not be written to or a full disk is not an error.
+    temporary_filename = f"{cache_filename}.{os.getpid()}.tmp"
+    try:
+        if cache_format == 'parquet':
+            dataframe.to_parquet(temporary_filename, index=False)
+        else:
+            dataframe.to_feather(temporary_filename)
+        os.replace(temporary_filename, cache_filename)
+    except OSError:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+
+    return dataframe
+
+
+def concat_rows(frame: pd.DataFrame, rows: list[pd.DataFrame]) -> pd.DataFrame:
+    """Add the rows to the end of the frame, labelled after the last label of the frame so that no label repeats."""
+    start = frame.index.max() + 1 if len(frame) else 0
+    rows = pd.concat(rows, ignore_index=True)
+    rows.index = pd.RangeIndex(start, start + len(rows))
+    return pd.concat([frame, rows])
+
+
+def replace_tags(frame: pd.DataFrame, positions: np.ndarray, tags: np.ndarray) -> pd.DataFrame:
+    """Return a copy of the frame with the 'tag' of the rows at the positions replaced, the frame is not changed."""
+    column = frame['tag'].copy()
+    column.iloc[positions] = tags
+    # The other columns are shared with the frame, only the 'tag' column is new.
+    frame = frame.copy(deep=False)
+    frame['tag'] = column
+    return frame
+
+
+def group_tags(tags: pd.DataFrame) -> pd.DataFrame:
+    """Join all tags of a movie into one space-separated string, the result is indexed by movieId."""
+    return (tags.drop(columns=['userId', 'timestamp'], axis=1)
+            .groupby("movieId").agg({'tag': lambda x: ' '.join(x)}))
+
+
+def normalize_tag(tag: str) -> str:
+    """Normalize a tag for the tag index: strip and lowercase."""
+    return str(tag).strip().lower()
+
+
+class TagIndex:
+    """
+    Class TagIndex.
+
+    Here we keep an inverted index from normalized tags and from the single words of the tags
+    to the set of movieIds that have them, so tag queries do not scan the rows.
+    """
+
+    def __init__(self):
+        """
+        Class initialization.
+
+        self.tags maps a whole normalized tag to movieIds, self.words maps every word of a tag to movieIds.
+        """
+        self.tags = {}
+        self.words = {}
+        self._vocabulary = None
+
+    @classmethod
+    def from_tags(cls, tags: pd.DataFrame) -> 'TagIndex':
+        """
+        Build the index from a dataframe with columns 'movieId' and 'tag' (one tag per line).
+
+        :param tags: pandas DataFrame object
+        :return: TagIndex
+        """
+        index = cls()
+        pairs = tags[['movieId', 'tag']].dropna().drop_duplicates()
+        for movie_id, tag in zip(pairs['movieId'].tolist(), pairs['tag'].tolist()):
+            index.add(movie_id, tag)
+        return index
+
+    def add(self, movie_id: int, tag: str) -> None:
+        """
+        Add a tag of a movie to the index.
+
+        :param movie_id: movieId of the tagged movie
+        :param tag: tag string
+        :return: None
+        """
+        tag = normalize_tag(tag)
+        if not tag:
+            return
+
+        self.tags.setdefault(tag, set()).add(movie_id)
+        for word in tag.split():
+            self.words.setdefault(word, set()).add(movie_id)
+        self._vocabulary = None
+
+    def discard_tag(self, movie_id: int, tag: str, words: bool = False) -> None:
+        """
+        Remove a whole tag of a movie from the index.
+
+        The words of the tag are kept, another tag of the movie may have them, unless words is True
+        (for an index with one tag per movie, like the joined tags of MovieFilter).
+
+        :param movie_id: movieId of the tagged movie
+        :param tag: tag string
+        :param words: whether to remove the words of the tag too
+        :return: None
+        """
+        tag = normalize_tag(tag)
+        postings = [(self.tags, tag)]
+        if words:
+            postings += [(self.words, word) for word in tag.split()]
+        for index, key in postings:
+            if movie_id in index.get(key, ()):
+                index[key].discard(movie_id)
+                if not index[key]:
+                    del index[key]
+                    self._vocabulary = None
+
+    def copy(self) -> 'TagIndex':
+        """Return a copy of the index that can be changed without changing this one."""
+        index = TagIndex()
+        index.tags = {tag: set(movie_ids) for tag, movie_ids in self.tags.items()}
+        index.words = {word: set(movie_ids) for word, movie_ids in self.words.items()}
+        return index
+
+    def get_vocabulary(self, words: bool) -> pd.Series:
+        """Return the sorted words (words=True) or whole tags of the index as a Series."""
+        if self._vocabulary is None:
+            self._vocabulary = (pd.Series(sorted(self.words), dtype=object),
+                                pd.Series(sorted(self.tags), dtype=object))
+        return self._vocabulary[0] if words else self._vocabulary[1]
+
+    def lookup(self, tag: str, mode: str = 'substring') -> set[int]:
+        """
+        Return the movieIds that have given tag. Search is case-insensitive.
+
+        Modes:
+        'exact' - a whole tag equals given tag;
+        'prefix' - a word of a tag starts with given tag (a whole tag, if given tag has several words);
+        'substring' - given tag matches a whole tag the same way as a case-insensitive str.contains,
+        so a regular expression like '^fun' is anchored to the start of the tag, not of its words.
+
+        :param tag: tag to look up
+        :param mode: 'substring', 'prefix' or 'exact'
+        :return: set of movieIds
+        """
+        query = normalize_tag(tag)
+        if mode == 'exact':
+            return set(self.tags.get(query, ()))
+
+        if mode == 'prefix':
+            by_word = len(query.split()) == 1
+            postings = self.words if by_word else self.tags
+            vocabulary = self.get_vocabulary(by_word)
+            start = vocabulary.searchsorted(query, side='left')
+            end = vocabulary.searchsorted(query + '\uffff', side='left')
+            matches = vocabulary.iloc[start:end]
+        else:
+            postings = self.tags
+            vocabulary = self.get_vocabulary(False)
+            matches = vocabulary[vocabulary.str.contains(tag, case=False)]
+
+        movie_ids = set()
+        for match in matches:
+            movie_ids |= postings[match]
+        return movie_ids
+
+
 class MovieData:
     """
     Class MovieData.
@@ -27,26 +256,107 @@ class MovieData:
         self.ratings = None or pd.DataFrame
         self.tags = None or pd.DataFrame
         self.aggregate_movie_dataframe = None or pd.DataFrame
+        self.tag_index = None
+        self.nan_placeholder = None
+        self.unrated_movie_ids = set()
+
+    @property
+    def ratings(self) -> pd.DataFrame:
+        """Return the ratings dataframe, including ratings added with append_ratings."""
+        if self.pending_ratings:
+            self._ratings = pd.concat([self._ratings] + self.pending_ratings, ignore_index=True)
+            self.pending_ratings = []
+        return self._ratings
+
+    @ratings.setter
+    def ratings(self, ratings: pd.DataFrame) -> None:
+        """Set the ratings dataframe."""
+        self._ratings = ratings
+        self.pending_ratings = []
+
+    @property
+    def aggregate_movie_dataframe(self) -> pd.DataFrame:
+        """
+        Return the aggregate dataframe, including rows added with append_ratings.
 
-    def load_data(self, movies_filename: str, ratings_filename: str, tags_filename: str) -> None:
+        Appended rows are collected and joined to the dataframe only when it is read, so that
+        many small appends cost one concatenation. The placeholder line (NaN rating) of a movie
+        that got its first rating is dropped at the same time.
+        """
+        if self.pending_aggregate:
+            aggregate = concat_rows(self._aggregate_movie_dataframe, self.pending_aggregate)
+            if self.rated_placeholder_ids:
+                aggregate = aggregate[~(aggregate['rating'].isna()
+                                        & aggregate['movieId'].isin(self.rated_placeholder_ids))]
+            self._aggregate_movie_dataframe = aggregate
+            self.pending_aggregate = []
+            self.rated_placeholder_ids = set()
+        return self._aggregate_movie_dataframe
+
+    @aggregate_movie_dataframe.setter
+    def aggregate_movie_dataframe(self, aggregate_movie_dataframe: pd.DataFrame) -> None:
+        """Set the aggregate dataframe."""
+        self._aggregate_movie_dataframe = aggregate_movie_dataframe
+        self.pending_aggregate = []
+        self.rated_placeholder_ids = set()
+
+    def load_data(self, movies_filename: str, ratings_filename: str, tags_filename: str, compact: bool = False,
+                  engine: str | None = None, cache_format: str | None = None) -> None:
         """
         Load Data from files into dataframes.
 
         Raise the built-in ValueError exception if either movies_filename, ratings_filename or
         tags_filename is None.
 
+        With compact=True the columns are read with declared compact types (int32 ids, float32
+        ratings, categorical genres and tags) and the pyarrow parser is used when it is installed.
+        With cache_format 'parquet' or 'feather' the dataframes are also written to a cache beside
+        the csv files, so the next load skips csv parsing while the csv files are unchanged.
+
         :param movies_filename: file path for movies.csv file.
         :param ratings_filename: file path for ratings.csv file.
         :param tags_filename: filepath for tags.csv file.
+        :param compact: whether to declare compact column types.
+        :param engine: pandas csv parser engine, by default pyarrow in compact mode if available.
+        :param cache_format: 'parquet', 'feather' or None for no cache.
         :return: None
         """
-        self.movies = pd.read_csv(movies_filename)
-        self.ratings = pd.read_csv(ratings_filename)
-        self.tags = pd.read_csv(tags_filename)
+        if movies_filename is None or ratings_filename is None or tags_filename is None:
+            raise_error()
+
+        if engine is None and compact and pyarrow_available():
+            engine = 'pyarrow'
+
+        self.load_movies_and_tags(movies_filename, tags_filename, compact, engine, cache_format)
+        self.ratings = read_csv_cached(ratings_filename, RATINGS_DTYPES if compact else None,
+                                       engine, cache_format, compact)
 
         if self.ratings is None or self.tags is None or self.movies is None:
             raise_error()
 
+    def load_movies_and_tags(self, movies_filename: str, tags_filename: str, compact: bool = False,
+                             engine: str | None = None, cache_format: str | None = None) -> None:
+        """
+        Load only the movies and tags files, ratings can then be streamed with iter_aggregate_movie_dataframe.
+
+        Raise the built-in ValueError exception if either movies_filename or tags_filename is None.
+        The remaining parameters are the same as in load_data.
+
+        :param movies_filename: file path for movies.csv file.
+        :param tags_filename: filepath for tags.csv file.
+        :return: None
+        """
+        if movies_filename is None or tags_filename is None:
+            raise_error()
+
+        if engine is None and compact and pyarrow_available():
+            engine = 'pyarrow'
+
+        self.movies = read_csv_cached(movies_filename, MOVIES_DTYPES if compact else None,
+                                      engine, cache_format, compact)
+        self.tags = read_csv_cached(tags_filename, TAGS_DTYPES if compact else None,
+                                    engine, cache_format, compact)
+
     def create_aggregate_movie_dataframe(self, nan_placeholder: str = '') -> None:
         """
         Create an aggregate dataframe from frames self.movies, self.ratings and self.tags.
@@ -67,14 +377,171 @@ class MovieData:
         """
         # Format ratings and tags.
         self.ratings = self.ratings.drop(columns=['userId', 'timestamp'], axis=1)
-        self.tags = (self.tags.drop(columns=['userId', 'timestamp'], axis=1)
-                     .groupby("movieId").agg({'tag': lambda x: ' '.join(x)}))
+        self.get_tag_index()
+        self.tags = self.get_grouped_tags()
 
         # Aggregate movie dataframe.
         movie_dataframe = self.movies.merge(self.ratings, on="movieId", how="left")
         self.aggregate_movie_dataframe = movie_dataframe.merge(self.tags, on="movieId", how="left")
         self.aggregate_movie_dataframe['tag'] = self.aggregate_movie_dataframe['tag'].fillna(nan_placeholder)
 
+        # Remember what append_ratings and append_tags need.
+        self.nan_placeholder = nan_placeholder
+        unrated = self.aggregate_movie_dataframe['rating'].isna()
+        self.unrated_movie_ids = set(self.aggregate_movie_dataframe.loc[unrated, 'movieId'].tolist())
+
+    def append_ratings(self, ratings: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add new ratings to the aggregate dataframe without building it again.
+
+        The new ratings are joined with the movies and the grouped tags and added to the end of
+        the aggregate dataframe. Ratings of unknown movies are left out, like in
+        create_aggregate_movie_dataframe. Pass the returned rows to MovieFilter.append_movie_data.
+
+        Raise the built-in ValueError exception if ratings is None or the aggregate dataframe
+        has not been created yet.
+
+        :param ratings: pandas DataFrame with (at least) columns 'movieId' and 'rating'
+        :return: pandas DataFrame of the new aggregate rows
+        """
+        if ratings is None or self.nan_placeholder is None:
+            raise_error()
+
+        ratings = ratings[['movieId', 'rating']]
+        rows = ratings.merge(self.movies, on="movieId", how="inner").merge(self.tags, on="movieId", how="left")
+        rows['tag'] = rows['tag'].fillna(self.nan_placeholder)
+        rows = rows[AGGREGATE_COLUMNS]
+
+        first_rated = self.unrated_movie_ids.intersection(rows['movieId'].tolist())
+        self.unrated_movie_ids -= first_rated
+        self.pending_ratings.append(ratings)
+        self.pending_aggregate.append(rows)
+        self.rated_placeholder_ids |= first_rated
+
+        return rows
+
+    def append_tags(self, tags: pd.DataFrame, movie_filter: 'MovieFilter | None' = None) -> pd.Series:
+        """
+        Add new tags to the grouped tags, the tag index and the aggregate dataframe.
+
+        The new tags of a movie are joined to the end of its existing tag string. The aggregate
+        dataframe and the tag index are replaced by changed copies, the ones handed out before
+        (e.g. to a MovieFilter) are not changed. Pass the MovieFilter of the aggregate dataframe
+        as movie_filter to update its rows and tag indexes in the same call; a MovieFilter that is
+        not updated (see MovieFilter.update_tags) keeps answering with the tags it had.
+
+        Raise the built-in ValueError exception if tags is None or the aggregate dataframe
+        has not been created yet.
+
+        :param tags: pandas DataFrame with (at least) columns 'movieId' and 'tag'
+        :param movie_filter: MovieFilter to update with the new tags
+        :return: pandas Series of the new tag string of every changed movie, indexed by movieId
+        """
+        if tags is None or self.nan_placeholder is None:
+            raise_error()
+
+        tags = tags[['movieId', 'tag']].dropna()
+        self.tag_index = self.tag_index.copy()
+        for movie_id, tag in zip(tags['movieId'].tolist(), tags['tag'].tolist()):
+            self.tag_index.add(movie_id, tag)
+
+        new_tags = tags.groupby('movieId')['tag'].agg(' '.join)
+        old_tags = self.tags['tag'].reindex(new_tags.index)
+        movie_tags = (old_tags + ' ' + new_tags).fillna(new_tags)
+
+        known = movie_tags.index.isin(self.tags.index)
+        self.tags.loc[movie_tags.index[known], 'tag'] = movie_tags[known]
+        self.tags = pd.concat([self.tags, movie_tags[~known].to_frame('tag')])
+
+        aggregate = self.aggregate_movie_dataframe
+        positions = np.flatnonzero(aggregate['movieId'].isin(movie_tags.index))
+        self.aggregate_movie_dataframe = replace_tags(aggregate, positions,
+                                                      aggregate['movieId'].iloc[positions].map(movie_tags).to_numpy())
+
+        if movie_filter is not None:
+            movie_filter.update_tags(movie_tags, self.tag_index)
+        return movie_tags
+
+    def get_grouped_tags(self) -> pd.DataFrame:
+        """
+        Return self.tags with all tags of a movie joined together, indexed by movieId.
+
+        self.tags is already in this form after create_aggregate_movie_dataframe has been called.
+
+        :return: pandas DataFrame
+        """
+        if 'userId' in self.tags.columns:
+            return group_tags(self.tags)
+        return self.tags
+
+    def get_tag_index(self) -> TagIndex | None:
+        """
+        Return the inverted tag index, building it from self.tags while it still has one tag per line.
+
+        :return: TagIndex
+        """
+        if self.tag_index is None and 'userId' in self.tags.columns:
+            self.tag_index = TagIndex.from_tags(self.tags)
+        return self.tag_index
+
+    def iter_aggregate_movie_dataframe(self, ratings_filename: str, chunksize: int = 1_000_000,
+                                       nan_placeholder: str = '', compact: bool = False):
+        """
+        Yield the aggregate movie dataframe in parts, reading the ratings file in chunks.
+
+        Every chunk of ratings is joined against self.movies and the grouped tags, so peak memory
+        depends on chunksize and not on the number of ratings. Rows follow the order of the
+        ratings file, and movies without any ratings come in the last part with a NaN rating.
+        The columns are the same as in create_aggregate_movie_dataframe.
+
+        self.movies and self.tags must be loaded first, e.g. with load_movies_and_tags.
+        Raise the built-in ValueError exception if ratings_filename is None or chunksize < 1.
+
+        :param ratings_filename: file path for ratings.csv file.
+        :param chunksize: number of ratings to read at a time.
+        :param nan_placeholder: Value to replace all np.nan-valued elements in column 'tag'.
+        :param compact: whether to declare compact column types for the ratings.
+        :return: generator of pandas DataFrame objects
+        """
+        if ratings_filename is None or chunksize < 1:
+            raise_error()
+
+        self.get_tag_index()
+        tags = self.get_grouped_tags()
+        dtypes = {'movieId': RATINGS_DTYPES['movieId'], 'rating': RATINGS_DTYPES['rating']} if compact else None
+        rated_movie_ids = set()
+
+        with pd.read_csv(ratings_filename, usecols=['movieId', 'rating'], dtype=dtypes,
+                         chunksize=chunksize) as reader:
+            for chunk in reader:
+                part = chunk.merge(self.movies, on="movieId", how="inner").merge(tags, on="movieId", how="left")
+                part['tag'] = part['tag'].fillna(nan_placeholder)
+                rated_movie_ids.update(chunk['movieId'].unique())
+                yield part[AGGREGATE_COLUMNS]
+
+        unrated = self.movies[~self.movies['movieId'].isin(rated_movie_ids)].merge(tags, on="movieId", how="left")
+        if not unrated.empty:
+            unrated.insert(3, 'rating', float('nan'))
+            unrated['tag'] = unrated['tag'].fillna(nan_placeholder)
+            yield unrated[AGGREGATE_COLUMNS]
+
+    def write_aggregate_movie_dataframe(self, ratings_filename: str, output_filename: str,
+                                        chunksize: int = 1_000_000, nan_placeholder: str = '',
+                                        compact: bool = False) -> None:
+        """
+        Write the aggregate movie dataframe into a csv file part by part.
+
+        See iter_aggregate_movie_dataframe for the parameters, only one part is in memory at a time.
+
+        :param ratings_filename: file path for ratings.csv file.
+        :param output_filename: file path for the aggregate csv file.
+        :return: None
+        """
+        header = True
+        for part in self.iter_aggregate_movie_dataframe(ratings_filename, chunksize, nan_placeholder, compact):
+            part.to_csv(output_filename, mode='w' if header else 'a', header=header, index=False)
+            header = False
+
     def get_aggregate_movie_dataframe(self) -> pd.DataFrame | None:
         """
         Return aggregate_movie_dataframe variable.
@@ -110,13 +577,494 @@ class MovieData:
 
 def extract_year_from_title(title):
     """Extract the year from the title."""
-    year_pattern = re.compile(r'\((\d{4})\)')
-    match = year_pattern.search(title)
+    match = YEAR_PATTERN.search(title)
     if match:
         return int(match.group(1))
     return None
 
 
+def extract_years(titles: pd.Series) -> pd.Series:
+    """Extract the year from every title at once, titles without a year get <NA>."""
+    return pd.to_numeric(titles.str.extract(YEAR_PATTERN.pattern, expand=False)).astype('Int64')
+
+
+def insert_sorted(sorted_values: np.ndarray, positions: np.ndarray, new_values: np.ndarray,
+                  new_positions: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Insert the values of new rows into a sorted index without sorting the whole index again.
+
+    :param sorted_values: sorted values of the index
+    :param positions: row positions of sorted_values
+    :param new_values: values of the new rows
+    :param new_positions: row positions of the new rows
+    :return: new sorted values and row positions
+    """
+    order = np.argsort(new_values, kind='stable')
+    new_sorted = new_values[order]
+    insert_at = np.searchsorted(sorted_values, new_sorted, side='right')
+    return np.insert(sorted_values, insert_at, new_sorted), np.insert(positions, insert_at, new_positions[order])
+
+
+class RatingHistogram:
+    """
+    Class RatingHistogram.
+
+    Here we count the ratings per 0.5 step of the MovieLens rating scale (0.5 to 5.0).
+    Mean, median and percentiles calculated from the counts are exact for such ratings,
+    adding ratings costs O(1) per rating and the histograms of chunks or worker processes
+    can be merged.
+    """
+
+    def __init__(self, counts=None):
+        """
+        Class initialization.
+
+        :param counts: ratings per step of RATING_SCALE, None for an empty histogram
+        """
+        if counts is None:
+            self.counts = np.zeros(len(RATING_SCALE), dtype=np.int64)
+        else:
+            self.counts = np.asarray(counts, dtype=np.int64)
+
+    def update(self, ratings) -> None:
+        """
+        Add ratings to the histogram, NaN values are skipped.
+
+        Raise the built-in ValueError exception if a rating is not on the 0.5 step scale from 0.5 to 5.0.
+
+        :param ratings: iterable of ratings
+        :return: None
+        """
+        values = np.asarray(ratings, dtype='float64')
+        values = values[~np.isnan(values)]
+        steps = values / RATING_STEP - 1
+        buckets = steps.astype(np.int64)
+        if ((buckets != steps) | (buckets < 0) | (buckets >= len(RATING_SCALE))).any():
+            raise_error()
+        self.counts += np.bincount(buckets, minlength=len(RATING_SCALE))
+
+    def merge(self, other: 'RatingHistogram') -> 'RatingHistogram':
+        """Return a new histogram with the ratings of both histograms."""
+        return RatingHistogram(self.counts + other.counts)
+
+    def get_count(self) -> int:
+        """Return the number of ratings."""
+        return int(self.counts.sum())
+
+    def get_mean(self) -> float | None:
+        """Return the mean rating, None if there are no ratings."""
+        count = self.get_count()
+        if not count:
+            return None
+        return float((self.counts * RATING_SCALE).sum() / count)
+
+    def get_percentile(self, percent: float) -> float | None:
+        """
+        Return the given percentile of the ratings, interpolated the same way as pandas' quantile.
+
+        Raise the built-in ValueError exception if percent is not between 0 and 100.
+
+        :param percent: percentile from 0 to 100
+        :return: float value, None if there are no ratings
+        """
+        if percent is None or not 0 <= percent <= 100:
+            raise_error()
+
+        count = self.get_count()
+        if not count:
+            return None
+
+        position = percent / 100 * (count - 1)
+        lower, upper = int(np.floor(position)), int(np.ceil(position))
+        cumulative_counts = np.cumsum(self.counts)
+        lower_value = RATING_SCALE[np.searchsorted(cumulative_counts, lower, side='right')]
+        upper_value = RATING_SCALE[np.searchsorted(cumulative_counts, upper, side='right')]
+        return float(lower_value + (upper_value - lower_value) * (position - lower))
+
+    def get_median(self) -> float | None:
+        """Return the median rating, None if there are no ratings."""
+        return self.get_percentile(50)
+
+
+class YearIndex:
+    """
+    Class YearIndex.
+
+    Here we keep the release year of every row and the row positions sorted by year,
+    so year and year range lookups are binary searches instead of a scan over the titles.
+    """
+
+    def __init__(self, years: pd.Series):
+        """
+        Class initialization.
+
+        :param years: nullable integer years, positionally aligned with the indexed dataframe
+        """
+        self.years = years
+        values = years.to_numpy(dtype='float64', na_value=np.nan)
+        known_positions = np.flatnonzero(~np.isnan(values))
+        self.positions = known_positions[np.argsort(values[known_positions], kind='stable')]
+        self.sorted_years = values[self.positions]
+
+    def lookup(self, start_year: int, end_year: int) -> np.ndarray:
+        """
+        Return positions of the rows released from start_year to end_year (both inclusive).
+
+        The positions are in the original row order.
+
+        :param start_year: first year of the range
+        :param end_year: last year of the range
+        :return: numpy array of row positions
+        """
+        start = np.searchsorted(self.sorted_years, start_year, side='left')
+        end = np.searchsorted(self.sorted_years, end_year, side='right')
+        return np.sort(self.positions[start:end])
+
+    def extend(self, years: pd.Series) -> None:
+        """
+        Add the years of rows appended to the indexed dataframe.
+
+        :param years: nullable integer years of the new rows
+        :return: None
+        """
+        offset = len(self.years)
+        self.years = pd.concat([self.years, years], ignore_index=True)
+        values = years.to_numpy(dtype='float64', na_value=np.nan)
+        known_positions = np.flatnonzero(~np.isnan(values))
+        self.sorted_years, self.positions = insert_sorted(self.sorted_years, self.positions,
+                                                          values[known_positions], known_positions + offset)
+
+
+class MovieIdIndex:
+    """
+    Class MovieIdIndex.
+
+    Here we keep the row positions sorted by movieId, so the rows of a set of movies
+    are found with binary search.
+    """
+
+    def __init__(self, movie_ids: pd.Series):
+        """
+        Class initialization.
+
+        :param movie_ids: movieIds, positionally aligned with the indexed dataframe
+        """
+        values = movie_ids.to_numpy()
+        self.size = len(values)
+        self.positions = np.argsort(values, kind='stable')
+        self.sorted_ids = values[self.positions]
+
+    def extend(self, movie_ids: pd.Series) -> None:
+        """
+        Add the movieIds of rows appended to the indexed dataframe.
+
+        :param movie_ids: movieIds of the new rows
+        :return: None
+        """
+        values = movie_ids.to_numpy().astype(self.sorted_ids.dtype)
+        new_positions = np.arange(self.size, self.size + len(values))
+        self.sorted_ids, self.positions = insert_sorted(self.sorted_ids, self.positions, values, new_positions)
+        self.size += len(values)
+
+    def lookup(self, movie_ids) -> np.ndarray:
+        """
+        Return positions of the rows of given movies, in the original row order.
+
+        :param movie_ids: iterable of movieIds
+        :return: numpy array of row positions
+        """
+        movie_ids = np.fromiter(movie_ids, dtype=self.sorted_ids.dtype)
+        starts = np.searchsorted(self.sorted_ids, movie_ids, side='left')
+        ends = np.searchsorted(self.sorted_ids, movie_ids, side='right')
+        if not len(movie_ids):
+            return np.array([], dtype=np.intp)
+        return np.sort(np.concatenate([self.positions[start:end] for start, end in zip(starts, ends)]))
+
+
+class GenreIndex:
+    """
+    Class GenreIndex.
+
+    Here we keep every row's genres as a bitmask with one bit per genre, so genre filters
+    are integer mask operations instead of a substring scan over the 'genres' column.
+    """
+
+    def __init__(self, genres: pd.Series):
+        """
+        Class initialization.
+
+        The pipe-delimited genre strings are split only once per distinct value.
+        Without an index (more than 64 genres), self.masks is None.
+
+        :param genres: pipe-delimited genres, positionally aligned with the indexed dataframe
+        """
+        self.genres = genres
+        self.genre_bits = {}
+        self.masks = self.encode(genres)
+
+    def encode(self, genres: pd.Series) -> np.ndarray | None:
+        """
+        Return the bitmasks of given genres, adding bits for genres not seen before.
+
+        :param genres: pipe-delimited genres
+        :return: numpy uint64 array, None if there are more than 64 genres
+        """
+        codes, uniques = pd.factorize(genres)
+
+        unique_masks = []
+        for value in uniques:
+            mask = 0
+            for genre in value.split('|'):
+                if genre not in self.genre_bits:
+                    self.genre_bits[genre] = 1 << len(self.genre_bits)
+                mask |= self.genre_bits[genre]
+            unique_masks.append(mask)
+
+        self.genre_names = pd.Series(list(self.genre_bits), dtype=object)
+        if len(self.genre_bits) > 64:
+            return None
+        unique_masks = np.array(unique_masks + [0], dtype=np.uint64)
+        return unique_masks[codes]  # Code -1 (missing genres) picks the trailing 0.
+
+    def extend(self, genres: pd.Series) -> None:
+        """
+        Add the genres of rows appended to the indexed dataframe.
+
+        :param genres: pipe-delimited genres of the new rows
+        :return: None
+        """
+        masks = self.encode(genres) if self.masks is not None else None
+        self.genres = pd.concat([self.genres, genres], ignore_index=True)
+        self.masks = np.concatenate([self.masks, masks]) if masks is not None else None
+
+    def get_bits(self, genre: str) -> int:
+        """
+        Return the bits of all genres that match given genre, the same way as a case-insensitive str.contains.
+
+        :param genre: genre (pattern) to look up
+        :return: integer bitmask
+        """
+        bits = 0
+        for name in self.genre_names[self.genre_names.str.contains(genre, case=False)]:
+            bits |= self.genre_bits[name]
+        return bits
+
+    def mask(self, genre: str) -> np.ndarray:
+        """
+        Return a boolean mask of the rows where given genre is in 'genres'. Search is case-insensitive.
+
+        :param genre: genre to filter by
+        :return: numpy boolean array
+        """
+        if self.masks is None:
+            return self.genres.str.contains(genre, case=False).fillna(False).to_numpy(dtype=bool)
+        return (self.masks & np.uint64(self.get_bits(genre))) != 0
+
+    def mask_all(self, genres: list[str], match_all: bool = True, positions: np.ndarray | None = None) -> np.ndarray:
+        """
+        Return a boolean mask of the rows that have all (match_all=True) or any of given genres.
+
+        :param genres: genres to filter by
+        :param match_all: whether every genre has to match (AND) or just one of them (OR)
+        :param positions: row positions to check, None checks every row
+        :return: numpy boolean array
+        """
+        if self.masks is None:
+            masks = [self.mask(genre) for genre in genres]
+            result = np.logical_and.reduce(masks) if match_all else np.logical_or.reduce(masks)
+            return result if positions is None else result[positions]
+
+        masks = self.masks if positions is None else self.masks[positions]
+        if not match_all:
+            bits = 0
+            for genre in genres:
+                bits |= self.get_bits(genre)
+            return (masks & np.uint64(bits)) != 0
+
+        result = np.ones(len(masks), dtype=bool)
+        for genre in genres:
+            result &= (masks & np.uint64(self.get_bits(genre))) != 0
+        return result
+
+
+def get_top_positions(ratings: np.ndarray, masks: np.ndarray, bits: int, n: int) -> np.ndarray:
+    """Return positions of the n best rated rows whose genre mask has any of bits, ties in row order."""
+    positions = np.flatnonzero((masks & np.uint64(bits)) != 0)
+    return positions[np.argsort(-ratings[positions], kind='stable')][:n]
+
+
+def find_top_positions_in_shared_memory(ratings_name: str, masks_name: str, size: int,
+                                        genre_bits: dict[str, int], n: int) -> dict[str, np.ndarray]:
+    """
+    Return the positions of the n best rated rows for every genre, for a worker process.
+
+    The ratings (float64) and genre masks (uint64) are read from shared memory blocks,
+    so they are not copied into every worker.
+    """
+    ratings_memory = shared_memory.SharedMemory(name=ratings_name)
+    masks_memory = shared_memory.SharedMemory(name=masks_name)
+    try:
+        ratings = np.ndarray((size,), dtype=np.float64, buffer=ratings_memory.buf)
+        masks = np.ndarray((size,), dtype=np.uint64, buffer=masks_memory.buf)
+        return {genre: get_top_positions(ratings, masks, bits, n).copy() for genre, bits in genre_bits.items()}
+    finally:
+        del ratings, masks
+        ratings_memory.close()
+        masks_memory.close()
+
+
+class MovieQuery:
+    """
+    Class MovieQuery.
+
+    Here we record the predicates of a query over MovieFilter data and apply them all at once:
+    index-backed predicates (year, tag) narrow down the candidate rows first, then the genre
+    bitmask and the rating comparison are checked only on those rows and the result is
+    materialized once, e.g. movie_filter.query().genre('Comedy').rating('>', 3.5).year(1995).top(10).collect()
+    """
+
+    def __init__(self, movie_filter: 'MovieFilter', per_movie: bool = False):
+        """
+        Class initialization.
+
+        :param movie_filter: MovieFilter with the data to query
+        :param per_movie: query the mean rating of every movie instead of the single ratings
+        """
+        self.movie_filter = movie_filter
+        self.per_movie = per_movie
+        self.years = []
+        self.tags = []
+        self.genres = []
+        self.ratings = []
+        self.limit = None
+
+    def year(self, start_year: int, end_year: int | None = None) -> 'MovieQuery':
+        """
+        Keep movies released from start_year to end_year, both inclusive. end_year defaults to start_year.
+
+        Raise the built-in ValueError exception if a year is None or < 0 or if start_year > end_year.
+        """
+        end_year = start_year if end_year is None else end_year
+        if start_year is None or start_year < 0 or start_year > end_year:
+            raise_error()
+
+        self.years.append((start_year, end_year))
+        return self
+
+    def tag(self, tag: str, mode: str = 'substring') -> 'MovieQuery':
+        """
+        Keep movies with given tag, see TagIndex.lookup for the modes.
+
+        Raise the built-in ValueError exception if tag is an empty string or None or mode is unknown.
+        """
+        if not tag or tag.strip() == "" or mode not in TAG_MATCH_MODES:
+            raise_error()
+
+        self.tags.append((tag, mode))
+        return self
+
+    def genre(self, *genres: str, match_all: bool = True) -> 'MovieQuery':
+        """
+        Keep movies with all (match_all=True) or any of given genres. Search is case-insensitive.
+
+        Raise the built-in ValueError exception if no genre is given or a genre is an empty string or None.
+        """
+        if not genres or any(not genre or genre.strip() == "" for genre in genres):
+            raise_error()
+
+        self.genres.append((list(genres), match_all))
+        return self
+
+    def rating(self, comp: str, rating: float) -> 'MovieQuery':
+        """
+        Keep movies whose rating compares to given rating, comp is e.g. '>', '>=', '==' or 'less_than'.
+
+        Raise the built-in ValueError exception if rating is None or < 0 or comp is unknown.
+        """
+        if rating is None or rating < 0 or comp not in RATING_OPERATORS:
+            raise_error()
+
+        self.ratings.append((comp, rating))
+        return self
+
+    def top(self, n: int) -> 'MovieQuery':
+        """
+        Keep only the n best rated movies of the result.
+
+        Raise the built-in ValueError exception if n is None or < 0.
+        """
+        if n is None or n < 0:
+            raise_error()
+
+        self.limit = n
+        return self
+
+    def get_plan(self) -> list[str]:
+        """Return the steps of the query in the order they are applied."""
+        steps = [f"year {start}..{end} [year index, binary search]" for start, end in self.years]
+        steps += [f"tag {tag!r} ({mode}) [tag index]" for tag, mode in self.tags]
+        steps += [f"genre {(' & ' if match_all else ' | ').join(genres)} [genre bitmask]"
+                  for genres, match_all in self.genres]
+        steps += [f"rating {comp} {rating} [column compare]" for comp, rating in self.ratings]
+        if self.limit is not None:
+            steps.append(f"top {self.limit} by rating")
+        return steps
+
+    def explain(self) -> str:
+        """
+        Return a description of how the query is executed.
+
+        :return: one line per step, index-backed predicates first
+        """
+        source = "mean rating of every movie" if self.per_movie else "movie data rows"
+        lines = [f"MovieQuery on {source}"]
+        lines += [f"{number}. {step}" for number, step in enumerate(self.get_plan(), start=1)]
+        return "\n".join(lines)
+
+    def collect(self) -> pd.DataFrame:
+        """
+        Run the query and return the result.
+
+        :return: pandas DataFrame object of the query result
+        """
+        movie_filter = self.movie_filter
+        if self.per_movie:
+            frame = movie_filter.get_cached_mean_ratings()
+            year_index, genre_index = movie_filter.mean_year_index, movie_filter.mean_genre_index
+        else:
+            frame = movie_filter.movie_data
+            year_index, genre_index = movie_filter.year_index, movie_filter.genre_index
+
+        # Index-backed predicates give candidate positions.
+        positions = None
+        for start_year, end_year in self.years:
+            found = year_index.lookup(start_year, end_year)
+            positions = found if positions is None else np.intersect1d(positions, found, assume_unique=True)
+        for tag, mode in self.tags:
+            movie_ids = movie_filter.lookup_tag(tag, mode)
+            if self.per_movie:
+                found = np.flatnonzero(frame.index.isin(movie_ids))
+            else:
+                found = movie_filter.movie_id_index.lookup(movie_ids)
+            positions = found if positions is None else np.intersect1d(positions, found, assume_unique=True)
+        if positions is None:
+            positions = np.arange(len(frame))
+
+        # The rest is a single boolean mask over the candidates.
+        mask = np.ones(len(positions), dtype=bool)
+        for genres, match_all in self.genres:
+            mask &= genre_index.mask_all(genres, match_all, positions)
+        if self.ratings:
+            ratings = frame['rating'].to_numpy()[positions]
+            for comp, rating in self.ratings:
+                mask &= RATING_OPERATORS[comp](ratings, rating)
+
+        result = frame.iloc[positions[mask]]
+        if self.limit is not None:
+            result = result.nlargest(self.limit, 'rating')
+        return result
+
+
 class MovieFilter:
     """
     Class MovieFilter.
@@ -132,18 +1080,256 @@ class MovieFilter:
         For OP part, some more variables might be a good idea here.
         """
         self.movie_data = None or pd.DataFrame
-        self.median_rating = None or float
-        self.average_rating = None or float
-        self.mean_ratings = None
 
-    def set_movie_data(self, movie_data: pd.DataFrame) -> None:
+    @property
+    def movie_data(self) -> pd.DataFrame:
+        """
+        Return the movie data, including rows added with append_movie_data.
+
+        Appended rows are collected and joined to the data (and the row indexes) only when
+        the rows are needed, so that many small appends cost one concatenation.
+        """
+        if self.pending_movie_data:
+            movie_data = concat_rows(self._movie_data, self.pending_movie_data)
+            rows = movie_data.iloc[len(self._movie_data):]
+            self.pending_movie_data = []
+
+            if self.placeholder_ids:
+                # A movie got its first rating, drop its NaN line and index the data again.
+                movie_data = movie_data[~(movie_data['rating'].isna()
+                                          & movie_data['movieId'].isin(self.placeholder_ids))]
+                self.placeholder_ids = set()
+                self._movie_data = movie_data
+                self.year_index = YearIndex(extract_years(movie_data['title']))
+                self.genre_index = GenreIndex(movie_data['genres'])
+                self.movie_id_index = MovieIdIndex(movie_data['movieId'])
+            else:
+                self._movie_data = movie_data
+                # An index that has not been built yet is built from all the rows on its first use.
+                if self._year_index is not None:
+                    self._year_index.extend(extract_years(rows['title']))
+                if self._genre_index is not None:
+                    self._genre_index.extend(rows['genres'])
+                if self._movie_id_index is not None:
+                    self._movie_id_index.extend(rows['movieId'])
+        return self._movie_data
+
+    @movie_data.setter
+    def movie_data(self, movie_data: pd.DataFrame) -> None:
+        """
+        Set the movie data and drop everything cached for the previous data.
+
+        The indexes of the rows are built again on their first use, so the filters also work
+        when self.movie_data is assigned directly instead of with set_movie_data.
+        """
+        self._movie_data = movie_data
+        self.pending_movie_data = []
+        self.median_rating = None
+        self.average_rating = None
+        self.rating_histogram = None
+        self.mean_ratings = None
+        self.movie_statistics = None
+        self.year_index = None
+        self.mean_year_index = None
+        self.genre_index = None
+        self.mean_genre_index = None
+        self.movie_id_index = None
+        self.tag_index = None
+        self.joined_tag_index = None
+        self.stale_median_ids = set()
+        self.placeholder_ids = set()
+        self.unrated_movie_ids = None
+
+    @property
+    def year_index(self) -> YearIndex:
+        """Return the index of the years of release of self.movie_data, built on first use."""
+        if self._year_index is None:
+            self._year_index = YearIndex(extract_years(self.movie_data['title']))
+        return self._year_index
+
+    @year_index.setter
+    def year_index(self, year_index: YearIndex | None) -> None:
+        """Set the year index, None builds it again on its next use."""
+        self._year_index = year_index
+
+    @property
+    def genre_index(self) -> GenreIndex:
+        """Return the genre index of self.movie_data, built on first use."""
+        if self._genre_index is None:
+            self._genre_index = GenreIndex(self.movie_data['genres'])
+        return self._genre_index
+
+    @genre_index.setter
+    def genre_index(self, genre_index: GenreIndex | None) -> None:
+        """Set the genre index, None builds it again on its next use."""
+        self._genre_index = genre_index
+
+    @property
+    def joined_tag_index(self) -> TagIndex:
+        """Return the index of the joined 'tag' column of self.movie_data, built on first use."""
+        if self._joined_tag_index is None:
+            self._joined_tag_index = TagIndex.from_tags(self.movie_data)
+        return self._joined_tag_index
+
+    @joined_tag_index.setter
+    def joined_tag_index(self, joined_tag_index: TagIndex | None) -> None:
+        """Set the index of the joined tags, None builds it again on its next use."""
+        self._joined_tag_index = joined_tag_index
+
+    @property
+    def tag_index(self) -> TagIndex:
+        """Return the tag index given to set_movie_data, or the index of the joined tags if none was given."""
+        return self._tag_index if self._tag_index is not None else self.joined_tag_index
+
+    @tag_index.setter
+    def tag_index(self, tag_index: TagIndex | None) -> None:
+        """Set the tag index, None uses the index of the joined tags."""
+        self._tag_index = tag_index
+
+    @property
+    def movie_id_index(self) -> MovieIdIndex:
+        """Return the index of the movieIds of self.movie_data, built on first use."""
+        if self._movie_id_index is None:
+            self._movie_id_index = MovieIdIndex(self.movie_data['movieId'])
+        return self._movie_id_index
+
+    @movie_id_index.setter
+    def movie_id_index(self, movie_id_index: MovieIdIndex | None) -> None:
+        """Set the movieId index, None builds it again on its next use."""
+        self._movie_id_index = movie_id_index
+
+    def set_movie_data(self, movie_data: pd.DataFrame, tag_index: TagIndex | None = None) -> None:
         """
         Set the value of self.movie_data to be given argument movie_data.
 
+        All statistics cached for the previous data are dropped, the year of release
+        is parsed from the titles once into a year index and the genres are split once
+        into a genre index.
+
+        Pass MovieData.get_tag_index() as tag_index to match single tags of movies with several tags
+        in the 'exact' and 'prefix' modes, otherwise they match the joined 'tag' column. The 'substring'
+        mode always matches the joined 'tag' column, see filter_movies_by_tag.
+
         :param movie_data: pandas DataFrame object
+        :param tag_index: TagIndex of the tags in movie_data
         :return: None
         """
         self.movie_data = movie_data
+        self.tag_index = tag_index
+
+    def append_movie_data(self, rows: pd.DataFrame) -> None:
+        """
+        Add new rows (e.g. from MovieData.append_ratings) to self.movie_data.
+
+        The cached per-movie statistics are updated from the running counts and sums
+        of the new rows only. Medians of the changed movies are recalculated on their next use.
+        The overall median and average rating are updated from the rating histogram if
+        calculate_rating_statistics(streaming=True) has been used, otherwise they are dropped.
+
+        Raise the built-in ValueError exception if rows is None or, with the rating histogram, if a rating
+        is not on its scale. Nothing is changed then.
+
+        :param rows: pandas DataFrame with the same columns as self.movie_data
+        :return: None
+        """
+        if rows is None:
+            raise_error()
+        if rows.empty:
+            return
+
+        # The new ratings are counted before anything is changed, a rating off the scale raises here.
+        new_ratings = None
+        if self.rating_histogram is not None:
+            new_ratings = RatingHistogram()
+            new_ratings.update(rows['rating'])
+
+        if self.unrated_movie_ids is None:
+            movie_data = self.movie_data
+            self.unrated_movie_ids = set(movie_data.loc[movie_data['rating'].isna(), 'movieId'].tolist())
+        self.pending_movie_data.append(rows)
+        if new_ratings is not None:
+            self.rating_histogram = self.rating_histogram.merge(new_ratings)
+            self.median_rating = round(self.rating_histogram.get_median(), 3)
+            self.average_rating = round(self.rating_histogram.get_mean(), 3)
+        else:
+            self.median_rating = None
+            self.average_rating = None
+
+        first_rated = self.unrated_movie_ids.intersection(rows.loc[rows['rating'].notna(), 'movieId'].tolist())
+        self.unrated_movie_ids -= first_rated
+        self.placeholder_ids |= first_rated
+
+        statistics = self.movie_statistics
+        if statistics is None:
+            return
+
+        new_statistics = rows.groupby('movieId').agg(title=('title', 'first'),
+                                                     genres=('genres', 'first'),
+                                                     tag=('tag', 'first'),
+                                                     count=('rating', 'count'),
+                                                     sum=('rating', 'sum'))
+        known = new_statistics.index.isin(statistics.index)
+        changed = new_statistics.index[known]
+        statistics.loc[changed, 'count'] += new_statistics.loc[changed, 'count']
+        statistics.loc[changed, 'sum'] += new_statistics.loc[changed, 'sum']
+        means = statistics.loc[changed, 'sum'] / statistics.loc[changed, 'count'].where(lambda x: x > 0)
+        statistics.loc[changed, 'mean'] = means.astype(statistics['mean'].dtype)
+        statistics.loc[changed, 'median'] = np.nan
+        self.stale_median_ids.update(changed)
+
+        added = new_statistics[~known]
+        if not added.empty:
+            added = added.assign(mean=added['sum'] / added['count'].where(lambda x: x > 0), median=np.nan)
+            statistics = pd.concat([statistics, added[statistics.columns]])
+            self.movie_statistics = statistics
+            self.stale_median_ids.update(added.index)
+
+        if self.mean_ratings is not None:
+            rated = statistics.index[statistics['count'] > 0]
+            if rated.isin(self.mean_ratings.index).all():
+                changed = changed.intersection(self.mean_ratings.index)
+                self.mean_ratings.loc[changed, 'rating'] = round(statistics.loc[changed, 'mean'], 3)
+            else:
+                # Some movies got their first rating, the frame and its indexes are built again.
+                self.mean_ratings = None
+                self.get_cached_mean_ratings()
+
+    def update_tags(self, movie_tags: pd.Series, tag_index: TagIndex | None = None) -> None:
+        """
+        Replace the tag string of the given movies (e.g. from MovieData.append_tags).
+
+        The 'tag' column is changed only in the rows of these movies and in the cached statistics.
+        self.movie_data is replaced by a changed copy, the dataframe it was set to is not changed.
+
+        Raise the built-in ValueError exception if movie_tags is None.
+
+        :param movie_tags: pandas Series of tag strings, indexed by movieId
+        :param tag_index: the new tag index of MovieData, it replaces the one given to set_movie_data
+        :return: None
+        """
+        if movie_tags is None:
+            raise_error()
+
+        movie_data = self.movie_data
+        positions = self.movie_id_index.lookup(movie_tags.index)
+        movie_ids = movie_data['movieId'].iloc[positions]
+
+        # An index of the joined tags that has not been built yet is built from the new tags on its first use.
+        if self._joined_tag_index is not None:
+            old_tags = movie_data['tag'].iloc[positions].groupby(movie_ids.to_numpy()).first()
+            for movie_id, tag in old_tags.items():
+                self._joined_tag_index.discard_tag(movie_id, tag, words=True)
+            for movie_id, tag in movie_tags.items():
+                self._joined_tag_index.add(movie_id, tag)
+
+        self._movie_data = replace_tags(movie_data, positions, movie_ids.map(movie_tags).to_numpy())
+        if tag_index is not None and self._tag_index is not None:
+            self.tag_index = tag_index
+
+        for frame in (self.movie_statistics, self.mean_ratings):
+            if frame is not None:
+                changed = movie_tags.index.intersection(frame.index)
+                frame.loc[changed, 'tag'] = movie_tags[changed]
 
     def filter_movies_by_rating_value(self, rating: float, comp: str) -> pd.DataFrame | None:
         """
@@ -184,26 +1370,67 @@ class MovieFilter:
             raise_error()
 
         if self.mean_ratings is not None:
-            return self.mean_ratings[self.mean_ratings['genres'].str.contains(genre, case=False)]
+            return self.mean_ratings[self.mean_genre_index.mask(genre)]
         else:
-            return self.movie_data[self.movie_data['genres'].str.contains(genre, case=False)]
+            return self.movie_data[self.genre_index.mask(genre)]
 
-    def filter_movies_by_tag(self, tag: str) -> pd.DataFrame:
+    def filter_movies_by_genres(self, genres: list[str], match_all: bool = True) -> pd.DataFrame:
+        """
+        Return a pandas DataFrame of self.movie_data filtered by several genres at once.
+
+        With match_all=True only rows that have every given genre are left in the result,
+        otherwise rows that have at least one of them. Operation is case-insensitive.
+
+        Raise the built-in ValueError exception if genres is empty or any genre is an empty string or None.
+
+        :param genres: list of string values to filter by
+        :param match_all: whether to combine the genres with AND (True) or OR (False)
+        :return: pandas DataFrame object of the filtration result
+        """
+        if not genres or any(not genre or genre.strip() == "" for genre in genres):
+            raise_error()
+
+        if self.mean_ratings is not None:
+            return self.mean_ratings[self.mean_genre_index.mask_all(genres, match_all)]
+        else:
+            return self.movie_data[self.genre_index.mask_all(genres, match_all)]
+
+    def filter_movies_by_tag(self, tag: str, mode: str = 'substring') -> pd.DataFrame:
         """
         Return a pandas DataFrame of self.movie_data filtered by parameter tag.
 
         Only rows where the given tag is in column 'tag' should be left in the result.
-        Operation should be case-insensitive.
+        Operation should be case-insensitive. The tag is looked up in a tag index,
+        see TagIndex.lookup for the 'substring', 'prefix' and 'exact' modes.
+
+        The 'substring' mode tests the tag against the value of column 'tag' of every movie (its joined
+        tags) like str.contains, so the result is the same as filtering the rows with str.contains: a tag
+        can match across two tags of the movie ('e w' matches 'pixar fun will ferrell'), '^fun' matches
+        only values that start with 'fun' and the nan_placeholder matches the movies without tags.
+        The 'exact' and 'prefix' modes match single tags if the tag index of MovieData was given to
+        set_movie_data, otherwise the joined tags.
 
-        Raise the built-in ValueError exception if tag is an empty string or None.
+        Raise the built-in ValueError exception if tag is an empty string or None or mode is unknown.
 
         :param tag: string value tu filter by
+        :param mode: how to match the tag
         :return: pandas DataFrame object of the filtration result
         """
-        if not tag or tag.strip() == "":
+        if not tag or tag.strip() == "" or mode not in TAG_MATCH_MODES:
             raise_error()
 
-        return self.movie_data[self.movie_data['tag'].str.contains(tag, case=False)]
+        return self.movie_data.iloc[self.movie_id_index.lookup(self.lookup_tag(tag, mode))]
+
+    def lookup_tag(self, tag: str, mode: str = 'substring') -> set[int]:
+        """
+        Return the movieIds of the movies that filter_movies_by_tag would leave in the result.
+
+        :param tag: tag to look up
+        :param mode: 'substring', 'prefix' or 'exact'
+        :return: set of movieIds
+        """
+        tag_index = self.joined_tag_index if mode == 'substring' else self.tag_index
+        return tag_index.lookup(tag, mode)
 
     def filter_movies_by_year(self, year: int) -> pd.DataFrame:
         """
@@ -219,7 +1446,31 @@ class MovieFilter:
         if not year or year < 0:
             raise_error()
 
-        return self.movie_data[self.movie_data['title'].apply(extract_year_from_title) == year]
+        return self.movie_data.iloc[self.year_index.lookup(year, year)]
+
+    def filter_movies_by_year_range(self, start_year: int, end_year: int) -> pd.DataFrame:
+        """
+        Return a pandas DataFrame of self.movie_data released from start_year to end_year (both inclusive).
+
+        Raise the built-in ValueError exception if either year is None or < 0 or if start_year > end_year.
+
+        :param start_year: integer value of the first year to include
+        :param end_year: integer value of the last year to include
+        :return: pandas DataFrame object of the filtration result
+        """
+        if start_year is None or end_year is None or start_year < 0 or start_year > end_year:
+            raise_error()
+
+        return self.movie_data.iloc[self.year_index.lookup(start_year, end_year)]
+
+    def query(self, per_movie: bool = False) -> MovieQuery:
+        """
+        Return a lazy query over self.movie_data, or over the mean rating of every movie if per_movie is True.
+
+        :param per_movie: whether to query calculate_mean_rating_for_every_movie() instead of the rows
+        :return: MovieQuery object, run it with collect()
+        """
+        return MovieQuery(self, per_movie)
 
     def get_decent_movies(self) -> pd.DataFrame:
         """
@@ -235,8 +1486,7 @@ class MovieFilter:
 
         :return: pandas DataFrame object of the search result
         """
-        return self.movie_data[(self.movie_data['genres'].str.contains('comedy'))
-                               & (self.movie_data['rating'] >= 3.0)]
+        return self.movie_data[self.genre_index.mask('comedy') & (self.movie_data['rating'] >= 3.0)]
 
     def get_decent_children_movies(self) -> pd.DataFrame | None:
         """
@@ -244,8 +1494,7 @@ class MovieFilter:
 
         :return: pandas DataFrame object of the search result
         """
-        return self.movie_data[(self.movie_data['genres'].str.contains('children'))
-                               & (self.movie_data['rating'] >= 3.0)]
+        return self.movie_data[self.genre_index.mask('children') & (self.movie_data['rating'] >= 3.0)]
 
     # Start of OP methods.
 
@@ -265,13 +1514,25 @@ class MovieFilter:
         """
         return self.average_rating
 
-    def calculate_rating_statistics(self):
+    def calculate_rating_statistics(self, streaming: bool = False):
         """
         Calculate median and average ratings for all entries in self.movie_data, rounded to three decimal places.
 
         Store results in self.median_rating and self.average_rating
+        With streaming=True the ratings are counted once into a RatingHistogram (self.rating_histogram),
+        which needs no sorted copy of the ratings and keeps both values up to date in append_movie_data.
+
+        :param streaming: whether to calculate from the rating histogram
         :return:
         """
+        if streaming:
+            if self.rating_histogram is None:
+                self.rating_histogram = RatingHistogram()
+                self.rating_histogram.update(self.movie_data['rating'])
+            self.median_rating = round(self.rating_histogram.get_median(), 3)
+            self.average_rating = round(self.rating_histogram.get_mean(), 3)
+            return
+
         valid_ratings = self.movie_data['rating'].dropna()
 
         self.median_rating = round(valid_ratings.median(), 3)
@@ -298,6 +1559,40 @@ class MovieFilter:
 
         return filtered_movies
 
+    def get_movie_rating_statistics(self) -> pd.DataFrame:
+        """
+        Return rating statistics for every movie in self.movie_data.
+
+        The statistics are calculated with a single groupby on first use and cached until
+        set_movie_data is called again. There is one line per unique movie (indexed by movieId)
+        with columns 'title', 'genres', 'tag', 'count', 'sum', 'mean' and 'median' of the ratings.
+        The result is a copy, changing it does not change the cache.
+
+        :return: pandas DataFrame object
+        """
+        return self.get_cached_movie_statistics().copy()
+
+    def get_cached_movie_statistics(self) -> pd.DataFrame:
+        """Return the cached statistics of get_movie_rating_statistics() themselves, they must not be changed."""
+        if self.stale_median_ids and self.movie_statistics is not None:
+            rows = self.movie_data.iloc[self.movie_id_index.lookup(self.stale_median_ids)]
+            medians = rows.groupby('movieId')['rating'].median()
+            self.movie_statistics.loc[medians.index, 'median'] = medians
+            self.stale_median_ids = set()
+
+        if self.movie_statistics is None:
+            self.movie_statistics = self.movie_data.groupby('movieId').agg(title=('title', 'first'),
+                                                                           genres=('genres', 'first'),
+                                                                           tag=('tag', 'first'),
+                                                                           count=('rating', 'count'),
+                                                                           sum=('rating', 'sum'),
+                                                                           mean=('rating', 'mean'),
+                                                                           median=('rating', 'median'))
+            # Running sums stay exact for appended ratings also with float32 ratings.
+            self.movie_statistics['sum'] = self.movie_statistics['sum'].astype('float64')
+
+        return self.movie_statistics
+
     def calculate_mean_rating_for_every_movie(self) -> pd.DataFrame:
         """Return a new DataFrame.
 
@@ -305,13 +1600,26 @@ class MovieFilter:
         mean rating of all the individual ratings for that movie in self.movie_data, rounded to three decimal places.
         If the mean rating value is NaN, it should be dropped from the result.
 
+        The result is built from the cached per-movie statistics and kept until set_movie_data is called again.
+        The result is a copy, changing it does not change the cache.
+
         :return: pandas DataFrame object
         """
-        # Grouping by 'movieId' and calculating mean rating.
-        mean_ratings = self.movie_data.groupby('movieId').agg({'title': 'first',
-                                                               'genres': 'first',
-                                                               'rating': 'mean',
-                                                               'tag': 'first'})
+        return self.get_cached_mean_ratings().copy()
+
+    def get_cached_mean_ratings(self) -> pd.DataFrame:
+        """
+        Return the cached result of calculate_mean_rating_for_every_movie() itself, it must not be changed.
+
+        self.mean_year_index and self.mean_genre_index index its rows.
+        """
+        if self.mean_ratings is not None:
+            return self.mean_ratings
+
+        # Medians are not needed here, so stale medians are not recalculated.
+        statistics = (self.movie_statistics if self.movie_statistics is not None
+                      else self.get_cached_movie_statistics())
+        mean_ratings = statistics[['title', 'genres', 'mean', 'tag']].rename(columns={'mean': 'rating'})
 
         # Dropping rows with NaN values.
         mean_ratings = mean_ratings.dropna(subset=['rating'])
@@ -319,6 +1627,8 @@ class MovieFilter:
         # Round to 3 decimal places.
         mean_ratings['rating'] = round(mean_ratings['rating'], 3)
         self.mean_ratings = mean_ratings
+        self.mean_year_index = YearIndex(extract_years(mean_ratings['title']))
+        self.mean_genre_index = GenreIndex(mean_ratings['genres'])
 
         return mean_ratings
 
@@ -327,6 +1637,7 @@ class MovieFilter:
         Return the top n best rated movies with the given genre. Search is case-insensitive.
 
         If genre is an empty string or None of if n is negative, a ValueError should be raised.
+        Movies with the same rating are in the order of calculate_mean_rating_for_every_movie.
 
         :param genre: string value to filter by
         :param n: number of best rated movies to include in the result
@@ -335,12 +1646,72 @@ class MovieFilter:
         if not genre or genre is None or n < 0:
             raise_error()
 
-        self.calculate_mean_rating_for_every_movie()
+        self.get_cached_mean_ratings()
         filtered_movies = self.filter_movies_by_genre(genre)
-        top_genre_movies = filtered_movies.sort_values(by='rating', ascending=False).head(n)
+        top_genre_movies = filtered_movies.sort_values(by='rating', ascending=False, kind='stable').head(n)
 
         return top_genre_movies
 
+    def top_movies_for_all_genres(self, n: int = 3, workers: int | None = None) -> dict[str, pd.DataFrame]:
+        """
+        Return the top n best rated movies of every genre at once.
+
+        The result is the same as calling get_top_movies_by_genre for every single genre, but the
+        mean ratings are sorted only once and every genre takes its first n movies of that order
+        with its genre bitmask.
+        With workers > 1 the genres are split between that many processes instead, which read the
+        ratings and genre masks from shared memory.
+
+        If n is None or negative, a ValueError should be raised.
+
+        :param n: number of best rated movies to include for every genre
+        :param workers: number of worker processes, None for the single grouped pass
+        :return: dictionary of genre -> pandas DataFrame object of the search result
+        """
+        if n is None or n < 0:
+            raise_error()
+
+        mean_ratings = self.get_cached_mean_ratings()
+        genre_index = self.mean_genre_index
+
+        ratings = mean_ratings['rating'].to_numpy(dtype=np.float64)
+        masks = genre_index.masks
+
+        if masks is None:
+            by_genre = (mean_ratings.assign(genre=mean_ratings['genres'].astype(str).str.split('|'))
+                        .explode('genre')
+                        .sort_values(by='rating', ascending=False, kind='stable')
+                        .groupby('genre', sort=False).head(n))
+            return {genre: by_genre[by_genre['genre'] == genre].drop(columns='genre')
+                    for genre in genre_index.genre_bits}
+
+        if not workers or workers < 2:
+            order = np.argsort(-ratings, kind='stable')
+            sorted_masks = masks[order]
+            return {genre: mean_ratings.iloc[order[np.flatnonzero((sorted_masks & np.uint64(bits)) != 0)[:n]]]
+                    for genre, bits in genre_index.genre_bits.items()}
+        ratings_memory = shared_memory.SharedMemory(create=True, size=max(ratings.nbytes, 1))
+        masks_memory = shared_memory.SharedMemory(create=True, size=max(masks.nbytes, 1))
+        try:
+            np.ndarray(ratings.shape, dtype=np.float64, buffer=ratings_memory.buf)[:] = ratings
+            np.ndarray(masks.shape, dtype=np.uint64, buffer=masks_memory.buf)[:] = masks
+
+            genres = list(genre_index.genre_bits.items())
+            shards = [dict(genres[i::workers]) for i in range(workers) if genres[i::workers]]
+            with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+                futures = [executor.submit(find_top_positions_in_shared_memory, ratings_memory.name,
+                                           masks_memory.name, len(ratings), shard, n) for shard in shards]
+                positions = {}
+                for future in futures:
+                    positions.update(future.result())
+        finally:
+            ratings_memory.close()
+            ratings_memory.unlink()
+            masks_memory.close()
+            masks_memory.unlink()
+
+        return {genre: mean_ratings.iloc[positions[genre]] for genre in genre_index.genre_bits}
+
     def get_best_movie_by_year_genre_and_tag(self, year: int, genre: str, tag: str) -> pd.DataFrame:
         """
         Return the best rated movie with given year of release, genre and tag. Search is case-insensitive.
@@ -356,14 +1727,14 @@ class MovieFilter:
         if year <= 0 or not genre or genre is None or not tag or tag is None:
             raise_error()
 
-        unique_movies = self.calculate_mean_rating_for_every_movie()
+        unique_movies = self.get_cached_mean_ratings()
 
         # Filter movies by year, genre, and tag
-        filtered_movies_by_year = unique_movies[unique_movies['title'].apply(extract_year_from_title) == year]
-        filtered_movies_by_year_genre = filtered_movies_by_year[
-            filtered_movies_by_year['genres'].str.contains(genre, case=False)]
+        year_positions = self.mean_year_index.lookup(year, year)
+        year_positions = year_positions[self.mean_genre_index.mask(genre)[year_positions]]
+        filtered_movies_by_year_genre = unique_movies.iloc[year_positions]
         filtered_movies = filtered_movies_by_year_genre[
-            filtered_movies_by_year_genre['tag'].str.contains(tag, case=False)]
+            filtered_movies_by_year_genre.index.isin(self.lookup_tag(tag))]
 
         top_movie = filtered_movies.nlargest(1, 'rating')
         return top_movie
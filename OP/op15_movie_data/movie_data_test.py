@@ -0,0 +1,308 @@
+"""Movie data tests, appended ratings and tags against a full rebuild."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from movie_data import MovieData, MovieFilter, RatingHistogram, get_cache_filename, read_csv_cached
+
+MOVIES = pd.DataFrame({
+    'movieId': [1, 2, 3, 4, 5, 6],
+    'title': ["Toy Story (1995)", "Jumanji (1995)", "Heat (1995)", "Fargo (1996)", "Scream (1996)",
+              "Titanic (1997)"],
+    'genres': ["Adventure|Animation|Children|Comedy", "Adventure|Children|Fantasy", "Action|Crime|Thriller",
+               "Comedy|Crime|Drama", "Horror|Mystery", "Drama|Romance"],
+})
+
+RATINGS = pd.DataFrame({
+    'userId': [1, 2, 3, 1, 2, 1, 3, 2, 1, 2, 3, 4, 4, 5, 5, 5],
+    'movieId': [1, 1, 2, 4, 4, 5, 1, 2, 3, 3, 4, 1, 6, 5, 3, 7],
+    'rating': [4.0, 5.0, 3.0, 4.5, 2.0, 1.0, 3.5, 4.0, 5.0, 2.5, 4.0, 0.5, 3.0, 4.5, 4.0, 5.0],
+    'timestamp': range(16),
+})
+
+TAGS = pd.DataFrame({
+    'userId': [1, 2, 1, 3, 2, 4, 5, 5],
+    'movieId': [1, 1, 4, 2, 6, 3, 1, 5],
+    'tag': ["pixar", "fun", "dark comedy", "board game", "sad", "pacino", "will ferrell", "slasher"],
+    'timestamp': range(8),
+})
+
+BASE_RATINGS = 6
+BASE_TAGS = 4
+
+
+def load_movie_data(directory, ratings: pd.DataFrame, tags: pd.DataFrame) -> MovieData:
+    """Write the data into csv files and load it with the aggregate dataframe created."""
+    MOVIES.to_csv(directory / "movies.csv", index=False)
+    ratings.to_csv(directory / "ratings.csv", index=False)
+    tags.to_csv(directory / "tags.csv", index=False)
+    movie_data = MovieData()
+    movie_data.load_data(str(directory / "movies.csv"), str(directory / "ratings.csv"), str(directory / "tags.csv"))
+    movie_data.create_aggregate_movie_dataframe("empty")
+    return movie_data
+
+
+def make_filter(movie_data: MovieData) -> MovieFilter:
+    """Return a movie filter on the aggregate dataframe of the movie data with the mean ratings calculated."""
+    movie_filter = MovieFilter()
+    movie_filter.set_movie_data(movie_data.get_aggregate_movie_dataframe(), movie_data.get_tag_index())
+    movie_filter.get_movie_rating_statistics()
+    movie_filter.calculate_mean_rating_for_every_movie()
+    return movie_filter
+
+
+def append_in_batches(tmp_path):
+    """Load the first ratings and tags, append the rest in batches and return the data and a full rebuild."""
+    (tmp_path / "full").mkdir()
+    (tmp_path / "appended").mkdir()
+    full = load_movie_data(tmp_path / "full", RATINGS, TAGS)
+    appended = load_movie_data(tmp_path / "appended", RATINGS[:BASE_RATINGS], TAGS[:BASE_TAGS])
+    movie_filter = make_filter(appended)
+
+    for start, end in [(BASE_RATINGS, 9), (9, 13), (13, len(RATINGS))]:
+        movie_filter.append_movie_data(appended.append_ratings(RATINGS[start:end]))
+    for start, end in [(BASE_TAGS, 6), (6, len(TAGS))]:
+        appended.append_tags(TAGS[start:end], movie_filter)
+    return appended, movie_filter, full, make_filter(full)
+
+
+def normalize(movie_data: pd.DataFrame) -> pd.DataFrame:
+    """Return the rows in the same order with the same index so that they can be compared."""
+    return movie_data.sort_values(['movieId', 'rating', 'tag'], kind='stable').reset_index(drop=True)
+
+
+def test__append_ratings_first_rating_of_unrated_movie(tmp_path):
+    """Test that the placeholder line of a movie is dropped when it gets its first rating."""
+    movie_data = load_movie_data(tmp_path, RATINGS[:BASE_RATINGS], TAGS)
+    assert movie_data.get_aggregate_movie_dataframe()['movieId'].tolist().count(3) == 1
+    movie_data.append_ratings(RATINGS[BASE_RATINGS:9])
+    aggregate = movie_data.get_aggregate_movie_dataframe()
+    assert aggregate.loc[aggregate['movieId'] == 3, 'rating'].tolist() == [5.0]
+    assert aggregate.index.is_unique
+
+
+def test__append_ratings_unknown_movie_left_out(tmp_path):
+    """Test that ratings of movies that are not in the movies file are left out."""
+    movie_data = load_movie_data(tmp_path, RATINGS[:BASE_RATINGS], TAGS)
+    assert movie_data.append_ratings(RATINGS[-1:]).empty
+
+
+def test__append_aggregate_same_as_full_rebuild(tmp_path):
+    """Test the aggregate dataframe and the filter rows after appending in batches."""
+    appended, movie_filter, full, full_filter = append_in_batches(tmp_path)
+    assert normalize(appended.get_aggregate_movie_dataframe()).equals(normalize(full.get_aggregate_movie_dataframe()))
+    assert normalize(movie_filter.movie_data).equals(normalize(full_filter.movie_data))
+    assert appended.get_aggregate_movie_dataframe().index.is_unique
+    assert movie_filter.movie_data.index.is_unique
+
+
+def test__append_statistics_same_as_full_rebuild(tmp_path):
+    """Test the rating statistics and the mean ratings after appending in batches."""
+    _, movie_filter, _, full_filter = append_in_batches(tmp_path)
+    statistics = movie_filter.get_movie_rating_statistics().sort_index()
+    expected = full_filter.get_movie_rating_statistics().sort_index()
+    assert statistics.index.tolist() == expected.index.tolist()
+    assert statistics['count'].tolist() == expected['count'].tolist()
+    assert np.allclose(statistics['mean'], expected['mean'], equal_nan=True)
+    assert np.allclose(statistics['median'], expected['median'], equal_nan=True)
+    assert statistics['tag'].tolist() == expected['tag'].tolist()
+    mean_ratings = movie_filter.calculate_mean_rating_for_every_movie().sort_index()
+    assert mean_ratings.equals(full_filter.calculate_mean_rating_for_every_movie().sort_index())
+
+
+def test__append_filters_same_as_full_rebuild(tmp_path):
+    """Test the tag, year and genre filters after appending in batches."""
+    _, movie_filter, _, full_filter = append_in_batches(tmp_path)
+    for tag, mode in [("pixar", 'substring'), ("will f", 'substring'), ("slasher", 'exact'), ("sa", 'prefix'),
+                      ("empty", 'substring')]:
+        assert normalize(movie_filter.filter_movies_by_tag(tag, mode)).equals(
+            normalize(full_filter.filter_movies_by_tag(tag, mode)))
+    for year in [1995, 1996, 1997]:
+        assert normalize(movie_filter.filter_movies_by_year(year)).equals(
+            normalize(full_filter.filter_movies_by_year(year)))
+    assert normalize(movie_filter.filter_movies_by_year_range(1995, 1996)).equals(
+        normalize(full_filter.filter_movies_by_year_range(1995, 1996)))
+    assert normalize(movie_filter.filter_movies_by_genre("comedy")).equals(
+        normalize(full_filter.filter_movies_by_genre("comedy")))
+
+
+def test__filter_movies_by_tag_substring_matches_joined_tags(tmp_path):
+    """Test that a substring can span two tags of a movie and that the nan_placeholder matches, with both indexes."""
+    movie_data = load_movie_data(tmp_path, RATINGS, TAGS[:BASE_TAGS])
+    aggregate = movie_data.get_aggregate_movie_dataframe()
+    for tag_index in (None, movie_data.get_tag_index()):
+        movie_filter = MovieFilter()
+        movie_filter.set_movie_data(aggregate, tag_index)
+        for tag in ["r fu", "x f", "empty", "PIXAR"]:
+            expected = aggregate[aggregate['tag'].str.contains(tag, case=False)]
+            assert normalize(movie_filter.filter_movies_by_tag(tag)).equals(normalize(expected))
+        assert set(movie_filter.filter_movies_by_tag("empty")['movieId']) == {3, 5, 6}
+
+
+def test__filter_movies_by_tag_exact_single_tag(tmp_path):
+    """Test that the exact mode matches a single tag of a movie only with the tag index of MovieData."""
+    movie_data = load_movie_data(tmp_path, RATINGS, TAGS)
+    movie_filter = MovieFilter()
+    movie_filter.set_movie_data(movie_data.get_aggregate_movie_dataframe(), movie_data.get_tag_index())
+    assert set(movie_filter.filter_movies_by_tag("fun", 'exact')['movieId']) == {1}
+    movie_filter.set_movie_data(movie_data.get_aggregate_movie_dataframe())
+    assert movie_filter.filter_movies_by_tag("fun", 'exact').empty
+
+
+def test__read_csv_cached_cache_not_written(tmp_path, monkeypatch):
+    """Test that the csv data is returned and no cache is left when the cache can not be written."""
+    def fail(*args, **kwargs):
+        raise OSError("No space left on device")
+
+    filename = str(tmp_path / "ratings.csv")
+    RATINGS.to_csv(filename, index=False)
+    monkeypatch.setattr(pd.DataFrame, 'to_feather', fail)
+    assert read_csv_cached(filename, cache_format='feather').equals(pd.read_csv(filename))
+    assert [path.name for path in tmp_path.iterdir()] == ["ratings.csv"]
+    monkeypatch.undo()
+    read_csv_cached(filename, cache_format='feather')
+    assert os.path.exists(get_cache_filename(filename, 'feather', False))
+    assert read_csv_cached(filename, cache_format='feather').equals(pd.read_csv(filename))
+
+
+def test__top_movies_for_all_genres_same_as_get_top_movies_by_genre(tmp_path):
+    """Test that every genre gets the same movies in the same order, including movies with the same rating."""
+    ratings = RATINGS.assign(rating=4.0)
+    movie_filter = make_filter(load_movie_data(tmp_path, ratings, TAGS))
+    for n in [0, 1, 2, 6]:
+        for workers in [None, 2]:
+            top_movies = movie_filter.top_movies_for_all_genres(n, workers)
+            for genre, movies in top_movies.items():
+                assert movies.equals(movie_filter.get_top_movies_by_genre(genre, n))
+
+
+def test__calculate_mean_rating_for_every_movie_returns_copy(tmp_path):
+    """Test that changing the returned mean ratings or statistics does not change the cached ones."""
+    movie_filter = make_filter(load_movie_data(tmp_path, RATINGS, TAGS))
+    expected = movie_filter.get_top_movies_by_genre("comedy", 3)
+    mean_ratings = movie_filter.calculate_mean_rating_for_every_movie()
+    mean_ratings.drop(mean_ratings.index[:3], inplace=True)
+    mean_ratings['rating'] = 0.0
+    statistics = movie_filter.get_movie_rating_statistics()
+    statistics['mean'] = 0.0
+    assert movie_filter.get_top_movies_by_genre("comedy", 3).equals(expected)
+    assert len(movie_filter.calculate_mean_rating_for_every_movie()) == 6
+    assert movie_filter.get_movie_rating_statistics()['mean'].max() > 0
+
+
+def test__movie_data_assigned_directly(tmp_path):
+    """Test the filters when movie_data is assigned instead of set with set_movie_data."""
+    aggregate = load_movie_data(tmp_path, RATINGS, TAGS).get_aggregate_movie_dataframe()
+    movie_filter = MovieFilter()
+    movie_filter.movie_data = aggregate
+    assert normalize(movie_filter.filter_movies_by_year(1995)).equals(
+        normalize(aggregate[aggregate['title'].str.contains("(1995)", regex=False)]))
+    assert len(movie_filter.filter_movies_by_year_range(1996, 1997)) == (aggregate['movieId'] >= 4).sum()
+    assert len(movie_filter.calculate_mean_rating_for_every_movie()) == 6
+    assert set(movie_filter.filter_movies_by_genre("crime").index) == {3, 4}
+    movie_filter.movie_data = aggregate[aggregate['movieId'] != 1]
+    assert movie_filter.get_decent_comedy_movies()['movieId'].unique().tolist() == [4]
+    assert set(movie_filter.get_decent_children_movies()['movieId']) == {2}
+    assert movie_filter.filter_movies_by_tag("game")['movieId'].unique().tolist() == [2]
+    assert movie_filter.filter_movies_by_tag("pixar").empty
+    assert movie_filter.filter_movies_by_tag("dark comedy", 'exact')['movieId'].unique().tolist() == [4]
+    assert movie_filter.filter_movies_by_year(1995)['movieId'].unique().tolist() == [2, 3]
+    assert len(movie_filter.calculate_mean_rating_for_every_movie()) == 5
+
+
+def test__filter_movies_by_tag_substring_same_as_str_contains(tmp_path):
+    """Test patterns against a multi-word tag and joined tags: each movie's tag value is matched as a whole."""
+    movie_data = load_movie_data(tmp_path, RATINGS, TAGS[:BASE_TAGS])
+    aggregate = movie_data.get_aggregate_movie_dataframe()
+    for tag_index in (None, movie_data.get_tag_index()):
+        movie_filter = MovieFilter()
+        movie_filter.set_movie_data(aggregate, tag_index)
+        for tag in ["^fun", "^dark", "^comedy", "comedy$", "k c", "DARK COMEDY", "^board game$", "r f"]:
+            expected = aggregate[aggregate['tag'].str.contains(tag, case=False)]
+            assert normalize(movie_filter.filter_movies_by_tag(tag)).equals(normalize(expected))
+        assert movie_filter.filter_movies_by_tag("^fun").empty
+        assert movie_filter.filter_movies_by_tag("^comedy").empty
+        assert movie_filter.filter_movies_by_tag("^dark")['movieId'].unique().tolist() == [4]
+
+
+def test__append_tags_then_query_by_tag(tmp_path):
+    """Test tag queries right after append_tags, with the filter given to it and with a filter that was not."""
+    (tmp_path / "full").mkdir()
+    full_filter = make_filter(load_movie_data(tmp_path / "full", RATINGS, TAGS))
+    movie_data = load_movie_data(tmp_path, RATINGS, TAGS[:BASE_TAGS])
+    aggregate = movie_data.get_aggregate_movie_dataframe()
+    old_tags = aggregate['tag'].copy()
+    movie_filter = make_filter(movie_data)
+    other_filter = make_filter(movie_data)
+
+    movie_data.append_tags(TAGS[BASE_TAGS:], movie_filter)
+    for tag, mode in [("sad", 'substring'), ("will f", 'substring'), ("empty", 'substring'), ("pixar", 'exact'),
+                      ("slasher", 'exact'), ("pac", 'prefix')]:
+        assert normalize(movie_filter.filter_movies_by_tag(tag, mode)).equals(
+            normalize(full_filter.filter_movies_by_tag(tag, mode)))
+    assert movie_filter.filter_movies_by_tag("sad")['movieId'].unique().tolist() == [6]
+
+    # The filter that was not given keeps answering from its own rows.
+    assert aggregate['tag'].equals(old_tags)
+    assert other_filter.movie_data['tag'].equals(old_tags)
+    assert other_filter.filter_movies_by_tag("sad").empty
+    assert other_filter.filter_movies_by_tag("slasher", 'exact').empty
+    assert set(other_filter.filter_movies_by_tag("empty")['movieId']) == {3, 5, 6}
+
+
+def test__rating_histogram_same_as_pandas():
+    """Test the count, mean, median and percentiles against pandas, NaN values are skipped."""
+    ratings = pd.Series([4.0, 5.0, np.nan, 3.0, 4.5, 0.5, 2.0, 4.0, np.nan, 3.5])
+    histogram = RatingHistogram()
+    histogram.update(ratings)
+    assert histogram.get_count() == 8
+    assert np.isclose(histogram.get_mean(), ratings.mean())
+    assert histogram.get_median() == ratings.median()
+    for percent in [0, 10, 25, 33, 75, 90, 100]:
+        assert np.isclose(histogram.get_percentile(percent), ratings.quantile(percent / 100))
+
+
+def test__rating_histogram_merge_and_empty():
+    """Test that merged histograms count the ratings of both and that an empty histogram has no values."""
+    first, second, both = RatingHistogram(), RatingHistogram(), RatingHistogram()
+    first.update([1.0, 2.5, 5.0])
+    second.update([2.5, 4.0])
+    both.update([1.0, 2.5, 5.0, 2.5, 4.0])
+    merged = first.merge(second)
+    assert merged.counts.tolist() == both.counts.tolist()
+    assert first.get_count() == 3
+    assert RatingHistogram().get_mean() is None
+    assert RatingHistogram().get_median() is None
+
+
+def test__rating_histogram_invalid_values():
+    """Test that ratings off the scale and percentiles outside 0 to 100 raise and leave the counts unchanged."""
+    histogram = RatingHistogram()
+    histogram.update([3.0])
+    for ratings in [[4.0, 4.25], [0.0], [5.5], [-1.0]]:
+        with pytest.raises(ValueError):
+            histogram.update(ratings)
+        assert histogram.get_count() == 1
+    for percent in [-1, 101, None]:
+        with pytest.raises(ValueError):
+            histogram.get_percentile(percent)
+
+
+def test__append_movie_data_off_scale_rating_changes_nothing(tmp_path):
+    """Test that an appended rating off the histogram's scale raises before the filter is changed."""
+    movie_data = load_movie_data(tmp_path, RATINGS[:BASE_RATINGS], TAGS)
+    movie_filter = make_filter(movie_data)
+    movie_filter.calculate_rating_statistics(streaming=True)
+    median, average = movie_filter.median_rating, movie_filter.average_rating
+    rows_before = normalize(movie_filter.movie_data)
+    rows = movie_data.append_ratings(RATINGS[BASE_RATINGS:9]).copy()
+    rows['rating'] = rows['rating'] + 0.1
+
+    with pytest.raises(ValueError):
+        movie_filter.append_movie_data(rows)
+    assert normalize(movie_filter.movie_data).equals(rows_before)
+    assert movie_filter.rating_histogram.get_count() == BASE_RATINGS
+    assert (movie_filter.median_rating, movie_filter.average_rating) == (median, average)
+    assert movie_filter.get_movie_rating_statistics()['count'].sum() == BASE_RATINGS